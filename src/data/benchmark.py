@@ -0,0 +1,715 @@
+'''
+Benchmarks for the data pipeline.
+
+Run from the src folder, e.g.:
+    python -m data.benchmark preprocess --samples 500000
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import tifffile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple
+
+from scipy.stats import zscore
+
+from data.dataset_handler import DatasetHandler
+from data.label_alignment import label_dataset
+from data.montage import CYTON_MONTAGE
+from data.ring_buffer import RingBuffer
+from data.session_recorder import SessionRecorder, SessionLog
+from data.normalization import RunningNormalizer
+
+
+def make_synthetic_dataset(num_samples: int, classes: Iterable[str]=("Move", "Relax"), num_channels: int=8, seed: int=0) -> pd.DataFrame:
+    '''
+    Create a synthetic merged dataset with the same layout as merged_dataset.csv.
+
+    args:
+        num_samples (int): The number of samples.
+        classes (Iterable[str]): The classes, assigned in consecutive blocks.
+        num_channels (int): The number of EEG channels.
+        seed (int): The random seed.
+
+    returns:
+        pd.DataFrame: Channel columns followed by 'Timestamp' and 'Class'.
+    '''
+    rng = np.random.default_rng(seed)
+    classes = list(classes)
+    df = pd.DataFrame(rng.normal(scale=50.0, size=(num_samples, num_channels)),
+                      columns=[f'Channel {n}' for n in range(1, num_channels+1)])
+    df['Timestamp'] = 1.7e9 + np.arange(num_samples) / 250.0
+    df['Class'] = np.array(classes)[(np.arange(num_samples) * len(classes) * 4 // num_samples) % len(classes)]
+    return df
+
+
+def legacy_oneill_windows(handler: DatasetHandler, df: pd.DataFrame, window_size: int, overlap: float) -> List[np.ndarray]:
+    '''
+    The original row-wise O'Neill preprocessing, kept in memory instead of written to disk.
+
+    args:
+        handler (DatasetHandler): The dataset handler.
+        df (pd.DataFrame): The dataset as a DataFrame.
+        window_size (int): The size of the window.
+        overlap (float): The overlap between windows.
+
+    returns:
+        List[np.ndarray]: The normalized windows, class after class.
+    '''
+    images = []
+    for _class in df['Class'].unique().tolist():
+        class_df = df[df['Class'] == _class].copy()
+        class_df['Spatial Matrix'] = class_df.apply(handler.get_spatial_matrix, axis=1)
+        step_size = int(np.floor(window_size * (1-overlap)))
+        for n in range(0, len(class_df), step_size):
+            image = np.stack(class_df['Spatial Matrix'].iloc[n: n+window_size])
+            if len(image) != window_size:
+                continue
+            normalized_image = zscore(image, axis=0)
+            np.nan_to_num(normalized_image, copy=False, nan=0.0)
+            images.append(normalized_image)
+    return images
+
+
+def benchmark_preprocess(num_samples: int=100000, window_size: int=64, overlap: float=0.25) -> None:
+    '''
+    Compare the samples/sec of the row-wise and the vectorized O'Neill preprocessing.
+
+    args:
+        num_samples (int): The number of samples in the synthetic dataset.
+        window_size (int): The size of the window.
+        overlap (float): The overlap between windows.
+    '''
+    handler = DatasetHandler()
+    df = make_synthetic_dataset(num_samples)
+
+    start_time = time.perf_counter()
+    legacy_images = legacy_oneill_windows(handler, df, window_size, overlap)
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    vectorized_images = []
+    for _class in df['Class'].unique().tolist():
+        windows = handler.get_oneill_windows(df[df['Class'] == _class], window_size, overlap)
+        vectorized_images.extend(handler.normalize_windows(windows))
+    vectorized_time = time.perf_counter() - start_time
+
+    identical = len(legacy_images) == len(vectorized_images) and all(np.array_equal(a, b) for a, b in zip(legacy_images, vectorized_images))
+    print(f"Windows: {len(vectorized_images)} (bit-for-bit identical: {identical})")
+    print(f"Row-wise:   {num_samples / legacy_time:12,.0f} samples/sec ({legacy_time:.2f} s)")
+    print(f"Vectorized: {num_samples / vectorized_time:12,.0f} samples/sec ({vectorized_time:.2f} s)")
+    print(f"Speedup:    {legacy_time / vectorized_time:.1f}x")
+
+
+def get_disk_usage(path: str) -> Tuple[int, int]:
+    '''
+    Get the logical size and the allocated size of a file or folder.
+
+    args:
+        path (str): Path to the file or folder.
+
+    returns:
+        Tuple[int, int]: The logical size and the allocated size in bytes.
+    '''
+    file_paths = [path] if os.path.isfile(path) else [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    stats = [os.stat(file_path) for file_path in file_paths]
+    logical_size = sum(stat.st_size for stat in stats)
+    allocated_size = sum(getattr(stat, 'st_blocks', 0) * 512 or stat.st_size for stat in stats)
+    return logical_size, allocated_size
+
+
+def benchmark_packed(num_samples: int=100000, window_size: int=64, overlap: float=0.25) -> None:
+    '''
+    Compare the load time and disk usage of the TIFF folder layout and the packed dataset format.
+
+    args:
+        num_samples (int): The number of samples in the synthetic dataset.
+        window_size (int): The size of the window.
+        overlap (float): The overlap between windows.
+    '''
+    handler = DatasetHandler()
+    df = make_synthetic_dataset(num_samples)
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        tiff_dir = handler.preprocess_oneill(df, window_size, overlap, os.path.join(work_dir, "tiff"))
+        start_time = time.perf_counter()
+        packed_path = handler.convert_tiff_to_packed(tiff_dir, os.path.join(work_dir, "dataset.smmr"))
+        print(f"Conversion: {time.perf_counter() - start_time:.2f} s")
+
+        start_time = time.perf_counter()
+        tiff_images, tiff_labels = handler.load_tiff_data(tiff_dir)
+        tiff_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        packed_images, packed_labels = handler.load_packed_data(packed_path)
+        open_time = time.perf_counter() - start_time
+        # Touch every window to include the time spent paging the data in
+        np.asarray(packed_images).sum()
+        read_time = time.perf_counter() - start_time
+
+        identical = np.array_equal(tiff_images, packed_images) and np.array_equal(tiff_labels, packed_labels)
+        print(f"Windows: {len(packed_images)} (identical: {identical})")
+        print(f"TIFF load:   {tiff_time:8.3f} s")
+        print(f"Packed open: {open_time:8.3f} s (full read {read_time:.3f} s)")
+        for name, path in (("TIFF", tiff_dir), ("Packed", packed_path)):
+            logical_size, allocated_size = get_disk_usage(path)
+            print(f"{name} disk usage: {logical_size / 2**20:8.1f} MiB ({allocated_size / 2**20:.1f} MiB allocated)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_compact(num_samples: int=100000, window_size: int=64, overlap: float=0.25) -> None:
+    '''
+    Compare the disk and memory usage of packed datasets stored on the spatial grid and in compact (window, channels) form.
+
+    args:
+        num_samples (int): The number of samples in the synthetic dataset.
+        window_size (int): The size of the window.
+        overlap (float): The overlap between windows.
+    '''
+    handler = DatasetHandler()
+    df = make_synthetic_dataset(num_samples)
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        results = {}
+        for name, compact in (("Grid", False), ("Compact", True)):
+            start_time = time.perf_counter()
+            packed_path = handler.preprocess_oneill(df, window_size, overlap, os.path.join(work_dir, name.lower()), output_format="packed", compact=compact)
+            elapsed = time.perf_counter() - start_time
+            images, _ = handler.load_packed_data(packed_path)
+            results[name] = np.asarray(images)
+            logical_size, _ = get_disk_usage(packed_path)
+            print(f"{name:8s}: windows {images.shape[1:]}, preprocessing {elapsed:6.2f} s, "
+                  f"disk {logical_size / 2**20:8.1f} MiB, memory {results[name].nbytes / 2**20:8.1f} MiB")
+        identical = np.array_equal(CYTON_MONTAGE.expand(results["Compact"]), results["Grid"])
+        print(f"Reduction: {results['Grid'].nbytes / results['Compact'].nbytes:.1f}x (expanded compact windows identical: {identical})")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_parallel(num_recordings: int=8, num_samples: int=100000, window_size: int=64, overlap: float=0.25, output_format: str="packed") -> None:
+    '''
+    Measure how the batch preprocessing throughput scales with the number of worker processes.
+
+    args:
+        num_recordings (int): The number of synthetic recordings in the batch.
+        num_samples (int): The number of samples in each recording.
+        window_size (int): The size of the window.
+        overlap (float): The overlap between windows.
+        output_format (str): "tiff" or "packed".
+    '''
+    handler = DatasetHandler()
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        file_paths = []
+        for n in range(num_recordings):
+            file_paths.append(os.path.join(work_dir, f"recording_{n}.csv"))
+            make_synthetic_dataset(num_samples, seed=n).to_csv(file_paths[-1], index=False)
+
+        num_workers = 1
+        results = []
+        while num_workers <= (os.cpu_count() or 1):
+            store_folder = os.path.join(work_dir, f"workers_{num_workers}")
+            start_time = time.perf_counter()
+            handler.preprocess_oneill_batch(file_paths, window_size, overlap, store_folder, output_format=output_format, num_workers=num_workers)
+            results.append((num_workers, time.perf_counter() - start_time))
+            shutil.rmtree(store_folder, ignore_errors=True)
+            num_workers *= 2
+
+        for num_workers, elapsed in results:
+            print(f"{num_workers:3d} workers: {num_recordings * num_samples / elapsed:12,.0f} samples/sec ({elapsed:.2f} s, {results[0][1] / elapsed:.1f}x)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _write_synthetic_recording(file_path: str, num_samples: int) -> None:
+    '''
+    Write a synthetic recording to a CSV file.
+
+    Runs in a worker process of benchmark_streaming, so the benchmark process itself stays small.
+    '''
+    make_synthetic_dataset(num_samples).to_csv(file_path, index=False)
+
+
+def _preprocess_peak_rss(file_path: str, store_folder: str, streaming: bool) -> float:
+    '''
+    Preprocess a recording and return the peak resident memory of the process in MiB.
+
+    Runs in a fresh worker process of benchmark_streaming.
+    '''
+    import resource
+
+    handler = DatasetHandler()
+    if streaming:
+        handler.preprocess_oneill_streaming(file_path, 64, 0.25, store_folder, output_format="packed")
+    else:
+        df = handler.load_csv_as_dataframe(file_path)
+        handler.preprocess_oneill(df, 64, 0.25, store_folder, output_format="packed")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_streaming(sample_counts: Iterable[int]=(100000, 200000, 400000)) -> None:
+    '''
+    Compare the peak memory of in-memory and chunked preprocessing for recordings of increasing length.
+
+    args:
+        sample_counts (Iterable[int]): The number of samples of each synthetic recording.
+    '''
+    # Linux keeps the peak memory of the parent in children, so every step runs in a fresh child of a small parent
+    def run_in_child(function, *args):
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+            return executor.submit(function, *args).result()
+
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        for num_samples in sample_counts:
+            file_path = os.path.join(work_dir, f"recording_{num_samples}.csv")
+            run_in_child(_write_synthetic_recording, file_path, num_samples)
+            peak_rss = {}
+            for streaming in (False, True):
+                peak_rss[streaming] = run_in_child(_preprocess_peak_rss, file_path, os.path.join(work_dir, f"out_{streaming}"), streaming)
+                shutil.rmtree(os.path.join(work_dir, f"out_{streaming}"), ignore_errors=True)
+            print(f"{num_samples:10,d} samples ({os.path.getsize(file_path) / 2**20:7.1f} MiB CSV): "
+                  f"in-memory peak RSS {peak_rss[False]:7.1f} MiB, streaming peak RSS {peak_rss[True]:7.1f} MiB")
+            os.remove(file_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def legacy_load_tiff_data(data_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    The original sequential TIFF loader, which appends to a list and then copies it into an array.
+
+    args:
+        data_dir (str): The directory containing the TIFF files.
+
+    returns:
+        Tuple[np.ndarray, np.ndarray]: The images and their labels.
+    '''
+    images = []
+    labels = []
+    class_names = os.listdir(data_dir)
+    for class_name in class_names:
+        class_dir = os.path.join(data_dir, class_name)
+        for file_name in os.listdir(class_dir):
+            with tifffile.TiffFile(os.path.join(class_dir, file_name)) as tif:
+                images.append(tif.asarray())
+                labels.append(class_name)
+    label_map = {name: i for i, name in enumerate(class_names)}
+    return np.array(images), np.array([label_map[label] for label in labels])
+
+
+def benchmark_tiff_load(num_samples: int=100000, window_size: int=64, overlap: float=0.25) -> None:
+    '''
+    Compare the load time and peak memory of the sequential and the parallel, preallocated TIFF loaders.
+
+    args:
+        num_samples (int): The number of samples in the synthetic dataset.
+        window_size (int): The size of the window.
+        overlap (float): The overlap between windows.
+    '''
+    handler = DatasetHandler()
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        tiff_dir = handler.preprocess_oneill(make_synthetic_dataset(num_samples), window_size, overlap, work_dir)
+        results = {}
+        for name, loader in (("Sequential", legacy_load_tiff_data), ("Parallel", handler.load_tiff_data)):
+            start_time = time.perf_counter()
+            images, labels = loader(tiff_dir)
+            elapsed = time.perf_counter() - start_time
+
+            # Measure the memory in a second run, since tracing slows the loaders down
+            del images
+            tracemalloc.start()
+            images, labels = loader(tiff_dir)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name] = (images, labels)
+            print(f"{name:10s}: {elapsed:7.3f} s, peak memory {peak_memory / 2**20:8.1f} MiB ({peak_memory / images.nbytes:.2f}x the dataset)")
+        identical = all(np.array_equal(a, b) for a, b in zip(results["Sequential"], results["Parallel"]))
+        print(f"Images: {len(labels)} (identical: {identical})")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_normalization(num_samples: int=20000, chunk_size: int=10, window_sizes: Iterable[int]=(64, 256, 1024)) -> None:
+    '''
+    Measure the per-sample cost of updating the streaming normalization modes for growing window sizes.
+
+    args:
+        num_samples (int): The number of streamed samples.
+        chunk_size (int): The number of samples per update, as delivered by a live stream.
+        window_sizes (Iterable[int]): The window sizes to compare.
+    '''
+    handler = DatasetHandler()
+    samples = handler.get_spatial_matrices(make_synthetic_dataset(num_samples).iloc[:, :8].to_numpy())
+    for mode in RunningNormalizer.MODES:
+        for window_size in window_sizes:
+            normalizer = RunningNormalizer(mode, window_size=window_size)
+            start_time = time.perf_counter()
+            for start in range(0, num_samples, chunk_size):
+                normalizer.update(samples[start: start+chunk_size])
+            elapsed = time.perf_counter() - start_time
+            print(f"{mode:8s} window {window_size:5d}: {elapsed / num_samples * 1e6:7.2f} us/sample")
+
+
+def benchmark_alignment(num_samples: int=2000000, sample_rate: float=250.0, cue_duration: float=4.0) -> None:
+    '''
+    Compare labeling a recording by cue interval with the nearest-cue merge_asof used before.
+
+    args:
+        num_samples (int): The number of samples in the recording.
+        sample_rate (float): The sampling rate in Hz.
+        cue_duration (float): The duration of each cue in seconds.
+    '''
+    rng = np.random.default_rng(0)
+    timestamps = 1.7e9 + np.arange(num_samples) / sample_rate
+    sensor_df = pd.DataFrame(rng.standard_normal((num_samples, 8)), columns=[f'Channel {n}' for n in range(1, 9)])
+    sensor_df['Timestamp'] = timestamps
+
+    # Alternate instructions and a random class, as the subject GUI does
+    num_cues = int(num_samples / sample_rate / cue_duration)
+    cue_timestamps = timestamps[0] + np.arange(num_cues) * cue_duration + rng.uniform(0, 0.1, num_cues)
+    cue_classes = np.where(np.arange(num_cues) % 2 == 0, "Instructions", rng.choice(["Move", "Relax"], num_cues))
+    class_df = pd.DataFrame({'Class': cue_classes, 'Timestamp': cue_timestamps})
+
+    start_time = time.perf_counter()
+    merged_df = pd.merge_asof(sensor_df, class_df, on='Timestamp', direction='nearest')
+    merged_df = merged_df[merged_df['Class'] != 'Instructions']
+    merge_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    labeled_df = label_dataset(sensor_df, class_df, exclude=("Instructions",))
+    alignment_time = time.perf_counter() - start_time
+
+    # The nearest cue differs from the enclosing cue for the second half of every interval
+    mismatched = np.mean(merged_df['Class'].reindex(labeled_df.index).to_numpy() != labeled_df['Class'].to_numpy())
+    print(f"Samples: {num_samples}, cues: {num_cues}")
+    print(f"merge_asof (nearest) : {merge_time:7.3f} s, {len(merged_df)} labeled samples")
+    print(f"Interval alignment   : {alignment_time:7.3f} s, {len(labeled_df)} labeled samples ({merge_time / alignment_time:.1f}x faster)")
+    print(f"Samples labeled differently by the nearest-cue merge: {mismatched:.1%}")
+
+
+def benchmark_acquisition(duration: float=10.0, sample_rate: int=250, num_rows: int=24, poll_rate: float=50.0, plot_rate: float=30.0) -> None:
+    '''
+    Estimate the CPU time per second of collection of the old polling loop and of the acquisition thread.
+
+    The old loop converts the latest 256 samples to a DataFrame and rewrites them to a CSV file on every poll, as fast as it can.
+    The acquisition thread copies the new samples into a ring buffer poll_rate times per second, and the plots read a
+    snapshot plot_rate times per second.
+
+    args:
+        duration (float): The simulated collection time in seconds.
+        sample_rate (int): The sampling rate of the board in Hz.
+        num_rows (int): The number of rows of the board data (24 for the Cyton).
+        poll_rate (float): The polls per second of the acquisition thread.
+        plot_rate (float): The plot refreshes per second.
+    '''
+    rng = np.random.default_rng(0)
+    eeg_channels = list(range(1, 9))
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        # Old loop: DataFrame and CSV file per poll (the real loop polls without pause, so it keeps one core busy)
+        data = rng.standard_normal((num_rows, 256))
+        num_polls = 200
+        start_time = time.process_time()
+        for _ in range(num_polls):
+            df = pd.DataFrame(np.transpose(data))
+            channel_data = df[eeg_channels]
+            np.savetxt(os.path.join(work_dir, "partial_dataset.csv"), data, delimiter='\t')
+            for ch in eeg_channels:
+                list(channel_data[ch])
+        legacy_poll_time = (time.process_time() - start_time) / num_polls
+
+        # Acquisition thread: ring buffer writes and plot snapshots
+        ring_buffer = RingBuffer(sample_rate * 30, num_rows)
+        chunk = rng.standard_normal((int(sample_rate / poll_rate), num_rows))
+        start_time = time.process_time()
+        for _ in range(int(duration * poll_rate)):
+            ring_buffer.write(chunk)
+        write_time = time.process_time() - start_time
+        start_time = time.process_time()
+        for _ in range(int(duration * plot_rate)):
+            samples = ring_buffer.get_latest(256)
+            for ch in eeg_channels:
+                samples[:, ch].tolist()
+        snapshot_time = time.process_time() - start_time
+
+        print(f"Old polling loop    : {legacy_poll_time * 1e3:7.3f} ms CPU per poll, unpaced (about 100% of a core)")
+        print(f"Ring buffer write   : {write_time / (duration * poll_rate) * 1e6:7.1f} us per poll at {poll_rate:.0f} Hz")
+        print(f"Plot snapshot       : {snapshot_time / (duration * plot_rate) * 1e6:7.1f} us per refresh at {plot_rate:.0f} Hz")
+        print(f"Acquisition CPU use : {(write_time + snapshot_time) / duration:.3%} of a core")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_session_log(hours: float=1.0, sample_rate: int=250, num_rows: int=24, flush_interval: float=1.0) -> None:
+    '''
+    Measure the cost of logging a long session one flush interval at a time, and of exporting it.
+
+    args:
+        hours (float): The simulated session length.
+        sample_rate (int): The sampling rate of the board in Hz.
+        num_rows (int): The number of rows of the board data (24 for the Cyton).
+        flush_interval (float): The time in seconds between two writes to the session log.
+    '''
+    rng = np.random.default_rng(0)
+    chunk = rng.standard_normal((int(sample_rate * flush_interval), num_rows))
+    num_chunks = int(hours * 3600 / flush_interval)
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        log_path = os.path.join(work_dir, "session.smmrlog")
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        with SessionRecorder(log_path, num_rows, flush_interval=flush_interval) as recorder:
+            for _ in range(num_chunks):
+                recorder.append(chunk)
+                recorder.flush()
+        elapsed = time.perf_counter() - start_time
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Logged {recorder.num_samples} samples ({hours:g} h): {elapsed / num_chunks * 1e3:.3f} ms per flush with fsync, "
+              f"peak memory {peak_memory / 2**20:.2f} MiB, file {os.path.getsize(log_path) / 2**20:.1f} MiB")
+
+        start_time = time.perf_counter()
+        SessionLog(log_path).export_csv(os.path.join(work_dir, "full_dataset.csv"))
+        print(f"CSV export: {time.perf_counter() - start_time:.2f} s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _write_board_recording(file_path: str, num_samples: int, sample_rate: int=250, num_rows: int=24) -> None:
+    '''
+    Write a synthetic recording in the Cyton board layout (EEG rows 1-8, timestamp row 22, marker row 23) as a session log.
+    '''
+    df = make_synthetic_dataset(num_samples)
+    samples = np.zeros((num_samples, num_rows))
+    samples[:, 0] = np.arange(num_samples) % 256
+    samples[:, 1:9] = df.iloc[:, :8].to_numpy()
+    samples[:, 22] = df['Timestamp'].to_numpy()
+    metadata = {'board_id': 0, 'sampling_rate': sample_rate, 'eeg_channels': list(range(1, 9)), 'timestamp_channel': 22, 'marker_channel': 23}
+    with SessionRecorder(file_path, num_rows, metadata, fsync=False) as recorder:
+        recorder.append(samples)
+
+
+def benchmark_replay(speeds: Iterable[float]=(1, 4, 16, 64, 256), duration: float=5.0, recording_seconds: float=600.0, poll_rate: float=50.0,
+                     plot_rate: float=30.0) -> None:
+    '''
+    Find the maximum sustainable throughput of the collection pipeline by replaying a recording at increasing speeds.
+
+    At each speed a DataCollector replays the recording with the acquisition thread and the session log running, while
+    the caller plays the plots (a snapshot plot_rate times per second) and the live normalization (every new sample).
+    A speed is sustained if the acquisition keeps up with the replay and the session log drops no sample.
+    The logged session is then labeled against the cues of the recording.
+    Needs BrainFlow, but no board.
+
+    args:
+        speeds (Iterable[float]): The replay speeds as multiples of real time.
+        duration (float): The wall time of each replay in seconds.
+        recording_seconds (float): The length of the synthetic recording in seconds (looped if shorter than a replay).
+        poll_rate (float): The polls per second of the acquisition thread.
+        plot_rate (float): The plot refreshes per second.
+    '''
+    from data.data_collector import DataCollector
+
+    sample_rate = 250
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        recording_path = os.path.join(work_dir, "recording.smmrlog")
+        _write_board_recording(recording_path, int(recording_seconds * sample_rate), sample_rate)
+        class_df = pd.DataFrame({'Class': ["Move", "Relax"] * 50, 'Timestamp': time.time() + np.arange(100) * 4.0})
+
+        print(f"{'speed':>6s} {'samples/s':>10s} {'kept up':>8s} {'log drops':>10s} {'CPU':>7s} {'label':>11s}")
+        for speed in speeds:
+            collector = DataCollector(replay_file=recording_path, replay_speed=speed, replay_loop=True)
+            log_path = os.path.join(work_dir, f"replay_{speed:g}x.smmrlog")
+            normalizer = RunningNormalizer("window", window_size=64)
+
+            collector.start_streaming()
+            start_cpu = time.process_time()
+            collector.start_acquisition(poll_rate=poll_rate, record=False, log_path=log_path)
+            count = 0
+            end_time = time.monotonic() + duration
+            while time.monotonic() < end_time:
+                time.sleep(1.0 / plot_rate)
+                samples = collector.get_latest(256)
+                for ch in collector.eeg_channels:
+                    samples[:, ch].tolist()
+                new_samples, count, _ = collector.ring_buffer.read_since(count)
+                normalizer.update(new_samples[:, collector.eeg_channels])
+            backlog = collector.board.get_board_data_count() / (sample_rate * speed)
+            collector.stop_acquisition()
+            cpu_time = time.process_time() - start_cpu
+            collector.stop_streaming()
+
+            start_time = time.perf_counter()
+            SessionLog(log_path).export_merged(os.path.join(work_dir, "merged_dataset.csv"), class_df)
+            label_time = time.perf_counter() - start_time
+
+            # Kept up if no more than two polls of samples were waiting at the end
+            kept_up = backlog <= 2.0 / poll_rate
+            print(f"{speed:5g}x {collector.num_samples / duration:10.0f} {str(kept_up):>8s} {collector.num_dropped:10d} "
+                  f"{cpu_time / duration:7.1%} {collector.num_samples / label_time:9.0f}/s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_plotting(sample_rates: Iterable[int]=(250, 1000, 4000, 16000), seconds: float=2.0, width: int=226, num_rows: int=24,
+                       frame_rate: float=30.0, num_frames: int=300) -> None:
+    '''
+    Measure the cost of one plot refresh when every sample is converted to a list, and with incremental min/max decimation to the plot width.
+
+    args:
+        sample_rates (Iterable[int]): The sampling rates of the board in Hz.
+        seconds (float): The time span shown by the plots.
+        width (int): The width of the plots in pixels.
+        num_rows (int): The number of rows of the board data (24 for the Cyton).
+        frame_rate (float): The plot refreshes per second.
+        num_frames (int): The number of refreshes timed.
+    '''
+    from gui.plot_updater import PlotUpdater
+
+    rng = np.random.default_rng(0)
+    eeg_channels = list(range(1, 9))
+    for sample_rate in sample_rates:
+        num_samples = int(seconds * sample_rate)
+        ring_buffer = RingBuffer(num_samples * 2, num_rows)
+        ring_buffer.write(rng.standard_normal((num_samples, num_rows)))
+        chunk = rng.standard_normal((int(sample_rate / frame_rate), num_rows))
+
+        # Every sample converted to a Python list per channel
+        start_time = time.perf_counter()
+        for _ in range(num_frames):
+            samples = ring_buffer.get_latest(num_samples)
+            for ch in eeg_channels:
+                samples[:, ch].tolist()
+        full_time = (time.perf_counter() - start_time) / num_frames
+
+        # Samples of one frame period folded into the pixel buckets (the writes are not timed)
+        updater = PlotUpdater(ring_buffer, eeg_channels, [str(ch) for ch in eeg_channels], lambda tag, values: None,
+                              num_samples=num_samples, width=width, frame_rate=frame_rate)
+        decimated_time = 0.0
+        for _ in range(num_frames):
+            ring_buffer.write(chunk)
+            start_time = time.perf_counter()
+            updater.update()
+            decimated_time += time.perf_counter() - start_time
+        decimated_time /= num_frames
+
+        print(f"{sample_rate:6d} Hz ({num_samples:6d} samples): every sample {full_time * 1e3:7.3f} ms/frame, "
+              f"decimated to {updater.plot_buffer.shape[1]} points {decimated_time * 1e3:6.3f} ms/frame")
+
+def benchmark_cues(num_cues: int=200, cue_period: float=0.05, spin_thresholds: Iterable[float]=(0.0, 0.001, 0.002, 0.005)) -> None:
+    '''
+    Measure the onset error and CPU use of the cue scheduler for several spin thresholds (0 only sleeps).
+
+    args:
+        num_cues (int): The number of cues per run.
+        cue_period (float): The time in seconds each cue is shown.
+        spin_thresholds (Iterable[float]): The times in seconds before each onset when sleeping turns into spinning.
+    '''
+    from gui.cue_scheduler import CueScheduler
+
+    for spin_threshold in spin_thresholds:
+        scheduler = CueScheduler(["Move", "Relax"] * (num_cues // 2), cue_period, lambda class_, timestamp: None, spin_threshold=spin_threshold)
+        start_cpu = time.process_time()
+        scheduler.start()
+        scheduler.thread.join()
+        cpu_use = (time.process_time() - start_cpu) / scheduler.duration
+        stats = scheduler.get_jitter_stats()
+        print(f"spin {spin_threshold * 1e3:4.1f} ms: onset error median {stats['p50_ms']:6.3f} ms, p99 {stats['p99_ms']:6.3f} ms, "
+              f"max {stats['max_ms']:6.3f} ms, CPU {cpu_use:6.1%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="Row-wise vs vectorized O'Neill preprocessing.")
+    preprocess_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic dataset.")
+    preprocess_parser.add_argument("--window-size", type=int, default=64, help="Size of the window.")
+    preprocess_parser.add_argument("--overlap", type=float, default=0.25, help="Overlap between windows.")
+
+    packed_parser = subparsers.add_parser("packed", help="TIFF folder vs packed dataset load time and disk usage.")
+    packed_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic dataset.")
+    packed_parser.add_argument("--window-size", type=int, default=64, help="Size of the window.")
+    packed_parser.add_argument("--overlap", type=float, default=0.25, help="Overlap between windows.")
+
+    compact_parser = subparsers.add_parser("compact", help="Disk and memory usage of grid vs compact packed datasets.")
+    compact_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic dataset.")
+    compact_parser.add_argument("--window-size", type=int, default=64, help="Size of the window.")
+    compact_parser.add_argument("--overlap", type=float, default=0.25, help="Overlap between windows.")
+
+    parallel_parser = subparsers.add_parser("parallel", help="Batch preprocessing throughput vs number of worker processes.")
+    parallel_parser.add_argument("--recordings", type=int, default=8, help="Number of synthetic recordings in the batch.")
+    parallel_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in each recording.")
+    parallel_parser.add_argument("--window-size", type=int, default=64, help="Size of the window.")
+    parallel_parser.add_argument("--overlap", type=float, default=0.25, help="Overlap between windows.")
+    parallel_parser.add_argument("--format", choices=("tiff", "packed"), default="packed", help="Output format.")
+
+    streaming_parser = subparsers.add_parser("streaming", help="Peak memory of in-memory vs chunked preprocessing (Unix only).")
+    streaming_parser.add_argument("--samples", type=int, nargs='+', default=[100000, 200000, 400000], help="Number of samples of each recording.")
+
+    tiff_load_parser = subparsers.add_parser("tiff-load", help="Sequential vs parallel, preallocated TIFF loading.")
+    tiff_load_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic dataset.")
+    tiff_load_parser.add_argument("--window-size", type=int, default=64, help="Size of the window.")
+    tiff_load_parser.add_argument("--overlap", type=float, default=0.25, help="Overlap between windows.")
+
+    normalization_parser = subparsers.add_parser("normalization", help="Per-sample cost of the streaming normalization modes.")
+    normalization_parser.add_argument("--samples", type=int, default=20000, help="Number of streamed samples.")
+    normalization_parser.add_argument("--chunk-size", type=int, default=10, help="Number of samples per update.")
+
+    alignment_parser = subparsers.add_parser("alignment", help="Interval label alignment vs nearest-cue merge_asof.")
+    alignment_parser.add_argument("--samples", type=int, default=2000000, help="Number of samples in the recording.")
+
+    acquisition_parser = subparsers.add_parser("acquisition", help="CPU use of the old polling loop vs the ring buffer acquisition thread.")
+    acquisition_parser.add_argument("--poll-rate", type=float, default=50.0, help="Polls per second of the acquisition thread.")
+
+    session_log_parser = subparsers.add_parser("session-log", help="Cost of logging and exporting a long session.")
+    session_log_parser.add_argument("--hours", type=float, default=1.0, help="Simulated session length in hours.")
+
+    replay_parser = subparsers.add_parser("replay", help="Maximum sustainable replay speed of the collection pipeline (needs BrainFlow).")
+    replay_parser.add_argument("--speeds", type=float, nargs='+', default=[1, 4, 16, 64, 256], help="Replay speeds as multiples of real time.")
+    replay_parser.add_argument("--duration", type=float, default=5.0, help="Wall time of each replay in seconds.")
+
+    plotting_parser = subparsers.add_parser("plotting", help="Cost of a plot refresh with and without min/max decimation.")
+    plotting_parser.add_argument("--sample-rates", type=int, nargs='+', default=[250, 1000, 4000, 16000], help="Sampling rates in Hz.")
+
+    cues_parser = subparsers.add_parser("cues", help="Onset error and CPU use of the cue scheduler.")
+    cues_parser.add_argument("--cues", type=int, default=200, help="Number of cues per run.")
+    cues_parser.add_argument("--cue-period", type=float, default=0.05, help="Time each cue is shown in seconds.")
+
+    args = parser.parse_args()
+    if args.benchmark == "preprocess":
+        benchmark_preprocess(args.samples, args.window_size, args.overlap)
+    elif args.benchmark == "packed":
+        benchmark_packed(args.samples, args.window_size, args.overlap)
+    elif args.benchmark == "compact":
+        benchmark_compact(args.samples, args.window_size, args.overlap)
+    elif args.benchmark == "parallel":
+        benchmark_parallel(args.recordings, args.samples, args.window_size, args.overlap, args.format)
+    elif args.benchmark == "streaming":
+        benchmark_streaming(args.samples)
+    elif args.benchmark == "tiff-load":
+        benchmark_tiff_load(args.samples, args.window_size, args.overlap)
+    elif args.benchmark == "normalization":
+        benchmark_normalization(args.samples, args.chunk_size)
+    elif args.benchmark == "alignment":
+        benchmark_alignment(args.samples)
+    elif args.benchmark == "acquisition":
+        benchmark_acquisition(poll_rate=args.poll_rate)
+    elif args.benchmark == "session-log":
+        benchmark_session_log(args.hours)
+    elif args.benchmark == "replay":
+        benchmark_replay(args.speeds, args.duration)
+    elif args.benchmark == "plotting":
+        benchmark_plotting(args.sample_rates)
+    elif args.benchmark == "cues":
+        benchmark_cues(args.cues, args.cue_period)
@@ -1,22 +1,88 @@
 import serial.tools.list_ports
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, BrainFlowPresets
 from brainflow.data_filter import DataFilter
-from time import sleep
+from time import sleep, monotonic
+import threading
+from typing import Iterable, Optional
 import pandas as pd
 import numpy as np
 from dearpygui.dearpygui import set_value
 
+from data.replay_board import ReplayBoard
+from data.ring_buffer import RingBuffer
+from data.session_recorder import SessionRecorder
+
+# Boards that are not connected through a serial port
+SERIAL_FREE_BOARDS = (BoardIds.SYNTHETIC_BOARD.value,)
+
+# USB vendor and product id of the FTDI chip of the OpenBCI dongle
+OPENBCI_DONGLE_VID = 0x0403
+OPENBCI_DONGLE_PID = 0x6015
+
+# Range of the package number the Cyton sends with every sample
+PACKAGE_NUM_RANGE = 256
+
+
+def find_BCI_headset_ports(serial_numbers: Optional[Iterable[str]]=None) -> list:
+    '''
+    Find the ports of the connected BCI headsets.
+
+    args:
+        serial_numbers (Iterable[str]): The serial numbers of the dongles to look for. None finds every OpenBCI dongle.
+
+    returns:
+        list: The ports, sorted by serial number.
+    '''
+    ports = serial.tools.list_ports.comports()
+    if serial_numbers is not None:
+        serial_numbers = set(serial_numbers)
+        ports = [port for port in ports if port.serial_number in serial_numbers]
+    else:
+        ports = [port for port in ports if (port.vid, port.pid) == (OPENBCI_DONGLE_VID, OPENBCI_DONGLE_PID)]
+    return sorted(ports, key=lambda port: port.serial_number or "")
+
+
 class DataCollector():
     '''
     A class to collect data from the BCI headset.
     '''
-    def __init__(self):
+    def __init__(self, board_id: int=BoardIds.CYTON_BOARD.value, serial_number: str='DM0258NJA', replay_file: Optional[str]=None,
+                 replay_speed: float=1.0, replay_loop: bool=False):
         '''
         Constructor for the DataCollector class.
+
+        args:
+            board_id (int): The BrainFlow id of the board (BoardIds.SYNTHETIC_BOARD needs no hardware).
+            serial_number (str): The serial number of the USB dongle of the headset. Boards without serial port get it as their
+                                 BrainFlow other_info, so several of them (e.g. synthetic boards with different names) can run at once.
+            replay_file (str): A session log or BrainFlow CSV file to replay instead of connecting to a board.
+            replay_speed (float): The playback speed of the replay as a multiple of real time.
+            replay_loop (bool): Whether the replay restarts at the end of the recording.
         '''
-        self.port = self.get_BCI_headset_port()
+        self.board_id = int(board_id)
+        self.serial_number = serial_number
+        self.replay_file = replay_file
+        self.replay_speed = replay_speed if replay_file is not None else 1.0
+        self.replay_loop = replay_loop
+        self.port = self.get_BCI_headset_port() if replay_file is None and self.board_id not in SERIAL_FREE_BOARDS else None
         self.board = self.connect_to_BCI_headset()
 
+        # Acquisition thread state
+        self.ring_buffer = None
+        self.recorded_chunks = []
+        self.acquisition_thread = None
+        self.stop_event = threading.Event()
+        self.num_polls = 0
+        self.num_samples = 0
+        self.num_lost = 0
+        self.clock = None
+
+        # Session log state
+        self.recorder = None
+        self.recorder_thread = None
+        self.recorded_count = 0
+        self.num_dropped = 0
+
     def get_BCI_headset_port(self) -> str:
         '''
         Find the port of the BCI headset.
@@ -30,18 +96,42 @@ class DataCollector():
         ports = serial.tools.list_ports.comports()
 
         for port in ports:
-            if port.serial_number == 'DM0258NJA':
+            if port.serial_number == self.serial_number:
                 return port
         return None
     
     def connect_to_BCI_headset(self) -> BoardShim:
+        '''
+        Create the board: a replay of the replay file, a board without serial port, or the headset on the port found.
+
+        returns:
+            BoardShim or ReplayBoard: The board, or None if it could not be created.
+        '''
         try:
+            if self.replay_file is not None:
+                return ReplayBoard.from_file(self.replay_file,
+                                             speed=self.replay_speed,
+                                             loop=self.replay_loop,
+                                             board_id=self.board_id,
+                                             sampling_rate=BoardShim.get_sampling_rate(self.board_id),
+                                             timestamp_channel=BoardShim.get_timestamp_channel(self.board_id),
+                                             marker_channel=BoardShim.get_marker_channel(self.board_id))
             params = BrainFlowInputParams()
-            params.serial_port = self.port.device
-            return BoardShim(BoardIds.CYTON_BOARD, params)
+            if self.board_id not in SERIAL_FREE_BOARDS:
+                params.serial_port = self.port.device
+            else:
+                # BrainFlow refuses a second session with the same board id and parameters
+                params.other_info = str(self.serial_number)
+            return BoardShim(self.board_id, params)
         except:
             print('Could not connect to the BCI headset.')
             return None
+
+    def is_connected(self) -> bool:
+        '''
+        Whether the board was created (and, for the headset, its port was found).
+        '''
+        return self.board is not None and (self.port is not None or self.replay_file is not None or self.board_id in SERIAL_FREE_BOARDS)
     
     def start_streaming(self) -> None:
         '''
@@ -58,7 +148,7 @@ class DataCollector():
         #data = self.board.get_board_data()  # get all data and remove it from internal buffer
 
         # demo how to convert it to pandas DF and plot data
-        eeg_channels = BoardShim.get_eeg_channels(BoardIds.CYTON_BOARD.value)
+        eeg_channels = BoardShim.get_eeg_channels(self.board.get_board_id())
         df = pd.DataFrame(np.transpose(data))
         #print('Data From the Board')
         #print(df.head(10))
@@ -82,6 +172,203 @@ class DataCollector():
     
         return df
     
+    def start_acquisition(self, poll_rate: float=50.0, buffer_seconds: float=30.0, record: bool=True, log_path: Optional[str]=None,
+                          flush_interval: float=1.0, clock=None, metadata: Optional[dict]=None) -> None:
+        '''
+        Start a background thread that drains the board into a preallocated ring buffer.
+
+        The thread only copies the new samples into the ring buffer (and keeps a reference to them when recording);
+        no DataFrame is built and nothing is written to disk while collecting.
+        With a log path, a second thread appends the ring buffer to a session log every flush interval,
+        so the session survives a crash and memory use does not grow with its length.
+
+        args:
+            poll_rate (float): The number of times per second the board is drained.
+            buffer_seconds (float): The number of seconds of samples kept in the ring buffer.
+            record (bool): Whether to keep every sample in memory for stop_acquisition.
+            log_path (str): Path to the session log. None disables the session log.
+            flush_interval (float): The time in seconds between two writes to the session log.
+            clock (SharedClock): A clock shared with other boards; the timestamps of the samples are moved onto it.
+            metadata (dict): Additional metadata of the session log (e.g. the class of each marker value).
+        '''
+        board_id = self.board.get_board_id()
+
+        # A replay at N times real time fills the buffer N times faster
+        capacity = int(BoardShim.get_sampling_rate(board_id) * buffer_seconds * self.replay_speed)
+        self.ring_buffer = RingBuffer(capacity, BoardShim.get_num_rows(board_id))
+        self.eeg_channels = BoardShim.get_eeg_channels(board_id)
+        self.timestamp_channel = BoardShim.get_timestamp_channel(board_id)
+        try:
+            self.package_num_channel = BoardShim.get_package_num_channel(board_id)
+        except Exception:
+            self.package_num_channel = None
+        self.sampling_rate = BoardShim.get_sampling_rate(board_id) * self.replay_speed
+        self.recorded_chunks = []
+        self.record = record
+        self.clock = clock
+        self.num_polls = 0
+        self.num_samples = 0
+        self.num_lost = 0
+        self.last_package_num = None
+        self.start_time = monotonic()
+
+        self.stop_event.clear()
+        self.acquisition_thread = threading.Thread(target=self._acquire, args=(1.0 / poll_rate,), name="acquisition", daemon=True)
+        self.acquisition_thread.start()
+
+        if log_path is not None:
+            self.recorder = SessionRecorder(log_path,
+                                            num_columns=self.ring_buffer.num_columns,
+                                            metadata={'board_id': board_id,
+                                                      'sampling_rate': BoardShim.get_sampling_rate(board_id),
+                                                      'eeg_channels': list(self.eeg_channels),
+                                                      'timestamp_channel': self.timestamp_channel,
+                                                      'marker_channel': BoardShim.get_marker_channel(board_id),
+                                                      'replay_file': self.replay_file,
+                                                      'replay_speed': self.replay_speed,
+                                                      'serial_number': self.port.serial_number if self.port is not None else None,
+                                                      'shared_clock': clock is not None,
+                                                      **(metadata or {})},
+                                            flush_interval=flush_interval)
+            self.recorded_count = 0
+            self.num_dropped = 0
+            self.recorder_thread = threading.Thread(target=self._record, args=(flush_interval,), name="recorder", daemon=True)
+            self.recorder_thread.start()
+
+    def _acquire(self, period: float) -> None:
+        '''
+        Drain the board at a fixed rate until stop_acquisition is called.
+
+        args:
+            period (float): The time between two polls in seconds.
+        '''
+        next_poll = monotonic()
+        while not self.stop_event.is_set():
+            self._poll()
+
+            # Sleep until the next poll, skipping polls that were missed
+            next_poll += period
+            now = monotonic()
+            if next_poll < now:
+                next_poll = now
+            self.stop_event.wait(next_poll - now)
+
+    def _poll(self) -> None:
+        '''
+        Move the samples collected by the board since the last poll into the ring buffer.
+        '''
+        data = self.board.get_board_data()  # get all data and remove it from internal buffer
+        self.num_polls += 1
+        if data.shape[1] == 0:
+            return
+        samples = data.T
+
+        # Count the samples lost on the radio link from the gaps in the package numbers
+        if self.package_num_channel is not None:
+            package_nums = np.concatenate(([self.last_package_num], data[self.package_num_channel])) if self.last_package_num is not None \
+                else data[self.package_num_channel]
+            self.num_lost += int(np.sum((np.diff(package_nums) - 1) % PACKAGE_NUM_RANGE))
+            self.last_package_num = data[self.package_num_channel, -1]
+
+        if self.clock is not None:
+            samples[:, self.timestamp_channel] = self.clock.from_wall(samples[:, self.timestamp_channel])
+        self.ring_buffer.write(samples)
+        if self.record:
+            self.recorded_chunks.append(samples)
+        self.num_samples += len(samples)
+
+    def _record(self, flush_interval: float) -> None:
+        '''
+        Append the ring buffer to the session log every flush interval until stop_acquisition is called.
+
+        args:
+            flush_interval (float): The time between two writes in seconds.
+        '''
+        while not self.stop_event.wait(flush_interval):
+            self._write_log()
+
+    def _write_log(self) -> None:
+        '''
+        Append the samples written to the ring buffer since the last write to the session log and flush it.
+        '''
+        samples, self.recorded_count, num_dropped = self.ring_buffer.read_since(self.recorded_count)
+        if num_dropped:
+            print(f"Warning: {num_dropped} samples were overwritten before they were logged")
+            self.num_dropped += num_dropped
+        self.recorder.append(samples)
+        self.recorder.flush()
+
+    def insert_marker(self, value: float) -> None:
+        '''
+        Stamp a marker (e.g. a cue code) into the marker row of the next sample of the board.
+
+        args:
+            value (float): The marker value, non-zero.
+        '''
+        self.board.insert_marker(value)
+
+    def get_stats(self) -> dict:
+        '''
+        Get the counters of the acquisition.
+
+        returns:
+            dict: The samples acquired, the measured and nominal sample rates, the samples lost on the radio link,
+                  the samples overwritten before they were logged and the fraction of the ring buffer waiting to be logged.
+        '''
+        elapsed = monotonic() - self.start_time
+        log_backlog = self.ring_buffer.total_written - self.recorded_count if self.recorder is not None else 0
+        return {'samples': self.num_samples,
+                'sample_rate': self.num_samples / elapsed if elapsed > 0 else 0.0,
+                'nominal_sample_rate': self.sampling_rate,
+                'lost': self.num_lost,
+                'log_dropped': self.num_dropped,
+                'log_backlog': log_backlog / self.ring_buffer.capacity}
+
+    def get_latest(self, num_samples: int) -> np.ndarray:
+        '''
+        Get the latest samples collected by the acquisition thread.
+
+        args:
+            num_samples (int): The number of samples.
+
+        returns:
+            np.ndarray: A zero-copy view with shape (num_samples, board rows), oldest first. Copy it to keep it.
+        '''
+        return self.ring_buffer.get_latest(num_samples)
+
+    def stop_acquisition(self) -> Optional[pd.DataFrame]:
+        '''
+        Stop the acquisition (and session log) threads and return every sample recorded since start_acquisition.
+
+        returns:
+            pd.DataFrame or None: The recorded samples, one row per sample as in get_board_data, or None if they were not kept in memory.
+        '''
+        self.stop_event.set()
+        for thread in (self.acquisition_thread, self.recorder_thread):
+            if thread is not None:
+                thread.join()
+        self.acquisition_thread = None
+        self.recorder_thread = None
+
+        # Drain what arrived after the last poll
+        self._poll()
+        print(f"Acquisition: {self.num_samples} samples in {self.num_polls} polls")
+
+        # Complete the session log
+        if self.recorder is not None:
+            self._write_log()
+            self.recorder.close()
+            print(f"Session log: {self.recorder.num_samples} samples in {self.recorder.file_path} ({self.num_dropped} dropped)")
+            self.recorder = None
+
+        if not self.record:
+            return None
+        if not self.recorded_chunks:
+            return pd.DataFrame(np.empty((0, self.ring_buffer.num_columns)))
+        dataset = pd.DataFrame(np.concatenate(self.recorded_chunks))
+        self.recorded_chunks = []
+        return dataset
+
     def stop_streaming(self) -> None:
         '''
         Stop streaming data from the BCI headset.
@@ -117,7 +404,13 @@ class DataCollector():
         '''
         print('\nBCI HEADSET INFO:')
         print('-----------------')
-        
+        if self.replay_file is not None:
+            print(f"Replay of {self.replay_file} at {self.replay_speed:g}x ({self.board.duration:.1f} s per pass)")
+            return
+        if self.port is None:
+            print(f"Board {self.board_id} (no serial port)")
+            return
+
         # Print the value of the attributes if not None
         info = self.port.__dict__
         for key, value in info.items():
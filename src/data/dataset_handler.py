@@ -1,15 +1,26 @@
 import os
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from logging import getLogger, basicConfig, INFO, info, warning, error, critical, Formatter
 from datetime import datetime
 import pandas as pd
-from typing import Optional, Union, Iterable
+from typing import Optional, Union, Iterable, Iterator, Tuple, List
 import numpy as np      
 import math
 import tifffile
 
-from scipy.stats import zscore
+from numpy.lib.stride_tricks import sliding_window_view
 from tqdm import tqdm
 
+from data.montage import Montage, CYTON_MONTAGE
+from data.normalization import normalize_windows
+from data.packed_dataset import PackedDataset, PackedDatasetWriter, PACKED_EXTENSION
+
+# Revision of the preprocessing output (window values, layout, dtype, class order), part of the preprocessing cache keys.
+# Increase it whenever the output of a preprocessing method changes, so cached results are rebuilt.
+PREPROCESSING_REVISION = 2
+
 
 class DatasetHandler():
     '''
@@ -22,6 +33,7 @@ class DatasetHandler():
         # Initialize the logger
         self.logger = getLogger(__name__)
         self.log_directory_path = os.path.join(os.path.dirname(__file__), 'logs')
+        os.makedirs(self.log_directory_path, exist_ok=True)
         basicConfig(filename=os.path.join(self.log_directory_path, f"dataset_handler_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log"), level=INFO)
 
         # Initialize the dataset paths
@@ -40,6 +52,9 @@ class DatasetHandler():
         self.val_labels = None
         self.test_labels = None
 
+        # The classes in label order, shared by the three datasets
+        self.class_names = None
+
 
     def load_csv_as_dataframe(self, file_path: str, **kwargs) -> Optional[pd.DataFrame]:
         """
@@ -61,6 +76,63 @@ class DatasetHandler():
         except Exception as e:
             print(f"Error: Failed to load '{file_path}': {e}")
             return None
+
+    def iter_csv_chunks(self, file_path: str, chunk_size: int=100000, montage: Montage=CYTON_MONTAGE, dtype: np.dtype=np.float32,
+                        engine: str="c") -> Iterator[pd.DataFrame]:
+        """
+        Read a merged CSV recording in chunks of rows with explicit column types.
+
+        The channel columns are parsed straight into the given dtype and the row index keeps counting across
+        chunks, so the memory used does not depend on the length of the recording.
+
+        args:
+            file_path (str): Path to the CSV file.
+            chunk_size (int): The number of rows per chunk (approximate for the pyarrow engine).
+            montage (Montage): The electrode layout of the headset, which sets the number of channel columns.
+            dtype (np.dtype): The data type of the channel columns.
+            engine (str): "c" for the pandas C parser, "pyarrow" for the multithreaded pyarrow parser.
+
+        returns:
+            Iterator[pd.DataFrame]: The chunks of the recording.
+
+        raises:
+            ValueError: If the engine is not supported.
+            ImportError: If the pyarrow engine is selected but pyarrow is not installed.
+        """
+        # Get the column types from the header
+        columns = pd.read_csv(file_path, nrows=0).columns.tolist()
+        column_types = {column: dtype for column in columns[:montage.num_channels]}
+        if 'Timestamp' in columns:
+            column_types['Timestamp'] = np.float64
+
+        if engine == "c":
+            with pd.read_csv(file_path, chunksize=chunk_size, dtype=column_types) as reader:
+                yield from reader
+
+        elif engine == "pyarrow":
+            try:
+                import pyarrow as pa
+                import pyarrow.csv as pa_csv
+            except ImportError as e:
+                raise ImportError("The pyarrow engine requires pyarrow. Install it with 'pip install pyarrow'.") from e
+
+            # pyarrow reads blocks of bytes, so estimate the block size from the length of the first rows
+            with open(file_path, 'rb') as file:
+                head = file.read(1 << 16)
+            row_size = max(1, len(head) // max(1, head.count(b"\n")))
+            reader = pa_csv.open_csv(file_path,
+                                     read_options=pa_csv.ReadOptions(block_size=max(1 << 16, chunk_size * row_size)),
+                                     convert_options=pa_csv.ConvertOptions(column_types={column: pa.from_numpy_dtype(np.dtype(column_type))
+                                                                                         for column, column_type in column_types.items()}))
+            num_rows = 0
+            for batch in reader:
+                chunk = batch.to_pandas()
+                chunk.index = pd.RangeIndex(num_rows, num_rows + len(chunk))
+                num_rows += len(chunk)
+                yield chunk
+
+        else:
+            raise ValueError(f"Invalid CSV engine '{engine}'")
     
     def get_spatial_matrix(self, channel_readings: Iterable) -> np.array:
         """
@@ -89,108 +161,673 @@ class DatasetHandler():
 
         return np.array(spatial_matrix)
     
-    def preprocess_oneill(self, df: pd.DataFrame, window_size: Union[int, float], overlap: float, store_folder: str, normalize: bool=True) -> None:
+    @staticmethod
+    def get_spatial_matrices(channel_values: np.ndarray, montage: Montage=CYTON_MONTAGE, dtype: np.dtype=np.float64) -> np.ndarray:
+        """
+        Create the spatial matrices of many samples at once.
+
+        This is the vectorized counterpart of get_spatial_matrix: every sample is scattered into
+        one preallocated array using the precomputed electrode index maps of the montage.
+
+        args:
+            channel_values (np.ndarray): The channel readings with shape (num_samples, num_channels).
+            montage (Montage): The electrode layout of the headset.
+            dtype (np.dtype): The data type of the spatial matrices.
+
+        returns:
+            np.ndarray: The spatial matrices with shape (num_samples, *montage.grid_shape).
+
+        raises:
+            ValueError: If there are fewer channels than the montage expects.
+        """
+        channel_values = np.asarray(channel_values)
+        if channel_values.ndim != 2 or channel_values.shape[1] < montage.num_channels:
+            raise ValueError(f"Expected readings for {montage.num_channels} channels, got shape {channel_values.shape}.")
+
+        # Scatter the channel readings into their grid positions
+        spatial_matrices = np.zeros((len(channel_values),) + montage.grid_shape, dtype=dtype)
+        spatial_matrices[:, montage.rows, montage.cols] = channel_values[:, :montage.num_channels]
+
+        return spatial_matrices
+
+    @staticmethod
+    def get_windows(data: np.ndarray, window_size: int, overlap: float) -> np.ndarray:
+        """
+        Split the data into overlapping windows along the first axis.
+
+        The windows are strided views of the data, so no samples are copied.
+
+        args:
+            data (np.ndarray): The data with the samples along the first axis.
+            window_size (int): The size of the window.
+            overlap (float): The overlap between windows.
+
+        returns:
+            np.ndarray: The windows with shape (num_windows, window_size, *data.shape[1:]).
+
+        raises:
+            ValueError: If the overlap leaves a step size smaller than one sample.
+        """
+        window_size = int(window_size)
+
+        # Calculate the step size
+        step_size = math.floor(window_size * (1-overlap))
+        if step_size < 1:
+            raise ValueError(f"Overlap {overlap} is too large for a window size of {window_size}.")
+
+        # Not enough samples for a single window
+        if len(data) < window_size:
+            return np.empty((0, window_size) + data.shape[1:], dtype=data.dtype)
+
+        # sliding_window_view appends the window axis at the end, so move it next to the window index
+        windows = sliding_window_view(data, window_size, axis=0)[::step_size]
+        return np.moveaxis(windows, -1, 1)
+
+    @staticmethod
+    def normalize_windows(windows: np.ndarray) -> np.ndarray:
+        """
+        Normalize a batch of windows about their depth axis.
+
+        args:
+            windows (np.ndarray): The windows with shape (num_windows, window_size, ...).
+
+        returns:
+            np.ndarray: The normalized windows, with NaN values (constant cells) replaced by 0.
+        """
+        return normalize_windows(windows, axis=1)
+
+    def get_oneill_windows(self, class_df: pd.DataFrame, window_size: int, overlap: float, montage: Montage=CYTON_MONTAGE) -> np.ndarray:
+        """
+        Get the (not normalized) O'Neill windows of the samples of a single class.
+
+        args:
+            class_df (pd.DataFrame): The samples of a single class, with the channels as the first columns.
+            window_size (int): The size of the window.
+            overlap (float): The overlap between windows.
+            montage (Montage): The electrode layout of the headset.
+
+        returns:
+            np.ndarray: The windows with shape (num_windows, window_size, *montage.grid_shape).
         """
-        Preprocess the O'Neill dataset and store the data as TIFF images.
+        channel_values = class_df.iloc[:, :montage.num_channels].to_numpy()
+        spatial_matrices = self.get_spatial_matrices(channel_values, montage)
+        return self.get_windows(spatial_matrices, window_size, overlap)
+
+    def preprocess_oneill(self, df: pd.DataFrame, window_size: Union[int, float], overlap: float, store_folder: str, normalize: bool=True,
+                          montage: Montage=CYTON_MONTAGE, batch_size: int=1024, output_format: str="tiff", session: str="",
+                          num_workers: int=1, compact: bool=False) -> str:
+        """
+        Preprocess the O'Neill dataset and store the data as TIFF images or as a packed dataset.
         
         args:
             df (pd.DataFrame): The dataset as a DataFrame.
             window_size (Union[int, float]): The size of the window.
             overlap (float): The overlap between windows.
-            store_folder (str): The folder to store the TIFF images.
+            store_folder (str): The folder to store the TIFF images or the packed dataset.
+            normalize (bool): Whether to z-score each window about its depth axis.
+            montage (Montage): The electrode layout of the headset.
+            batch_size (int): The number of windows processed (and normalized) at once by a worker.
+            output_format (str): "tiff" for one TIFF image per window, "packed" for a single .smmr file.
+            session (str): The name of the recording, stored in the index of packed datasets.
+            num_workers (int): The number of worker processes. 1 processes the dataset in this process.
+            compact (bool): Whether to store the windows as (window_size, num_channels) instead of on the spatial grid.
             
         returns:
-            None
+            str: The folder with the TIFF images or the path to the packed dataset.
+
+        raises:
+            ValueError: If the output format is not supported.
+        """
+        job = (store_folder, session, split_classes(df, montage))
+        return self._run_oneill_jobs([job], window_size, overlap, normalize, montage, batch_size, output_format, num_workers, compact=compact)[0]
+
+    def preprocess_oneill_batch(self, file_paths: Iterable[str], window_size: Union[int, float], overlap: float, store_folder: str, normalize: bool=True,
+                                montage: Montage=CYTON_MONTAGE, batch_size: int=1024, output_format: str="tiff", num_workers: Optional[int]=None,
+                                compact: bool=False) -> List[str]:
+        """
+        Preprocess many raw recordings with the O'Neill method in a single process pool.
+
+        The recordings are loaded in parallel, then the windows of all recordings and classes are split into
+        batches that are spread over the workers. Each recording is stored in its own subfolder named after the file.
+
+        args:
+            file_paths (Iterable[str]): Paths to the merged CSV recordings.
+            window_size (Union[int, float]): The size of the window.
+            overlap (float): The overlap between windows.
+            store_folder (str): The folder to store the preprocessed recordings.
+            normalize (bool): Whether to z-score each window about its depth axis.
+            montage (Montage): The electrode layout of the headset.
+            batch_size (int): The number of windows processed (and normalized) at once by a worker.
+            output_format (str): "tiff" for one TIFF image per window, "packed" for a single .smmr file.
+            num_workers (int): The number of worker processes. Defaults to the number of CPUs.
+            compact (bool): Whether to store the windows as (window_size, num_channels) instead of on the spatial grid.
+
+        returns:
+            List[str]: The output of each recording, in the order of file_paths.
+        """
+        file_paths = list(file_paths)
+        num_workers = num_workers or os.cpu_count() or 1
+
+        # Spawn the workers: the GUI process runs threads and may have imported TensorFlow, neither survives a fork
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context("spawn")) as executor:
+            # Load the recordings in parallel
+            print(f"Loading {len(file_paths)} recordings...")
+            class_data = executor.map(load_oneill_classes, file_paths, [montage] * len(file_paths))
+
+            jobs = []
+            for file_path, classes in zip(file_paths, class_data):
+                session = os.path.splitext(os.path.basename(file_path))[0]
+                jobs.append((os.path.join(store_folder, session), os.path.basename(file_path), classes))
+
+            return self._run_oneill_jobs(jobs, window_size, overlap, normalize, montage, batch_size, output_format, num_workers, executor, compact)
+
+    def preprocess_oneill_streaming(self, file_path: str, window_size: Union[int, float], overlap: float, store_folder: str, normalize: bool=True,
+                                    montage: Montage=CYTON_MONTAGE, batch_size: int=1024, chunk_size: int=100000, dtype: np.dtype=np.float64,
+                                    engine: str="c", output_format: str="tiff", session: Optional[str]=None, compact: bool=False) -> str:
+        """
+        Preprocess a raw recording with the O'Neill method while reading it in chunks.
+
+        The samples of each class that do not fill a complete window yet are carried over to the next chunk,
+        so windows that span chunk edges are produced exactly as if the whole recording had been loaded.
+        Memory use is bounded by the chunk size instead of the length of the recording.
+
+        With the default float64 dtype the windows equal those of preprocess_oneill. They are stored chunk by chunk,
+        so the windows of the classes are interleaved instead of grouped by class; the offsets in the index of packed
+        datasets still identify every window. float32 halves the memory and the output size.
+
+        args:
+            file_path (str): Path to the merged CSV recording.
+            window_size (Union[int, float]): The size of the window.
+            overlap (float): The overlap between windows.
+            store_folder (str): The folder to store the TIFF images or the packed dataset.
+            normalize (bool): Whether to z-score each window about its depth axis.
+            montage (Montage): The electrode layout of the headset.
+            batch_size (int): The number of windows processed (and normalized) at once.
+            chunk_size (int): The number of rows read at once.
+            dtype (np.dtype): The data type of the channel readings and of the stored windows.
+            engine (str): The CSV parser, "c" or "pyarrow".
+            output_format (str): "tiff" for one TIFF image per window, "packed" for a single .smmr file.
+            session (str): The name of the recording, stored in the index of packed datasets. Defaults to the file name.
+            compact (bool): Whether to store the windows as (window_size, num_channels) instead of on the spatial grid.
+
+        returns:
+            str: The folder with the TIFF images or the path to the packed dataset.
+
+        raises:
+            ValueError: If the output format is not supported or the overlap is too large.
+        """
+        if output_format not in ("tiff", "packed"):
+            raise ValueError(f"Invalid output format '{output_format}'")
+
+        window_size = int(window_size)
+        session = os.path.basename(file_path) if session is None else session
+
+        # Calculate the step size
+        step_size = math.floor(window_size * (1-overlap))
+        if step_size < 1:
+            raise ValueError(f"Overlap {overlap} is too large for a window size of {window_size}.")
+
+        # Open the packed dataset
+        os.makedirs(store_folder, exist_ok=True)
+        writer = None
+        if output_format == "packed":
+            output_path = os.path.join(store_folder, f"{os.path.basename(os.path.normpath(store_folder))}{PACKED_EXTENSION}")
+            writer = self._get_oneill_writer(output_path, window_size, overlap, normalize, montage, compact, dtype)
+        else:
+            output_path = store_folder
+
+        # Samples of each class that were not consumed by a window yet, their row index and the number of windows so far
+        carry = {}
+
+        try:
+            with tqdm(desc="Processing", colour="green", unit="images") as progress_bar:
+                for chunk in self.iter_csv_chunks(file_path, chunk_size, montage, dtype, engine):
+                    for _class, channel_values, sample_index in split_classes(chunk, montage):
+                        # Prepend the samples carried over from the previous chunks
+                        if _class in carry:
+                            carried_values, carried_index, first_index = carry[_class]
+                            channel_values = np.concatenate((carried_values, channel_values))
+                            sample_index = np.concatenate((carried_index, sample_index))
+                        else:
+                            first_index = 0
+                            if writer is None:
+                                os.makedirs(os.path.join(store_folder, _class), exist_ok=True)
+
+                        # Process every window that is complete, batch_size windows at a time
+                        num_windows = max(0, (len(channel_values) - window_size) // step_size + 1)
+                        for start in range(0, num_windows, batch_size):
+                            stop = min(start + batch_size, num_windows)
+                            task = {'class': _class,
+                                    'first_index': first_index + start,
+                                    'channel_values': channel_values[start*step_size: (stop-1)*step_size + window_size],
+                                    'offsets': sample_index[start*step_size: (stop-1)*step_size + 1: step_size],
+                                    'window_size': window_size,
+                                    'overlap': overlap,
+                                    'normalize': normalize,
+                                    'montage': montage,
+                                    'compact': compact,
+                                    'folder_path': None if writer else os.path.join(store_folder, _class)}
+                            images = preprocess_oneill_task(task)
+                            if writer is not None:
+                                writer.append(images, _class, session, task['offsets'])
+
+                            progress_bar.set_description(f"Processing {_class}")
+                            progress_bar.update(stop - start)
+
+                        # Carry over the samples from the start of the next window
+                        consumed = num_windows * step_size
+                        carry[_class] = (channel_values[consumed:].copy(), sample_index[consumed:].copy(), first_index + num_windows)
+        except BaseException:
+            # Do not leave a partial packed dataset that would load as complete
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            writer.close()
+
+        return output_path
+
+    def _get_oneill_writer(self, output_path: str, window_size: int, overlap: float, normalize: bool, montage: Montage, compact: bool,
+                           dtype: np.dtype=np.float64) -> PackedDatasetWriter:
+        """
+        Open a packed dataset for O'Neill windows, recording the preprocessing parameters and the window layout.
+
+        args:
+            output_path (str): Path to the packed dataset file.
+            window_size (int): The size of the window.
+            overlap (float): The overlap between windows.
+            normalize (bool): Whether the windows are normalized.
+            montage (Montage): The electrode layout of the headset.
+            compact (bool): Whether the windows are stored as (window_size, num_channels) instead of on the spatial grid.
+            dtype (np.dtype): The data type the windows are stored as.
+
+        returns:
+            PackedDatasetWriter: The open writer.
+        """
+        window_shape = (window_size, montage.num_channels) if compact else (window_size,) + montage.grid_shape
+        return PackedDatasetWriter(output_path,
+                                   window_shape=window_shape,
+                                   dtype=dtype,
+                                   metadata={'preset': "O'Neill",
+                                             'window_size': window_size,
+                                             'overlap': overlap,
+                                             'normalize': normalize,
+                                             'montage': montage.name,
+                                             'layout': "compact" if compact else "grid"})
+
+    def _run_oneill_jobs(self, jobs: list, window_size: Union[int, float], overlap: float, normalize: bool, montage: Montage, batch_size: int,
+                         output_format: str, num_workers: int, executor: Optional[ProcessPoolExecutor]=None, compact: bool=False) -> List[str]:
+        """
+        Split O'Neill preprocessing jobs into batches of windows and run them, in a process pool if requested.
+
+        Results are consumed in submission order, so the output is the same for any number of workers.
+
+        args:
+            jobs (list): (store_folder, session, [(class, channel_values, sample_index), ...]) for each recording.
+            window_size (Union[int, float]): The size of the window.
+            overlap (float): The overlap between windows.
+            normalize (bool): Whether to z-score each window about its depth axis.
+            montage (Montage): The electrode layout of the headset.
+            batch_size (int): The number of windows per task.
+            output_format (str): "tiff" or "packed".
+            num_workers (int): The number of worker processes.
+            executor (ProcessPoolExecutor): A running process pool to reuse.
+            compact (bool): Whether to store the windows as (window_size, num_channels) instead of on the spatial grid.
+
+        returns:
+            List[str]: The output of each job.
+
+        raises:
+            ValueError: If the output format is not supported.
         """
-        # Get names of unique classes
-        classes = df['Class'].unique().tolist()
+        if output_format not in ("tiff", "packed"):
+            raise ValueError(f"Invalid output format '{output_format}'")
 
-        # Process data for each class
-        for _class in classes:
-            # Create a dataframe containing only the data for a specific class
-            class_df = df[df['Class'] == _class].copy()
+        window_size = int(window_size)
 
-            # Add a column that contains the spatial matrices
-            class_df['Spatial Matrix'] = class_df.apply(self.get_spatial_matrix, axis=1)
+        # Calculate the step size
+        step_size = math.floor(window_size * (1-overlap))
+        if step_size < 1:
+            raise ValueError(f"Overlap {overlap} is too large for a window size of {window_size}.")
 
-            # Get the number of samples in the dataset
-            num_samples = len(class_df)
+        # Split every class of every job into tasks of at most batch_size windows
+        output_paths = []
+        writers = []
+        tasks = []
+        for job_id, (store_folder, session, classes) in enumerate(jobs):
+            os.makedirs(store_folder, exist_ok=True)
+            if output_format == "packed":
+                output_path = os.path.join(store_folder, f"{os.path.basename(os.path.normpath(store_folder))}{PACKED_EXTENSION}")
+                writers.append(self._get_oneill_writer(output_path, window_size, overlap, normalize, montage, compact))
+            else:
+                output_path = store_folder
+            output_paths.append(output_path)
 
-            # Calculate the number of TIFF images to create
-            #num_images = math.floor( num_samples / (window_size * overlap) ) - 1
+            for _class, channel_values, sample_index in classes:
+                # Create folder if it doesn't exist
+                folder_path = os.path.join(store_folder, _class)
+                if output_format == "tiff":
+                    os.makedirs(folder_path, exist_ok=True)
 
-            # Calculate the step size
-            step_size = math.floor(window_size * (1-overlap))
+                num_windows = max(0, (len(channel_values) - window_size) // step_size + 1)
+                for start in range(0, num_windows, batch_size):
+                    stop = min(start + batch_size, num_windows)
+                    tasks.append({'job_id': job_id,
+                                  'class': _class,
+                                  'first_index': start,
+                                  'channel_values': channel_values[start*step_size: (stop-1)*step_size + window_size],
+                                  'offsets': sample_index[start*step_size: (stop-1)*step_size + 1: step_size],
+                                  'window_size': window_size,
+                                  'overlap': overlap,
+                                  'normalize': normalize,
+                                  'montage': montage,
+                                  'compact': compact,
+                                  'folder_path': folder_path if output_format == "tiff" else None})
 
-            # Create folder if it doesn't exist
-            folder_path = os.path.join(store_folder, _class)
-            os.makedirs(folder_path, exist_ok=True)
+        def run_tasks():
+            # Run the tasks in this process
+            if executor is None:
+                for task in tasks:
+                    yield task, preprocess_oneill_task(task)
+                return
 
-            # Create and store TIFF images of the respective class
-            for index, n in enumerate(tqdm(range(0, num_samples, step_size), desc=f"Processing {_class}", colour="green", unit="images")):
-                # Create the image
-                image = class_df['Spatial Matrix'].iloc[n: n+window_size]
-                image = np.stack(image)
-                # image.shape --> (window_size, 10, 11)
-                # This is the numpy format for a stack of n 10x11 matrices
+            # Run the tasks in the pool, keeping a few tasks per worker in flight and yielding in submission order
+            pending = deque()
+            for task in tasks:
+                pending.append((task, executor.submit(preprocess_oneill_task, task)))
+                if len(pending) >= 4 * num_workers:
+                    task, future = pending.popleft()
+                    yield task, future.result()
+            while pending:
+                task, future = pending.popleft()
+                yield task, future.result()
 
-                # Check if the image size matches target size
-                if len(image) != window_size:
-                    continue
+        # Create and store the images
+        owns_executor = executor is None and num_workers > 1
+        if owns_executor:
+            executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context("spawn"))
+        try:
+            with tqdm(total=sum(len(task['offsets']) for task in tasks), desc="Processing", colour="green", unit="images") as progress_bar:
+                for task, images in run_tasks():
+                    # Append the batch to the packed dataset
+                    if writers:
+                        writers[task['job_id']].append(images, task['class'], jobs[task['job_id']][1], task['offsets'])
 
-                # Normalize the image data about the depth axis
-                if normalize:
-                    normalized_image = zscore(image, axis=0)
-                    # Replace NaN values with 0
-                    np.nan_to_num(normalized_image, copy=False, nan=0.0)
+                    progress_bar.set_description(f"Processing {task['class']}")
+                    progress_bar.update(len(task['offsets']))
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+        finally:
+            if owns_executor:
+                executor.shutdown(cancel_futures=True)
+        for writer in writers:
+            writer.close()
 
-                # Save TIFF image with timestamp in class folder
-                file_path = os.path.join(folder_path, f"{_class}_{index}.tif")  # Adjust file name as needed
-                tifffile.imwrite(file_path, normalized_image)
+        return output_paths
 
-    def load_tiff_data(self, data_dir):
+    def load_tiff_data(self, data_dir, num_workers=None, class_names=None):
         '''
         Load the data from the TIFF files in the specified directory.
+
+        The files are listed once, the output array is preallocated from the first file and the
+        files are decoded straight into it by a pool of threads.
         
         args:
             data_dir (str): The directory containing the TIFF files.
+            num_workers (int): The number of decoding threads. Defaults to the ThreadPoolExecutor default.
+            class_names (List[str]): The classes in label order. Defaults to the class folders sorted by name.
             
         returns:
             images (np.array): The image data.
             labels (np.array): The labels for the image data.
             
         raises:
-            ValueError: If the data directory is not set.'''
+            ValueError: If the data directory is not set or the images do not all have the same shape.'''
         
         if data_dir is None:
             raise ValueError("Data directory not set.")
 
-        images = []
-        labels = []
-        class_names = os.listdir(data_dir)
-        for class_name in class_names:
-            class_dir = os.path.join(data_dir, class_name)
-            for file_name in os.listdir(class_dir):
-                file_path = os.path.join(class_dir, file_name)
-                with tifffile.TiffFile(file_path) as tif:
-                    image = tif.asarray()
-                    images.append(image)
-                    labels.append(class_name)
-
-        # Convert lists to numpy arrays
-        images = np.array(images)
-        labels = np.array(labels)
-
-        # Convert class names to integer labels
-        label_map = {name: i for i, name in enumerate(class_names)}
-        labels = np.array([label_map[label] for label in labels])
+        # List all the files once, keeping the class of each one
+        file_paths, labels, _ = list_tiff_files(data_dir, class_names)
+        if not file_paths:
+            return np.empty((0,)), labels
+
+        # Preallocate the images from the shape and data type of the first file
+        with tifffile.TiffFile(file_paths[0]) as tif:
+            series = tif.series[0]
+            images = np.empty((len(file_paths),) + tuple(series.shape), dtype=series.dtype)
+
+        def read_image(index: int) -> None:
+            with tifffile.TiffFile(file_paths[index]) as tif:
+                if tuple(tif.series[0].shape) != images.shape[1:]:
+                    raise ValueError(f"'{file_paths[index]}' has shape {tif.series[0].shape}, expected {images.shape[1:]}.")
+                tif.asarray(out=images[index])
+
+        # Decode the files in parallel
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for _ in executor.map(read_image, range(len(file_paths))):
+                pass
 
         return images, labels
     
+    def load_packed_data(self, file_path: str, class_names: Optional[List[str]]=None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Load the data from a packed dataset file.
+
+        The images are memory-mapped, so this returns almost immediately regardless of the dataset size.
+
+        args:
+            file_path (str): Path to the packed dataset file.
+            class_names (List[str]): The classes in label order. Defaults to the classes of the file.
+
+        returns:
+            images (np.memmap): The image data.
+            labels (np.array): The labels for the image data.
+
+        raises:
+            ValueError: If the file path is not set.
+        '''
+        if file_path is None:
+            raise ValueError("Data file not set.")
+
+        dataset = PackedDataset(file_path)
+        return dataset.windows, dataset.get_labels(class_names)
+
+    def load_data(self, data_path: str, class_names: Optional[List[str]]=None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Load a dataset stored either as a packed dataset file or as a folder of TIFF files.
+
+        args:
+            data_path (str): Path to the packed dataset file or to the TIFF folder.
+            class_names (List[str]): The classes in label order.
+
+        returns:
+            images (np.array): The image data.
+            labels (np.array): The labels for the image data.
+        '''
+        if data_path is not None and data_path.endswith(PACKED_EXTENSION):
+            return self.load_packed_data(data_path, class_names)
+        return self.load_tiff_data(data_path, class_names=class_names)
+
+    def convert_tiff_to_packed(self, data_dir: str, file_path: str, batch_size: int=1024) -> str:
+        '''
+        Convert a folder of TIFF files into a packed dataset file.
+
+        The classes are sorted by name in both formats, so both produce the same labels.
+
+        args:
+            data_dir (str): The directory containing the TIFF files.
+            file_path (str): Path to the packed dataset file.
+            batch_size (int): The number of images written at once.
+
+        returns:
+            str: Path to the packed dataset file.
+
+        raises:
+            ValueError: If the data directory is not set or contains no TIFF files.
+        '''
+        if data_dir is None:
+            raise ValueError("Data directory not set.")
+
+        class_names = sorted(os.listdir(data_dir))
+        file_paths = {class_name: [os.path.join(data_dir, class_name, file_name) for file_name in os.listdir(os.path.join(data_dir, class_name))]
+                      for class_name in class_names}
+        first_path = next((paths[0] for paths in file_paths.values() if paths), None)
+        if first_path is None:
+            raise ValueError(f"No TIFF files found in '{data_dir}'.")
+        sample = tifffile.imread(first_path)
+
+        with PackedDatasetWriter(file_path, window_shape=sample.shape, dtype=sample.dtype, metadata={'source': os.path.abspath(data_dir)},
+                                 class_names=class_names) as writer:
+            for class_name in tqdm(class_names, desc="Converting", colour="green", unit="classes"):
+                paths = file_paths[class_name]
+                for start in range(0, len(paths), batch_size):
+                    images = np.stack([tifffile.imread(path) for path in paths[start: start+batch_size]])
+                    writer.append(images, class_name, session=os.path.basename(os.path.normpath(data_dir)))
+
+        return file_path
+
     def load_train_test_val_directories(self)-> None:
         '''
-        Load the training, validation and test datasets from the TIFF files in the specified directories.
+        Load the training, validation and test datasets from the TIFF folders or packed dataset files in the specified paths.
+
+        The labels of the three datasets refer to the same classes, sorted by name.
         '''
-        self.train_images, self.train_labels = self.load_tiff_data(self.train_dataset_path)
-        self.val_images, self.val_labels = self.load_tiff_data(self.validation_dataset_path)
-        self.test_images, self.test_labels = self.load_tiff_data(self.test_dataset_path)
\ No newline at end of file
+        self.class_names = get_shared_class_names([self.train_dataset_path, self.validation_dataset_path, self.test_dataset_path])
+
+        # Load the three splits concurrently
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            train = executor.submit(self.load_data, self.train_dataset_path, self.class_names)
+            val = executor.submit(self.load_data, self.validation_dataset_path, self.class_names)
+            test = executor.submit(self.load_data, self.test_dataset_path, self.class_names)
+
+            self.train_images, self.train_labels = train.result()
+            self.val_images, self.val_labels = val.result()
+            self.test_images, self.test_labels = test.result()
+
+
+def list_tiff_files(data_dir: str, class_names: Optional[List[str]]=None) -> Tuple[List[str], np.ndarray, List[str]]:
+    """
+    List the TIFF files of a dataset folder with one subfolder per class.
+
+    args:
+        data_dir (str): The directory containing the class folders.
+        class_names (List[str]): The classes in label order. Defaults to the class folders sorted by name.
+
+    returns:
+        Tuple[List[str], np.ndarray, List[str]]: The path and integer label of each file, and the class names in label order.
+
+    raises:
+        ValueError: If a class folder is not in class_names.
+    """
+    file_paths = []
+    labels = []
+    folder_names = sorted(os.listdir(data_dir))
+    class_names = folder_names if class_names is None else list(class_names)
+    for class_name in folder_names:
+        if class_name not in class_names:
+            raise ValueError(f"Class '{class_name}' of '{data_dir}' is not in {class_names}.")
+        class_dir = os.path.join(data_dir, class_name)
+        for file_name in os.listdir(class_dir):
+            file_paths.append(os.path.join(class_dir, file_name))
+            labels.append(class_names.index(class_name))
+    return file_paths, np.array(labels, dtype=int), class_names
+
+
+def get_class_names(data_path: str) -> List[str]:
+    """
+    Get the classes of a stored dataset without loading it.
+
+    args:
+        data_path (str): Path to the packed dataset file or to the TIFF folder.
+
+    returns:
+        List[str]: The class names, sorted by name.
+    """
+    if data_path.endswith(PACKED_EXTENSION):
+        return sorted(PackedDataset(data_path).class_names)
+    return sorted(os.listdir(data_path))
+
+
+def get_shared_class_names(data_paths: List[str]) -> List[str]:
+    """
+    Get one class order for several stored datasets, so their labels can be compared (e.g. the train, validation and test datasets).
+
+    args:
+        data_paths (List[str]): Paths to the packed dataset files or TIFF folders. Unset paths are skipped.
+
+    returns:
+        List[str]: The classes of all the datasets, sorted by name.
+    """
+    return sorted(set().union(*(get_class_names(data_path) for data_path in data_paths if data_path is not None)))
+
+
+def split_classes(df: pd.DataFrame, montage: Montage=CYTON_MONTAGE) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Split a merged dataset into the channel readings of each class.
+
+    args:
+        df (pd.DataFrame): The dataset as a DataFrame, with the channels as the first columns and a 'Class' column.
+        montage (Montage): The electrode layout of the headset.
+
+    returns:
+        List[Tuple[str, np.ndarray, np.ndarray]]: (class, channel readings, row index of each reading) for each class.
+    """
+    classes = []
+    for _class in df['Class'].unique().tolist():
+        class_df = df[df['Class'] == _class]
+        classes.append((_class, class_df.iloc[:, :montage.num_channels].to_numpy(), class_df.index.to_numpy()))
+    return classes
+
+
+def load_oneill_classes(file_path: str, montage: Montage=CYTON_MONTAGE) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Load a merged CSV recording and split it into the channel readings of each class.
+
+    Runs in the worker processes of DatasetHandler.preprocess_oneill_batch.
+
+    args:
+        file_path (str): Path to the merged CSV recording.
+        montage (Montage): The electrode layout of the headset.
+
+    returns:
+        List[Tuple[str, np.ndarray, np.ndarray]]: (class, channel readings, row index of each reading) for each class.
+    """
+    return split_classes(pd.read_csv(file_path), montage)
+
+
+def preprocess_oneill_task(task: dict) -> Optional[np.ndarray]:
+    """
+    Build, normalize and (for TIFF output) store one batch of O'Neill windows.
+
+    Runs in the worker processes of DatasetHandler._run_oneill_jobs.
+
+    args:
+        task (dict): The batch, as created by DatasetHandler._run_oneill_jobs.
+
+    returns:
+        np.ndarray or None: The windows for packed output, None when they were written as TIFF images.
+    """
+    # Keep float32 readings in float32, build everything else in float64
+    dtype = np.result_type(task['channel_values'].dtype, np.float32)
+    if task.get('compact'):
+        # The grid positions without an electrode are all zeros, so they are left out and rebuilt by the model
+        samples = task['channel_values'].astype(dtype, copy=False)
+    else:
+        samples = DatasetHandler.get_spatial_matrices(task['channel_values'], task['montage'], dtype)
+    images = DatasetHandler.get_windows(samples, task['window_size'], task['overlap'])
+
+    # Normalize the whole batch of images about the depth axis (the zero grid positions normalize to zero)
+    if task['normalize']:
+        images = DatasetHandler.normalize_windows(images)
+
+    if task['folder_path'] is None:
+        return np.ascontiguousarray(images)
+
+    for offset, image in enumerate(images):
+        # Save TIFF image in class folder
+        file_path = os.path.join(task['folder_path'], f"{task['class']}_{task['first_index']+offset}.tif")
+        tifffile.imwrite(file_path, np.ascontiguousarray(image))
+    return None
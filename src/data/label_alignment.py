@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+
+def to_epoch_seconds(timestamps: Union[Sequence, np.ndarray, pd.Series]) -> np.ndarray:
+    '''
+    Convert timestamps to float64 seconds since the epoch.
+
+    Numeric timestamps (unix time, as written by BrainFlow and the subject GUI) are returned as they are;
+    date-time strings (as written by the key loggers) are parsed once, vectorized.
+
+    args:
+        timestamps (Union[Sequence, np.ndarray, pd.Series]): The timestamps.
+
+    returns:
+        np.ndarray: The timestamps in seconds.
+    '''
+    values = np.asarray(timestamps)
+    if np.issubdtype(values.dtype, np.number):
+        return values
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype(np.int64) / 1e9
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype('datetime64[ns]').astype(np.int64) / 1e9
+
+
+def align_labels(sample_timestamps: np.ndarray, cue_timestamps: np.ndarray, end_timestamp: Optional[float]=None) -> np.ndarray:
+    '''
+    Find the cue interval each sample falls in.
+
+    Cue i covers [cue_timestamps[i], cue_timestamps[i+1]); the last cue lasts until end_timestamp (or forever).
+
+    args:
+        sample_timestamps (np.ndarray): The timestamps of the samples.
+        cue_timestamps (np.ndarray): The start time of each cue, sorted in ascending order.
+        end_timestamp (float): The end of the last cue.
+
+    returns:
+        np.ndarray: The index of the cue of each sample, -1 for samples outside every cue.
+    '''
+    sample_timestamps = np.asarray(sample_timestamps)
+    cue_timestamps = np.asarray(cue_timestamps, dtype=np.result_type(sample_timestamps.dtype, np.asarray(cue_timestamps).dtype))
+    cue_indices = np.searchsorted(cue_timestamps, sample_timestamps, side='right') - 1
+    if end_timestamp is not None:
+        cue_indices[sample_timestamps >= end_timestamp] = -1
+    return cue_indices
+
+
+def label_dataset(sensor_df: pd.DataFrame, class_dfs: Union[pd.DataFrame, Iterable[pd.DataFrame]], exclude: Iterable[str]=("Instructions",),
+                  end_timestamp: Optional[float]=None, timestamp_column: str='Timestamp', class_column: str='Class') -> pd.DataFrame:
+    '''
+    Label the samples of a recording with the cue interval they fall in.
+
+    Samples before the first cue and samples of excluded classes are dropped with a single row selection.
+
+    args:
+        sensor_df (pd.DataFrame): The sensor data, with a timestamp column.
+        class_dfs (Union[pd.DataFrame, Iterable[pd.DataFrame]]): One or more marker files with class and timestamp columns.
+        exclude (Iterable[str]): The classes to drop.
+        end_timestamp (float): The end of the last cue.
+        timestamp_column (str): The name of the timestamp column.
+        class_column (str): The name of the class column.
+
+    returns:
+        pd.DataFrame: The labeled samples, with the class column appended.
+    '''
+    if isinstance(class_dfs, pd.DataFrame):
+        class_dfs = [class_dfs]
+    class_dfs = list(class_dfs)
+
+    # Sort the cues of every marker file by time
+    cue_timestamps = np.concatenate([to_epoch_seconds(class_df[timestamp_column]) for class_df in class_dfs])
+    cue_classes = np.concatenate([class_df[class_column].to_numpy(dtype=object) for class_df in class_dfs])
+    order = np.argsort(cue_timestamps, kind='stable')
+    cue_timestamps = cue_timestamps[order]
+    cue_classes = cue_classes[order]
+
+    # Encode the classes once, so the labels of the samples are small integers
+    class_names, cue_codes = np.unique(cue_classes.astype(str), return_inverse=True)
+    cue_indices = align_labels(to_epoch_seconds(sensor_df[timestamp_column]), cue_timestamps, end_timestamp)
+
+    # Keep the samples inside a cue of a class that is not excluded
+    keep_class = ~np.isin(class_names, list(exclude))
+    keep = cue_indices >= 0
+    keep[keep] = keep_class[cue_codes[cue_indices[keep]]]
+    rows = np.flatnonzero(keep)
+
+    # Gather the kept rows column by column, so the samples are copied exactly once
+    columns = {name: sensor_df[name].to_numpy()[rows] for name in sensor_df.columns}
+    columns[class_column] = pd.Categorical.from_codes(cue_codes[cue_indices[rows]], categories=class_names).remove_unused_categories()
+    return pd.DataFrame(columns, index=sensor_df.index[rows], copy=False)
+
+
+def labels_from_markers(markers: np.ndarray, previous_code: int=0) -> np.ndarray:
+    '''
+    Find the cue each sample falls in from the marker row of the board, where each cue was stamped as it was shown.
+
+    args:
+        markers (np.ndarray): The marker value of each sample, 0 for samples without marker.
+        previous_code (int): The cue code in effect before the first sample (e.g. the last code of the previous chunk).
+
+    returns:
+        np.ndarray: The code of the last marker at or before each sample, previous_code before the first marker.
+    '''
+    markers = np.asarray(markers)
+    marker_positions = np.where(markers != 0, np.arange(len(markers)), -1)
+    np.maximum.accumulate(marker_positions, out=marker_positions)
+    codes = np.where(marker_positions >= 0, markers[marker_positions], previous_code)
+    return codes.astype(np.int64)
+
+
+def label_by_markers(sensor_df: pd.DataFrame, codes: np.ndarray, marker_classes: Dict[int, str], exclude: Iterable[str]=("Instructions",),
+                     class_column: str='Class') -> pd.DataFrame:
+    '''
+    Label the samples of a recording with the class of their cue code (see labels_from_markers).
+
+    Samples whose code has no class (no cue yet, or the end of the experiment) and samples of excluded classes are dropped.
+
+    args:
+        sensor_df (pd.DataFrame): The sensor data.
+        codes (np.ndarray): The cue code of each sample.
+        marker_classes (Dict[int, str]): The class of each marker value.
+        exclude (Iterable[str]): The classes to drop.
+        class_column (str): The name of the class column.
+
+    returns:
+        pd.DataFrame: The labeled samples, with the class column appended.
+    '''
+    kept_codes = {int(code): name for code, name in marker_classes.items() if name not in set(exclude)}
+    class_names = sorted(set(kept_codes.values()))
+
+    # Map the codes to class indices once, through a lookup table
+    lookup = np.full(max(list(kept_codes) + [0]) + 1, -1, dtype=np.int64)
+    for code, name in kept_codes.items():
+        lookup[code] = class_names.index(name)
+    codes = np.asarray(codes, dtype=np.int64)
+    valid = (codes >= 0) & (codes < len(lookup))
+    class_indices = np.full(len(codes), -1, dtype=np.int64)
+    class_indices[valid] = lookup[codes[valid]]
+    rows = np.flatnonzero(class_indices >= 0)
+
+    # Gather the kept rows column by column, so the samples are copied exactly once
+    columns = {name: sensor_df[name].to_numpy()[rows] for name in sensor_df.columns}
+    columns[class_column] = pd.Categorical.from_codes(class_indices[rows], categories=class_names).remove_unused_categories()
+    return pd.DataFrame(columns, index=sensor_df.index[rows], copy=False)
+
+
+def label_sessions(sessions: Iterable[Tuple[pd.DataFrame, Union[pd.DataFrame, Iterable[pd.DataFrame]]]], exclude: Iterable[str]=("Instructions",),
+                   session_names: Optional[Sequence[str]]=None, timestamp_column: str='Timestamp', class_column: str='Class') -> pd.DataFrame:
+    '''
+    Label many recordings at once.
+
+    args:
+        sessions (Iterable[Tuple[pd.DataFrame, Union[pd.DataFrame, Iterable[pd.DataFrame]]]]): (sensor data, marker files) of each recording.
+        exclude (Iterable[str]): The classes to drop.
+        session_names (Sequence[str]): If given, a 'Session' column with the name of each recording is added.
+        timestamp_column (str): The name of the timestamp column.
+        class_column (str): The name of the class column.
+
+    returns:
+        pd.DataFrame: The labeled samples of all recordings, one after another.
+    '''
+    labeled_dfs = []
+    for number, (sensor_df, class_dfs) in enumerate(sessions):
+        labeled_df = label_dataset(sensor_df, class_dfs, exclude, timestamp_column=timestamp_column, class_column=class_column)
+        if session_names is not None:
+            labeled_df = labeled_df.assign(Session=session_names[number])
+        labeled_dfs.append(labeled_df)
+
+    # Classes may differ between recordings, so merge them back into plain strings
+    labeled_df = pd.concat(labeled_dfs, ignore_index=True)
+    labeled_df[class_column] = labeled_df[class_column].astype(str)
+    return labeled_df
@@ -0,0 +1,110 @@
+import numpy as np
+from typing import Iterable, Tuple
+
+
+class Montage():
+    '''
+    A class to describe where each electrode of a headset sits on the spatial grid.
+    '''
+    def __init__(self, name: str, grid_shape: Tuple[int, int], positions: Iterable[Tuple[int, int]]) -> None:
+        '''
+        Constructor for the Montage class.
+
+        args:
+            name (str): The name of the montage.
+            grid_shape (Tuple[int, int]): The (rows, columns) of the spatial grid.
+            positions (Iterable[Tuple[int, int]]): The (row, column) of each channel, in channel order.
+
+        raises:
+            ValueError: If a position falls outside the grid or two channels share a position.
+        '''
+        self.name = name
+        self.grid_shape = tuple(grid_shape)
+        self.positions = [tuple(position) for position in positions]
+
+        # Validate the electrode positions
+        for row, col in self.positions:
+            if not (0 <= row < self.grid_shape[0] and 0 <= col < self.grid_shape[1]):
+                raise ValueError(f"Position {(row, col)} is outside the {self.grid_shape} grid of montage '{name}'.")
+        if len(set(self.positions)) != len(self.positions):
+            raise ValueError(f"Montage '{name}' maps two channels to the same grid position.")
+
+        # Precompute the index maps used to scatter channel readings into the grid
+        self.rows = np.array([row for row, _ in self.positions], dtype=np.intp)
+        self.cols = np.array([col for _, col in self.positions], dtype=np.intp)
+
+    @property
+    def num_channels(self) -> int:
+        '''
+        The number of channels in the montage.
+        '''
+        return len(self.positions)
+
+    def expand(self, windows: np.ndarray) -> np.ndarray:
+        '''
+        Scatter compact channel readings into the spatial grid.
+
+        args:
+            windows (np.ndarray): Readings with the channels along the last axis, e.g. (num_windows, window_size, num_channels).
+
+        returns:
+            np.ndarray: The readings with the last axis replaced by the grid, zero where there is no electrode.
+        '''
+        windows = np.asarray(windows)
+        grids = np.zeros(windows.shape[:-1] + self.grid_shape, dtype=windows.dtype)
+        grids[..., self.rows, self.cols] = windows
+        return grids
+
+    def compact(self, grids: np.ndarray) -> np.ndarray:
+        '''
+        Gather the channel readings from the spatial grid, the inverse of expand.
+
+        args:
+            grids (np.ndarray): Readings with the grid along the last two axes.
+
+        returns:
+            np.ndarray: The readings with the channels along the last axis.
+        '''
+        return np.asarray(grids)[..., self.rows, self.cols]
+
+    def __repr__(self) -> str:
+        return f"Montage(name='{self.name}', grid_shape={self.grid_shape}, num_channels={self.num_channels})"
+
+
+# OpenBCI Cyton (8 channels): Fp1, Fp2, C3, C4, P7, P8, O1, O2
+CYTON_MONTAGE = Montage("Cyton",
+                        grid_shape=(10, 11),
+                        positions=[(0, 4), (0, 6),
+                                   (4, 3), (4, 7),
+                                   (6, 1), (6, 9),
+                                   (9, 4), (9, 6)])
+
+# OpenBCI Cyton + Daisy (16 channels): the Cyton electrodes followed by F7, F8, F3, F4, T7, T8, P3, P4
+CYTON_DAISY_MONTAGE = Montage("Cyton+Daisy",
+                              grid_shape=(10, 11),
+                              positions=CYTON_MONTAGE.positions + [(2, 1), (2, 9),
+                                                                   (2, 3), (2, 7),
+                                                                   (4, 1), (4, 9),
+                                                                   (6, 3), (6, 7)])
+
+# Available montages by name
+MONTAGES = {montage.name: montage for montage in (CYTON_MONTAGE, CYTON_DAISY_MONTAGE)}
+
+
+def get_montage(num_channels: int) -> Montage:
+    '''
+    Get the montage of a headset from its number of channels.
+
+    args:
+        num_channels (int): The number of channels.
+
+    returns:
+        Montage: The montage.
+
+    raises:
+        ValueError: If no montage has that number of channels.
+    '''
+    for montage in MONTAGES.values():
+        if montage.num_channels == num_channels:
+            return montage
+    raise ValueError(f"No montage with {num_channels} channels.")
@@ -0,0 +1,249 @@
+'''
+Concurrent acquisition from several boards, e.g. to record several subjects at once from one workstation.
+
+Run from the src folder, e.g.:
+    python -m data.multi_board --serial-numbers DM0258NJA DM0261XYZ --duration 600
+    python -m data.multi_board --replay ../data/raw/session.smmrlog --boards 4 --speed 8 --duration 10
+'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from brainflow.board_shim import BoardIds
+
+from data.data_collector import DataCollector, find_BCI_headset_ports
+from data.session_recorder import LOG_EXTENSION
+
+
+class SharedClock():
+    '''
+    A monotonic clock in unix seconds, shared by the boards of a session.
+
+    BrainFlow stamps every sample with the wall clock of the computer when it arrives. The wall clock can jump
+    (NTP corrections, daylight saving changes on some systems), so the timestamps of boards whose polls straddle a
+    jump would not be comparable. The shared clock follows the monotonic clock from a single wall clock reading,
+    and timestamps are moved onto it at every poll.
+    '''
+    def __init__(self) -> None:
+        '''
+        Constructor for the SharedClock class.
+        '''
+        self.wall_epoch = time.time()
+        self.monotonic_epoch = time.monotonic()
+
+    def now(self) -> float:
+        '''
+        The current time in unix seconds.
+        '''
+        return self.wall_epoch + time.monotonic() - self.monotonic_epoch
+
+    def from_wall(self, timestamps: np.ndarray) -> np.ndarray:
+        '''
+        Move wall clock timestamps taken just before now onto the shared clock.
+
+        args:
+            timestamps (np.ndarray): The wall clock timestamps in unix seconds.
+
+        returns:
+            np.ndarray: The timestamps in unix seconds of the shared clock.
+        '''
+        return timestamps + (self.now() - time.time())
+
+
+class MultiBoardManager():
+    '''
+    A class to acquire from several boards at once, each with its own acquisition thread, ring buffer and session log.
+    '''
+    def __init__(self, collectors: Dict[str, DataCollector]) -> None:
+        '''
+        Constructor for the MultiBoardManager class.
+
+        args:
+            collectors (Dict[str, DataCollector]): The data collector of each board, by board name (e.g. the subject or serial number).
+
+        raises:
+            ValueError: If no collector is given.
+        '''
+        if not collectors:
+            raise ValueError("No board to acquire from.")
+        self.collectors = dict(collectors)
+        self.clock = SharedClock()
+        self.log_paths = {}
+
+    @classmethod
+    def from_serial_numbers(cls, serial_numbers: Iterable[str], board_id: int=BoardIds.CYTON_BOARD.value) -> 'MultiBoardManager':
+        '''
+        Create a manager for the headsets with the given dongle serial numbers.
+
+        args:
+            serial_numbers (Iterable[str]): The serial numbers of the dongles.
+            board_id (int): The BrainFlow id of the boards.
+
+        returns:
+            MultiBoardManager: The manager, with the boards named by serial number.
+        '''
+        return cls({serial_number: DataCollector(board_id=board_id, serial_number=serial_number) for serial_number in serial_numbers})
+
+    @classmethod
+    def discover(cls, board_id: int=BoardIds.CYTON_BOARD.value) -> 'MultiBoardManager':
+        '''
+        Create a manager for every OpenBCI dongle plugged into the computer.
+
+        args:
+            board_id (int): The BrainFlow id of the boards.
+
+        returns:
+            MultiBoardManager: The manager, with the boards named by serial number.
+        '''
+        return cls.from_serial_numbers([port.serial_number for port in find_BCI_headset_ports()], board_id)
+
+    def start(self, log_folder: str, poll_rate: float=50.0, buffer_seconds: float=30.0, flush_interval: float=1.0) -> Dict[str, str]:
+        '''
+        Start streaming and acquiring from every board, logging each board to its own session log.
+
+        The boards are prepared concurrently, since preparing a Cyton session takes a few seconds. A board that fails
+        to connect or to start is reported and left out; the other boards are not affected.
+
+        args:
+            log_folder (str): The folder of the session logs.
+            poll_rate (float): The number of times per second each board is drained.
+            buffer_seconds (float): The number of seconds of samples kept in each ring buffer.
+            flush_interval (float): The time in seconds between two writes to each session log.
+
+        returns:
+            Dict[str, str]: The session log of each started board.
+        '''
+        session_time = time.strftime("%Y%m%d_%H%M%S")
+
+        def start_board(name: str) -> Optional[str]:
+            collector = self.collectors[name]
+            if not collector.is_connected():
+                print(f"Board '{name}' not found. Please check the connection.")
+                return None
+            try:
+                collector.start_streaming()
+            except Exception as error:
+                print(f"Failed to start streaming from board '{name}': {error}")
+                return None
+            log_path = os.path.join(log_folder, f"session_{session_time}_{name}{LOG_EXTENSION}")
+            try:
+                collector.start_acquisition(poll_rate=poll_rate, buffer_seconds=buffer_seconds, record=False, log_path=log_path,
+                                            flush_interval=flush_interval, clock=self.clock)
+            except Exception as error:
+                # Leave no board streaming without an acquisition that stop() would end
+                print(f"Failed to start acquiring from board '{name}': {error}")
+                collector.stop_event.set()
+                if collector.acquisition_thread is not None:
+                    collector.acquisition_thread.join()
+                    collector.acquisition_thread = None
+                try:
+                    collector.stop_streaming()
+                except Exception as stop_error:
+                    print(f"Failed to stop streaming from board '{name}': {stop_error}")
+                return None
+            return log_path
+
+        os.makedirs(log_folder, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=len(self.collectors)) as executor:
+            log_paths = dict(zip(self.collectors, executor.map(start_board, self.collectors)))
+        self.log_paths = {name: log_path for name, log_path in log_paths.items() if log_path is not None}
+        return self.log_paths
+
+    def get_latest(self, name: str, num_samples: int) -> np.ndarray:
+        '''
+        Get the latest samples of one board.
+
+        args:
+            name (str): The name of the board.
+            num_samples (int): The number of samples.
+
+        returns:
+            np.ndarray: A zero-copy view with shape (num_samples, board rows), oldest first. Copy it to keep it.
+        '''
+        return self.collectors[name].get_latest(num_samples)
+
+    def get_stats(self) -> Dict[str, dict]:
+        '''
+        Get the acquisition counters of every started board (see DataCollector.get_stats).
+
+        returns:
+            Dict[str, dict]: The counters of each board.
+        '''
+        return {name: self.collectors[name].get_stats() for name in self.log_paths}
+
+    def report(self) -> str:
+        '''
+        Get a summary of the acquisition, one line per board.
+
+        returns:
+            str: The sample rate, lost and dropped samples and log backlog of each board.
+        '''
+        lines = []
+        for name, stats in self.get_stats().items():
+            lines.append(f"{name}: {stats['samples']} samples, {stats['sample_rate']:.1f}/{stats['nominal_sample_rate']:g} Hz, "
+                         f"{stats['lost']} lost, {stats['log_dropped']} dropped from the log, log backlog {stats['log_backlog']:.0%}")
+        return "\n".join(lines)
+
+    def stop(self) -> Dict[str, str]:
+        '''
+        Stop acquiring and streaming from every started board and complete their session logs.
+
+        returns:
+            Dict[str, str]: The session log of each board.
+        '''
+        # Stop every acquisition first so all streams end at about the same time
+        for collector in self.started_collectors():
+            collector.stop_event.set()
+        for name, collector in zip(self.log_paths, self.started_collectors()):
+            collector.stop_acquisition()
+            try:
+                collector.stop_streaming()
+            except Exception as error:
+                print(f"Failed to stop streaming from board '{name}': {error}")
+        log_paths = self.log_paths
+        self.log_paths = {}
+        return log_paths
+
+    def started_collectors(self) -> list:
+        '''
+        Get the data collectors of the started boards.
+        '''
+        return [self.collectors[name] for name in self.log_paths]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record from several boards at once.")
+    parser.add_argument("--serial-numbers", type=str, nargs='+', default=None, help="Serial numbers of the dongles (default: every OpenBCI dongle found).")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of BrainFlow synthetic boards instead of headsets.")
+    parser.add_argument("--replay", type=str, default=None, help="Session log or CSV file replayed by every board instead of headsets.")
+    parser.add_argument("--boards", type=int, default=2, help="Number of replayed boards.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed as a multiple of real time.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Recording time in seconds.")
+    parser.add_argument("--log-folder", type=str, default=os.path.join("..", "data", "raw"), help="Folder of the session logs.")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between two reports.")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        manager = MultiBoardManager({f"replay{n}": DataCollector(replay_file=args.replay, replay_speed=args.speed, replay_loop=True)
+                                     for n in range(args.boards)})
+    elif args.synthetic:
+        manager = MultiBoardManager({f"synthetic{n}": DataCollector(board_id=BoardIds.SYNTHETIC_BOARD.value, serial_number=f"synthetic{n}")
+                                     for n in range(args.synthetic)})
+    elif args.serial_numbers:
+        manager = MultiBoardManager.from_serial_numbers(args.serial_numbers)
+    else:
+        manager = MultiBoardManager.discover()
+
+    print(f"Session logs: {manager.start(args.log_folder)}")
+    end_time = time.monotonic() + args.duration
+    try:
+        while time.monotonic() < end_time:
+            time.sleep(min(args.report_interval, max(0.0, end_time - time.monotonic())))
+            print(manager.report())
+    except KeyboardInterrupt:
+        pass
+    manager.stop()
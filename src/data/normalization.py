@@ -0,0 +1,376 @@
+import numpy as np
+from typing import Optional, Tuple
+
+from scipy.signal import lfilter
+
+# Relative rounding error of float64, per sample of a running statistic
+ROUND_OFF = np.finfo(np.float64).eps
+
+
+def normalize_windows(windows: np.ndarray, axis: int=1) -> np.ndarray:
+    '''
+    Z-score a batch of windows about their depth axis.
+
+    Equivalent to scipy.stats.zscore(windows, axis=axis) followed by replacing NaN values (constant cells) with 0.
+
+    args:
+        windows (np.ndarray): The windows with shape (num_windows, window_size, ...).
+        axis (int): The depth axis.
+
+    returns:
+        np.ndarray: The normalized windows.
+    '''
+    windows = np.asarray(windows)
+    if not np.issubdtype(windows.dtype, np.inexact):
+        windows = windows.astype(np.float64)
+    mean = windows.mean(axis=axis, keepdims=True)
+    std = windows.std(axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized_windows = (windows - mean) / std
+    # Replace NaN values with 0
+    np.nan_to_num(normalized_windows, copy=False, nan=0.0)
+    # Constant cells (e.g. a railed channel) have a tiny but nonzero std from rounding; zscore returns NaN, so 0, for them
+    normalized_windows[np.broadcast_to(is_constant(windows, axis), normalized_windows.shape)] = 0.0
+    return normalized_windows
+
+
+def is_constant(windows: np.ndarray, axis: int=1) -> np.ndarray:
+    '''
+    Find the cells whose samples along the axis are all equal, as scipy.stats.zscore does.
+
+    args:
+        windows (np.ndarray): The windows.
+        axis (int): The depth axis.
+
+    returns:
+        np.ndarray: Whether each cell is constant, with the axis kept with size 1.
+    '''
+    return (windows == windows.take([0], axis=axis)).all(axis=axis, keepdims=True)
+
+
+class RunningStats():
+    '''
+    A class to keep the running mean and variance of a stream of samples (Welford's algorithm).
+
+    Chunks are merged with the parallel form of the algorithm (Chan et al.), so adding or removing
+    k samples costs O(k) vectorized work and the result does not depend on how the stream is chunked.
+    '''
+    def __init__(self, feature_shape: Tuple[int, ...]=()) -> None:
+        '''
+        Constructor for the RunningStats class.
+
+        args:
+            feature_shape (Tuple[int, ...]): The shape of a single sample.
+        '''
+        self.feature_shape = tuple(feature_shape)
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        Forget every sample.
+        '''
+        self.count = 0
+        self.mean = np.zeros(self.feature_shape)
+        self.m2 = np.zeros(self.feature_shape)
+
+    def update(self, samples: np.ndarray) -> None:
+        '''
+        Add samples to the statistics.
+
+        args:
+            samples (np.ndarray): The samples with shape (num_samples, *feature_shape).
+        '''
+        if len(samples) == 0:
+            return
+        count = len(samples)
+        mean = samples.mean(axis=0)
+        m2 = ((samples - mean) ** 2).sum(axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+
+    def remove(self, samples: np.ndarray) -> None:
+        '''
+        Remove samples that were previously added (e.g. samples leaving a sliding window).
+
+        args:
+            samples (np.ndarray): The samples with shape (num_samples, *feature_shape).
+        '''
+        if len(samples) == 0:
+            return
+        count = len(samples)
+        total = self.count - count
+        if total <= 0:
+            self.reset()
+            return
+        mean = samples.mean(axis=0)
+        m2 = ((samples - mean) ** 2).sum(axis=0)
+
+        remaining_mean = (self.count * self.mean - count * mean) / total
+        delta = mean - remaining_mean
+        self.m2 = np.maximum(self.m2 - m2 - delta ** 2 * (total * count / self.count), 0.0)
+        self.mean = remaining_mean
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        '''
+        The population variance (ddof=0), as used by scipy.stats.zscore.
+        '''
+        return self.m2 / self.count if self.count else np.full(self.feature_shape, np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        '''
+        The population standard deviation.
+        '''
+        return np.sqrt(self.variance)
+
+
+class RunningNormalizer():
+    '''
+    A class to z-score samples with running statistics, shared by offline preprocessing and live inference.
+
+    Modes:
+        window:  Each window is z-scored with its own statistics, like the O'Neill preprocessing.
+                 Offline, normalize_windows handles a whole batch of windows at once. Live, update keeps the
+                 statistics of the latest window_size samples so normalize_window costs O(1) per new sample.
+        sliding: Every sample is z-scored with the statistics of the window_size samples ending at it.
+        ewm:     Every sample is z-scored with exponentially-weighted statistics (smoothing factor alpha).
+    '''
+    MODES = ("window", "sliding", "ewm")
+
+    def __init__(self, mode: str="window", window_size: int=64, alpha: float=0.05, feature_shape: Optional[Tuple[int, ...]]=None) -> None:
+        '''
+        Constructor for the RunningNormalizer class.
+
+        args:
+            mode (str): "window", "sliding" or "ewm".
+            window_size (int): The number of samples of the window and sliding modes.
+            alpha (float): The smoothing factor of the ewm mode.
+            feature_shape (Tuple[int, ...]): The shape of a single sample. Inferred from the first update if None.
+
+        raises:
+            ValueError: If the mode is not supported.
+        '''
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid normalization mode '{mode}'")
+        self.mode = mode
+        self.window_size = int(window_size)
+        self.alpha = alpha
+        self.feature_shape = feature_shape
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        Forget the state of the stream.
+        '''
+        # Ring buffer with the last window_size samples and the number of samples seen so far
+        self.history = None
+        self.num_samples = 0
+        self.samples_since_sync = 0
+
+        # Window mode: Welford statistics of the samples in the ring buffer
+        self.stats = None
+
+        # Sliding mode: sums of the samples in the ring buffer, shifted to avoid cancellation
+        self.shift = None
+        self.sum = None
+        self.squared_sum = None
+
+        # Ewm mode
+        self.ewm_mean = None
+        self.ewm_variance = None
+
+    def normalize_windows(self, windows: np.ndarray) -> np.ndarray:
+        '''
+        Z-score a batch of complete windows, vectorized across windows.
+
+        args:
+            windows (np.ndarray): The windows with shape (num_windows, window_size, ...).
+
+        returns:
+            np.ndarray: The normalized windows.
+        '''
+        return normalize_windows(windows, axis=1)
+
+    def update(self, samples: np.ndarray) -> Optional[np.ndarray]:
+        '''
+        Feed the next chunk of the stream.
+
+        Every mode costs O(1) work per sample, plus an O(window_size) resynchronization once per window_size samples.
+
+        args:
+            samples (np.ndarray): The samples with shape (num_samples, *feature_shape).
+
+        returns:
+            np.ndarray or None: The normalized samples in the sliding and ewm modes, None in the window mode.
+        '''
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return None if self.mode == "window" else samples
+        if self.history is None:
+            self.feature_shape = tuple(samples.shape[1:]) if self.feature_shape is None else tuple(self.feature_shape)
+            self.history = np.zeros((self.window_size,) + self.feature_shape)
+            self.stats = RunningStats(self.feature_shape)
+            self.shift = samples[0].copy()
+            self.sum = np.zeros(self.feature_shape)
+            self.squared_sum = np.zeros(self.feature_shape)
+
+        if self.mode == "window":
+            self._update_window(samples)
+            return None
+
+        if self.mode == "sliding":
+            return self._update_sliding(samples)
+
+        return self._update_ewm(samples)
+
+    def _get_leaving(self, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Get the sample that leaves the window as each of the new samples arrives.
+
+        returns:
+            Tuple[np.ndarray, np.ndarray]: The leaving samples and whether a sample leaves at all.
+        '''
+        positions = self.num_samples + np.arange(len(samples)) - self.window_size
+        leaving = self.history[positions % self.window_size]
+
+        # With chunks longer than the window, the leaving samples come from the chunk itself
+        from_chunk = positions >= self.num_samples
+        leaving[from_chunk] = samples[positions[from_chunk] - self.num_samples]
+        return leaving, positions >= 0
+
+    def _write_history(self, samples: np.ndarray) -> None:
+        '''
+        Write samples into the ring buffer.
+        '''
+        last_samples = samples[-self.window_size:]
+        positions = self.num_samples + len(samples) - len(last_samples) + np.arange(len(last_samples))
+        self.history[positions % self.window_size] = last_samples
+        self.num_samples += len(samples)
+
+    def _get_window(self) -> np.ndarray:
+        '''
+        Get the samples of the ring buffer in stream order.
+        '''
+        count = min(self.num_samples, self.window_size)
+        return self.history[(self.num_samples - count + np.arange(count)) % self.window_size]
+
+    def _update_window(self, samples: np.ndarray) -> None:
+        '''
+        Keep the Welford statistics of the latest window_size samples.
+        '''
+        if len(samples) >= self.window_size or self.samples_since_sync + len(samples) >= self.window_size:
+            # Recompute the statistics from the ring buffer once per window_size samples to stop rounding drift
+            self._write_history(samples)
+            self.stats.reset()
+            self.stats.update(self._get_window())
+            self.samples_since_sync = 0
+            return
+
+        # Remove the samples that leave the window and add the new ones
+        leaving, valid = self._get_leaving(samples)
+        self.stats.remove(leaving[valid])
+        self.stats.update(samples)
+        self._write_history(samples)
+        self.samples_since_sync += len(samples)
+
+    def _update_sliding(self, samples: np.ndarray) -> np.ndarray:
+        '''
+        Z-score every sample with the statistics of the window_size samples ending at it.
+
+        The window sums of every new sample follow from the running sums plus the cumulative sums of the
+        entering and leaving samples, so every sample costs O(1) no matter the window size.
+        '''
+        leaving, valid = self._get_leaving(samples)
+        valid = valid.reshape((-1,) + (1,) * len(self.feature_shape))
+        shifted = samples - self.shift
+        shifted_leaving = np.where(valid, leaving - self.shift, 0.0)
+
+        sums = self.sum + np.cumsum(shifted - shifted_leaving, axis=0)
+        squared_sums = self.squared_sum + np.cumsum(shifted ** 2 - shifted_leaving ** 2, axis=0)
+        counts = np.minimum(self.num_samples + np.arange(1, len(samples) + 1), self.window_size).reshape(valid.shape)
+        mean = sums / counts
+        variance = np.maximum(squared_sums / counts - mean ** 2, 0.0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized_samples = (shifted - mean) / np.sqrt(variance)
+        np.nan_to_num(normalized_samples, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+        self.sum = sums[-1]
+        self.squared_sum = squared_sums[-1]
+        self._write_history(samples)
+        self.samples_since_sync += len(samples)
+
+        if self.samples_since_sync >= self.window_size:
+            # Re-center the sums on the current window once per window_size samples to stop rounding drift
+            window = self._get_window()
+            self.shift = window.mean(axis=0)
+            self.sum = (window - self.shift).sum(axis=0)
+            self.squared_sum = ((window - self.shift) ** 2).sum(axis=0)
+            self.samples_since_sync = 0
+
+        return normalized_samples
+
+    def _update_ewm(self, samples: np.ndarray) -> np.ndarray:
+        '''
+        Z-score every sample with exponentially-weighted statistics.
+
+        The recursions
+            mean[t]     = (1 - alpha) * mean[t-1] + alpha * x[t]
+            variance[t] = (1 - alpha) * (variance[t-1] + alpha * (x[t] - mean[t-1]) ** 2)
+        are linear filters, so a whole chunk is filtered at once.
+        '''
+        if self.ewm_mean is None:
+            self.ewm_mean = samples[0].copy()
+            self.ewm_variance = np.zeros(self.feature_shape)
+
+        decay = 1.0 - self.alpha
+        mean, _ = lfilter([self.alpha], [1.0, -decay], samples, axis=0, zi=(decay * self.ewm_mean)[np.newaxis])
+        previous_mean = np.concatenate((self.ewm_mean[np.newaxis], mean[:-1]))
+        variance, _ = lfilter([1.0], [1.0, -decay], decay * self.alpha * (samples - previous_mean) ** 2, axis=0,
+                              zi=(decay * self.ewm_variance)[np.newaxis])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized_samples = (samples - mean) / np.sqrt(variance)
+        np.nan_to_num(normalized_samples, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+        self.ewm_mean = mean[-1]
+        self.ewm_variance = variance[-1]
+        return normalized_samples
+
+    def normalize_window(self, window: np.ndarray) -> np.ndarray:
+        '''
+        Z-score the latest window of the stream with the running statistics.
+
+        In the window mode this matches normalize_windows on the same window without recomputing its statistics.
+
+        args:
+            window (np.ndarray): The latest window_size samples of the stream.
+
+        returns:
+            np.ndarray: The normalized window.
+        '''
+        if self.mode == "ewm":
+            mean, std = self.ewm_mean, np.sqrt(self.ewm_variance)
+        elif self.mode == "sliding":
+            count = min(self.num_samples, self.window_size)
+            mean = self.shift + self.sum / count
+            std = np.sqrt(np.maximum(self.squared_sum / count - (self.sum / count) ** 2, 0.0))
+        else:
+            mean, std = self.stats.mean, self.stats.std
+        window = np.asarray(window, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized_window = (window - mean) / std
+        np.nan_to_num(normalized_window, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+        # A constant channel leaves a running variance of rounding noise; zero it like normalize_windows does
+        constant = std <= ROUND_OFF * self.window_size * np.abs(mean)
+        if self.mode != "ewm":
+            constant = constant | is_constant(window, axis=0)[0]
+        normalized_window[np.broadcast_to(constant, normalized_window.shape)] = 0.0
+        return normalized_window
@@ -0,0 +1,236 @@
+'''
+Packed single-file dataset format.
+
+Layout of a .smmr file:
+    [0, 64)                 Magic number, format version and padding
+    [64, index_offset)      The windows as one contiguous C-ordered array
+    [index_offset, ...)     One (label, session, offset) record per window
+    [footer_offset, ...)    JSON metadata header
+    last 16 bytes           Footer offset (uint64) followed by the magic number
+'''
+
+import os
+import json
+import struct
+import numpy as np
+from typing import Iterable, Optional, Tuple
+
+# File extension of packed datasets
+PACKED_EXTENSION = ".smmr"
+
+# Magic number written at the start and at the end of the file
+MAGIC = b"SMMRPACK"
+
+# Format version
+VERSION = 1
+
+# Byte offset of the window data (keeps the data 64-byte aligned)
+DATA_OFFSET = 64
+
+# Record of the window index
+INDEX_DTYPE = np.dtype([('label', '<i4'), ('session', '<i4'), ('offset', '<i8')])
+
+# Trailer with the footer offset and the magic number
+TRAILER = struct.Struct("<Q8s")
+
+
+class PackedDatasetWriter():
+    '''
+    A class to write windows into a packed dataset file.
+    '''
+    def __init__(self, file_path: str, window_shape: Tuple[int, ...], dtype: np.dtype=np.float64, metadata: Optional[dict]=None,
+                 class_names: Optional[Iterable[str]]=None) -> None:
+        '''
+        Constructor for the PackedDatasetWriter class.
+
+        args:
+            file_path (str): Path to the packed dataset file.
+            window_shape (Tuple[int, ...]): The shape of a single window.
+            dtype (np.dtype): The data type the windows are stored as.
+            metadata (dict): Additional JSON-serializable metadata (e.g. preprocessing parameters).
+            class_names (Iterable[str]): Classes to list even if no window of them is written. The stored classes are
+                                         sorted by name, so the labels of files written from different recordings agree.
+        '''
+        self.file_path = file_path
+        self.window_shape = tuple(int(n) for n in window_shape)
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict(metadata or {})
+
+        self.class_names = list(class_names or [])
+        self.sessions = []
+        self.index = []
+        self.num_windows = 0
+
+        # Write the file header and move to the start of the window data
+        self.file = open(file_path, 'wb')
+        self.file.write(MAGIC + struct.pack("<I", VERSION))
+        self.file.write(b"\0" * (DATA_OFFSET - self.file.tell()))
+
+    def _get_id(self, names: list, name: str) -> int:
+        '''
+        Get the id of a class or session name, registering it if it is new.
+        '''
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def append(self, windows: np.ndarray, label: str, session: str="", offsets: Optional[Iterable[int]]=None) -> None:
+        '''
+        Append a batch of windows of the same class.
+
+        args:
+            windows (np.ndarray): The windows with shape (num_windows, *window_shape).
+            label (str): The class of the windows.
+            session (str): The recording the windows come from.
+            offsets (Iterable[int]): The sample offset of each window in the recording, -1 if unknown.
+
+        raises:
+            ValueError: If the windows or offsets do not have the expected shape.
+        '''
+        windows = np.asarray(windows)
+        if windows.shape[1:] != self.window_shape:
+            raise ValueError(f"Expected windows of shape {self.window_shape}, got {windows.shape[1:]}.")
+
+        # Build the index records of the windows
+        records = np.empty(len(windows), dtype=INDEX_DTYPE)
+        records['label'] = self._get_id(self.class_names, str(label))
+        records['session'] = self._get_id(self.sessions, str(session))
+        records['offset'] = -1 if offsets is None else np.asarray(offsets, dtype=np.int64)
+        if offsets is not None and len(records['offset']) != len(windows):
+            raise ValueError(f"Expected {len(windows)} offsets, got {len(records['offset'])}.")
+
+        # Write the window data
+        self.file.write(np.ascontiguousarray(windows, dtype=self.dtype).tobytes())
+        self.index.append(records)
+        self.num_windows += len(windows)
+
+    def close(self) -> None:
+        '''
+        Write the index and the metadata header, and close the file.
+        '''
+        if self.file.closed:
+            return
+
+        # Write the index, with the label ids of the classes sorted by name
+        index_offset = self.file.tell()
+        index = np.concatenate(self.index) if self.index else np.empty(0, dtype=INDEX_DTYPE)
+        class_names = sorted(self.class_names)
+        index['label'] = np.array([class_names.index(name) for name in self.class_names], dtype=np.int32)[index['label']]
+        self.file.write(index.tobytes())
+
+        # Write the metadata header followed by the trailer
+        footer_offset = self.file.tell()
+        header = {
+            'version': VERSION,
+            'dtype': self.dtype.str,
+            'window_shape': list(self.window_shape),
+            'num_windows': self.num_windows,
+            'data_offset': DATA_OFFSET,
+            'index_offset': index_offset,
+            'class_names': class_names,
+            'sessions': self.sessions,
+            'metadata': self.metadata,
+        }
+        self.file.write(json.dumps(header).encode('utf-8'))
+        self.file.write(TRAILER.pack(footer_offset, MAGIC))
+        self.file.close()
+
+    def abort(self) -> None:
+        '''
+        Close the file without finalizing it and delete it, so a partial dataset is never mistaken for a complete one.
+        '''
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def __enter__(self) -> 'PackedDatasetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PackedDataset():
+    '''
+    A class to read a packed dataset file through a memory map.
+    '''
+    def __init__(self, file_path: str) -> None:
+        '''
+        Constructor for the PackedDataset class.
+
+        Only the header and the index are read; the windows are memory-mapped and paged in on access.
+
+        args:
+            file_path (str): Path to the packed dataset file.
+
+        raises:
+            ValueError: If the file is not a complete packed dataset.
+        '''
+        self.file_path = file_path
+
+        # Read the trailer and the metadata header
+        with open(file_path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{file_path}' is not a packed dataset.")
+            file.seek(-TRAILER.size, os.SEEK_END)
+            trailer_offset = file.tell()
+            footer_offset, magic = TRAILER.unpack(file.read(TRAILER.size))
+            if magic != MAGIC:
+                raise ValueError(f"'{file_path}' is incomplete: the writer was not closed.")
+            file.seek(footer_offset)
+            self.header = json.loads(file.read(trailer_offset - footer_offset).decode('utf-8'))
+
+        self.dtype = np.dtype(self.header['dtype'])
+        self.window_shape = tuple(self.header['window_shape'])
+        self.class_names = self.header['class_names']
+        self.session_names = self.header['sessions']
+        self.metadata = self.header['metadata']
+        num_windows = self.header['num_windows']
+
+        # Memory-map the windows (np.memmap does not support empty arrays)
+        if num_windows:
+            self.windows = np.memmap(file_path, dtype=self.dtype, mode='r', offset=self.header['data_offset'], shape=(num_windows,) + self.window_shape)
+        else:
+            self.windows = np.empty((0,) + self.window_shape, dtype=self.dtype)
+
+        # Read the index
+        index = np.fromfile(file_path, dtype=INDEX_DTYPE, count=num_windows, offset=self.header['index_offset'])
+        self.labels = index['label'].astype(np.int64)
+        self.sessions = index['session']
+        self.offsets = index['offset']
+
+    def get_labels(self, class_names: Optional[Iterable[str]]=None) -> np.ndarray:
+        '''
+        Get the labels of the windows in a given class order.
+
+        args:
+            class_names (Iterable[str]): The classes in label order, e.g. shared by the train, validation and test datasets.
+                                         Defaults to the classes of this file.
+
+        returns:
+            np.ndarray: The label of each window.
+
+        raises:
+            ValueError: If a class of this file is not in class_names.
+        '''
+        if class_names is None:
+            return self.labels
+        class_names = list(class_names)
+        missing = [name for name in self.class_names if name not in class_names]
+        if missing:
+            raise ValueError(f"Classes {missing} of '{self.file_path}' are not in {class_names}.")
+        lookup = np.array([class_names.index(name) for name in self.class_names], dtype=np.int64)
+        return lookup[self.labels] if len(lookup) else self.labels
+
+    def __len__(self) -> int:
+        return len(self.windows)
+
+    def __getitem__(self, index) -> Tuple[np.ndarray, np.ndarray]:
+        return self.windows[index], self.labels[index]
+
+    def __repr__(self) -> str:
+        return f"PackedDataset('{self.file_path}', num_windows={len(self)}, window_shape={self.window_shape}, classes={self.class_names})"
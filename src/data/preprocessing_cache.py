@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from typing import Callable, Optional
+
+from data.dataset_handler import PREPROCESSING_REVISION
+from data.packed_dataset import VERSION as PACKED_VERSION
+
+
+class PreprocessingCache():
+    '''
+    A class to cache preprocessing results by the content of the raw input and the preprocessing parameters.
+    '''
+    def __init__(self, cache_dir: str, max_size_bytes: Optional[int]=None, prefix: str="oneill") -> None:
+        '''
+        Constructor for the PreprocessingCache class.
+
+        args:
+            cache_dir (str): The folder holding the cache entries and the cache index.
+            max_size_bytes (int): The total size above which the least recently used entries are evicted. None disables eviction.
+            prefix (str): The prefix of the entry folder names.
+        '''
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.prefix = prefix
+        self.index_path = os.path.join(cache_dir, "cache_index.json")
+
+        # Hits and misses of this session
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        '''
+        Load the cache index, dropping entries whose output no longer exists.
+        '''
+        index = {'entries': {}, 'file_digests': {}, 'hits': 0, 'misses': 0}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as file:
+                    index.update(json.load(file))
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring unreadable cache index '{self.index_path}': {e}")
+        index['entries'] = {key: entry for key, entry in index['entries'].items()
+                            if os.path.exists(os.path.join(self.cache_dir, entry['output']))}
+        return index
+
+    def _save_index(self) -> None:
+        '''
+        Save the cache index atomically.
+        '''
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.index, file, indent=2)
+        os.replace(temp_path, self.index_path)
+
+    def get_file_digest(self, file_path: str) -> str:
+        '''
+        Get the SHA-256 digest of a file.
+
+        Digests are remembered by (path, size, modification time), so unchanged files are hashed only once.
+
+        args:
+            file_path (str): Path to the file.
+
+        returns:
+            str: The hexadecimal digest.
+        '''
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        known = self.index['file_digests'].get(file_path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+        self.index['file_digests'][file_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def get_key(self, raw_path: str, params: dict) -> str:
+        '''
+        Get the cache key of a raw input and a set of preprocessing parameters.
+
+        The key also covers the packed dataset format version and the preprocessing revision, so entries built
+        by an older version of the code are rebuilt instead of returned.
+
+        args:
+            raw_path (str): Path to the raw input.
+            params (dict): JSON-serializable preprocessing parameters.
+
+        returns:
+            str: The cache key.
+        '''
+        sha256 = hashlib.sha256(self.get_file_digest(raw_path).encode('utf-8'))
+        params = dict(params, packed_version=PACKED_VERSION, preprocessing_revision=PREPROCESSING_REVISION)
+        sha256.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return sha256.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+        Get the output of a cache entry and mark it as recently used.
+
+        args:
+            key (str): The cache key.
+
+        returns:
+            str or None: Path to the cached output, or None if the entry does not exist.
+        '''
+        entry = self.index['entries'].get(key)
+        if entry is None:
+            return None
+        entry['last_access'] = time.time()
+        return os.path.join(self.cache_dir, entry['output'])
+
+    def get_or_create(self, raw_path: str, params: dict, build: Callable[[str], str]) -> str:
+        '''
+        Get the cached output of a raw input and preprocessing parameters, or build and cache it.
+
+        args:
+            raw_path (str): Path to the raw input.
+            params (dict): JSON-serializable preprocessing parameters.
+            build (Callable[[str], str]): Called with an empty folder to build the output in; returns the path to the output.
+
+        returns:
+            str: Path to the cached output.
+        '''
+        key = self.get_key(raw_path, params)
+        output_path = self.get(key)
+        if output_path is not None:
+            self.hits += 1
+            self.index['hits'] += 1
+            self._save_index()
+            print(f"Cache hit: {output_path}")
+            return output_path
+
+        self.misses += 1
+        self.index['misses'] += 1
+
+        # Build in a temporary folder and move it into place, so an interrupted build never looks like a cache entry
+        entry_name = f"{self.prefix}_{key[:16]}"
+        entry_dir = os.path.join(self.cache_dir, entry_name)
+        temp_dir = os.path.join(self.cache_dir, ".staging", entry_name)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        try:
+            temp_output_path = build(temp_dir)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(temp_dir, entry_dir)
+
+        # Record the entry
+        output = os.path.join(entry_name, os.path.relpath(temp_output_path, temp_dir))
+        self.index['entries'][key] = {'output': os.path.normpath(output),
+                                      'folder': entry_name,
+                                      'raw_path': os.path.abspath(raw_path),
+                                      'params': params,
+                                      'size': get_folder_size(entry_dir),
+                                      'created': time.time(),
+                                      'last_access': time.time()}
+        self.evict(keep=key)
+        self._save_index()
+        return os.path.join(self.cache_dir, self.index['entries'][key]['output'])
+
+    def evict(self, keep: Optional[str]=None) -> None:
+        '''
+        Evict the least recently used entries until the cache fits in max_size_bytes.
+
+        args:
+            keep (str): A key that must not be evicted (e.g. the entry that was just created).
+        '''
+        if self.max_size_bytes is None:
+            return
+        entries = sorted(self.index['entries'].items(), key=lambda item: item[1]['last_access'])
+        total_size = sum(entry['size'] for _, entry in entries)
+        for key, entry in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, entry['folder']), ignore_errors=True)
+            del self.index['entries'][key]
+            total_size -= entry['size']
+            print(f"Evicted cache entry {entry['folder']} ({entry['size'] / 2**20:.1f} MiB)")
+
+    @property
+    def size_bytes(self) -> int:
+        '''
+        The total size of the cache entries.
+        '''
+        return sum(entry['size'] for entry in self.index['entries'].values())
+
+    def report(self) -> str:
+        '''
+        Get a summary of the cache usage.
+
+        returns:
+            str: The hits and misses of this session and of all time, and the size of the cache.
+        '''
+        return (f"Preprocessing cache: {self.hits} hits / {self.misses} misses this session, "
+                f"{self.index['hits']} hits / {self.index['misses']} misses in total, "
+                f"{len(self.index['entries'])} entries ({self.size_bytes / 2**20:.1f} MiB)")
+
+
+def get_folder_size(folder_path: str) -> int:
+    '''
+    Get the total size of the files in a folder.
+
+    args:
+        folder_path (str): Path to the folder.
+
+    returns:
+        int: The size in bytes.
+    '''
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder_path) for name in names)
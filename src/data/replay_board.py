@@ -0,0 +1,235 @@
+'''
+Hardware-free board that replays a recorded session through the subset of the BrainFlow BoardShim API used by the DataCollector.
+'''
+
+import os
+import time
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+from data.session_recorder import SessionLog, LOG_EXTENSION
+
+# BrainFlow id of the Cyton board, its sampling rate and its timestamp and marker rows
+CYTON_BOARD_ID = 0
+CYTON_SAMPLING_RATE = 250
+CYTON_TIMESTAMP_CHANNEL = 22
+CYTON_MARKER_CHANNEL = 23
+
+# Default size of the internal buffer of a BrainFlow session
+DEFAULT_BUFFER_SIZE = 450000
+
+
+class ReplayBoard():
+    '''
+    A class to stream the samples of a recorded session as if they came from the board, at real time or faster.
+
+    Samples become available at sampling_rate * speed samples per second from start_stream, and are returned by
+    get_board_data in the (board rows, samples) layout of BrainFlow. Nothing runs in the background: the samples
+    that are due are computed from the elapsed time on every call.
+    '''
+    def __init__(self, samples: np.ndarray, sampling_rate: float, board_id: int=CYTON_BOARD_ID, timestamp_channel: Optional[int]=CYTON_TIMESTAMP_CHANNEL,
+                 marker_channel: Optional[int]=CYTON_MARKER_CHANNEL, speed: float=1.0, loop: bool=False, retime: bool=True,
+                 keep_markers: bool=False) -> None:
+        '''
+        Constructor for the ReplayBoard class.
+
+        args:
+            samples (np.ndarray): The recorded samples with shape (num_samples, board rows).
+            sampling_rate (float): The sampling rate of the recording in Hz.
+            board_id (int): The BrainFlow id of the board that made the recording.
+            timestamp_channel (int): The row of the timestamps, or None if the recording has none.
+            marker_channel (int): The row where inserted markers are written, or None if the board has none.
+            speed (float): The playback speed as a multiple of real time.
+            loop (bool): Whether to restart from the first sample at the end of the recording instead of stopping.
+            retime (bool): Whether to replace the recorded timestamps by the time each sample is made available,
+                           so latencies measured on the replay are meaningful.
+            keep_markers (bool): Whether to keep the recorded markers in the marker row. By default they are cleared,
+                                 so only the markers inserted during the replay are streamed.
+
+        raises:
+            ValueError: If the recording is empty or the speed is not positive.
+        '''
+        samples = np.array(samples, dtype=np.float64)
+        if samples.ndim != 2 or len(samples) == 0:
+            raise ValueError("The recording to replay is empty.")
+        if speed <= 0:
+            raise ValueError(f"Invalid replay speed {speed}.")
+        if not keep_markers and marker_channel is not None:
+            samples[:, marker_channel] = 0.0
+
+        self.samples = samples
+        self.sampling_rate = float(sampling_rate)
+        self.board_id = board_id
+        self.timestamp_channel = timestamp_channel
+        self.marker_channel = marker_channel
+        self.speed = float(speed)
+        self.loop = loop
+        self.retime = retime
+        self.keep_markers = keep_markers
+
+        self.prepared = False
+        self.streaming = False
+        self.buffer_size = DEFAULT_BUFFER_SIZE
+        self.start_time = None
+        self.start_wall_time = None
+        self.read_count = 0
+        self.due_count = 0
+        self.markers = []
+
+    @classmethod
+    def from_file(cls, file_path: str, speed: float=1.0, loop: bool=False, retime: bool=True, board_id: int=CYTON_BOARD_ID,
+                  sampling_rate: float=CYTON_SAMPLING_RATE, timestamp_channel: Optional[int]=CYTON_TIMESTAMP_CHANNEL,
+                  marker_channel: Optional[int]=CYTON_MARKER_CHANNEL, keep_markers: bool=False) -> 'ReplayBoard':
+        '''
+        Create a replay board from a session log or a BrainFlow CSV file (e.g. full_dataset.csv).
+
+        Session logs carry the board id, sampling rate and timestamp row in their metadata; the other
+        arguments describe CSV recordings.
+
+        args:
+            file_path (str): Path to the session log or CSV file.
+            speed (float): The playback speed as a multiple of real time.
+            loop (bool): Whether to restart from the first sample at the end of the recording.
+            retime (bool): Whether to replace the recorded timestamps by the replay time.
+            board_id (int): The BrainFlow id of the board of a CSV recording.
+            sampling_rate (float): The sampling rate of a CSV recording in Hz.
+            timestamp_channel (int): The row of the timestamps of a CSV recording.
+            marker_channel (int): The row of the markers of a CSV recording.
+            keep_markers (bool): Whether to keep the recorded markers instead of only the ones inserted during the replay.
+
+        returns:
+            ReplayBoard: The replay board.
+        '''
+        if os.path.splitext(file_path)[1] == LOG_EXTENSION:
+            log = SessionLog(file_path)
+            board_id = log.metadata.get('board_id', board_id)
+            sampling_rate = log.metadata.get('sampling_rate', sampling_rate)
+            timestamp_channel = log.metadata.get('timestamp_channel', timestamp_channel)
+            marker_channel = log.metadata.get('marker_channel', marker_channel)
+            samples = log.to_array()
+        else:
+            # DataFilter.write_file layout: one tab-separated row per sample, no header
+            samples = pd.read_csv(file_path, sep='\t', header=None, dtype=np.float64).to_numpy()
+        return cls(samples, sampling_rate, board_id, timestamp_channel, marker_channel, speed, loop, retime, keep_markers)
+
+    @property
+    def duration(self) -> float:
+        '''
+        The duration of one pass over the recording in seconds of replay time.
+        '''
+        return len(self.samples) / (self.sampling_rate * self.speed)
+
+    def get_board_id(self) -> int:
+        return self.board_id
+
+    def is_prepared(self) -> bool:
+        return self.prepared
+
+    def prepare_session(self) -> None:
+        self.prepared = True
+
+    def release_session(self) -> None:
+        self.streaming = False
+        self.prepared = False
+
+    def start_stream(self, buffer_size: int=DEFAULT_BUFFER_SIZE, streamer_params: str=None) -> None:
+        '''
+        Start making samples available, from the first sample of the recording.
+
+        args:
+            buffer_size (int): The maximum number of samples kept before the oldest are dropped, as in BrainFlow.
+            streamer_params (str): Ignored, kept for compatibility with BoardShim.start_stream.
+
+        raises:
+            RuntimeError: If prepare_session was not called.
+        '''
+        if not self.prepared:
+            raise RuntimeError("prepare_session must be called before start_stream.")
+        self.buffer_size = int(buffer_size)
+        self.start_time = time.monotonic()
+        self.start_wall_time = time.time()
+        self.read_count = 0
+        self.markers = []
+        self.streaming = True
+
+    def stop_stream(self) -> None:
+        # Freeze the stream at the samples made available so far
+        self.due_count = self._get_due_count()
+        self.streaming = False
+
+    def insert_marker(self, value: float) -> None:
+        '''
+        Write a marker to the marker row of the next sample made available, as BrainFlow does.
+
+        args:
+            value (float): The marker value (non-zero).
+        '''
+        self.markers.append((self._get_due_count(), value))
+
+    def _get_due_count(self) -> int:
+        '''
+        Get the number of samples made available since start_stream.
+        '''
+        if self.start_time is None:
+            return 0
+        if not self.streaming:
+            return self.due_count
+        due_count = int((time.monotonic() - self.start_time) * self.sampling_rate * self.speed)
+        return due_count if self.loop else min(due_count, len(self.samples))
+
+    def _get_samples(self, start: int, stop: int) -> np.ndarray:
+        '''
+        Get the samples between two positions of the stream, in the (board rows, samples) layout of BrainFlow.
+        '''
+        positions = np.arange(start, stop)
+        data = self.samples.take(positions % len(self.samples), axis=0)
+        if self.retime and self.timestamp_channel is not None:
+            data[:, self.timestamp_channel] = self.start_wall_time + positions / (self.sampling_rate * self.speed)
+        if self.marker_channel is not None:
+            for position, value in self.markers:
+                if start <= position < stop:
+                    data[position - start, self.marker_channel] = value
+        return data.T
+
+    def get_board_data_count(self) -> int:
+        due_count = self._get_due_count()
+        return min(due_count - self.read_count, self.buffer_size)
+
+    def get_board_data(self, num_samples: Optional[int]=None) -> np.ndarray:
+        '''
+        Get the samples made available since the last call and remove them from the buffer.
+
+        args:
+            num_samples (int): The maximum number of samples, oldest first. None returns all of them.
+
+        returns:
+            np.ndarray: The samples with shape (board rows, num_samples).
+        '''
+        due_count = self._get_due_count()
+
+        # Like BrainFlow, drop the oldest samples that did not fit in the buffer
+        start = max(self.read_count, due_count - self.buffer_size)
+        stop = due_count if num_samples is None else min(due_count, start + num_samples)
+        self.read_count = stop
+        return self._get_samples(start, stop)
+
+    def get_current_board_data(self, num_samples: int) -> np.ndarray:
+        '''
+        Get the latest samples without removing them from the buffer.
+
+        args:
+            num_samples (int): The maximum number of samples.
+
+        returns:
+            np.ndarray: The samples with shape (board rows, num_samples).
+        '''
+        due_count = self._get_due_count()
+        start = max(due_count - num_samples, due_count - self.buffer_size, self.read_count, 0)
+        return self._get_samples(start, due_count)
+
+    def is_finished(self) -> bool:
+        '''
+        Whether a replay without loop has made every sample of the recording available.
+        '''
+        return not self.loop and self._get_due_count() >= len(self.samples)
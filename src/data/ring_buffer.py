@@ -0,0 +1,124 @@
+import threading
+import numpy as np
+from typing import Optional, Tuple
+
+
+class RingBuffer():
+    '''
+    A class to hold the latest samples of a stream in a preallocated array.
+
+    Every sample is written twice, capacity rows apart, so the latest N samples are always one contiguous
+    slice of the storage and snapshots are returned as zero-copy views.
+    '''
+    def __init__(self, capacity: int, num_columns: int, dtype: np.dtype=np.float64) -> None:
+        '''
+        Constructor for the RingBuffer class.
+
+        args:
+            capacity (int): The number of samples kept.
+            num_columns (int): The number of values per sample (e.g. the rows of a BrainFlow board).
+            dtype (np.dtype): The data type of the samples.
+
+        raises:
+            ValueError: If the capacity is not positive.
+        '''
+        if capacity < 1:
+            raise ValueError(f"Invalid ring buffer capacity {capacity}")
+        self.capacity = int(capacity)
+        self.num_columns = int(num_columns)
+        self.storage = np.zeros((2 * self.capacity, self.num_columns), dtype=dtype)
+
+        # Position of the next write and number of samples written so far
+        self.position = 0
+        self.total_written = 0
+        self.lock = threading.Condition()
+
+    def write(self, samples: np.ndarray) -> None:
+        '''
+        Append samples, overwriting the oldest ones once the buffer is full.
+
+        args:
+            samples (np.ndarray): The samples with shape (num_samples, num_columns).
+        '''
+        samples = np.asarray(samples)
+        num_samples = len(samples)
+        if num_samples > self.capacity:
+            samples = samples[-self.capacity:]
+
+        with self.lock:
+            # Write each part of the samples to both halves of the storage
+            first = min(len(samples), self.capacity - self.position)
+            for start, stop, position in ((0, first, self.position), (first, len(samples), 0)):
+                if stop > start:
+                    self.storage[position: position + stop - start] = samples[start: stop]
+                    self.storage[position + self.capacity: position + self.capacity + stop - start] = samples[start: stop]
+            self.position = (self.position + len(samples)) % self.capacity
+            self.total_written += num_samples
+            self.lock.notify_all()
+
+    def wait_for(self, count: int, timeout: Optional[float]=None) -> bool:
+        '''
+        Block until total_written reaches a count, e.g. until the next window of a live stream is complete.
+
+        args:
+            count (int): The value of total_written to wait for.
+            timeout (float): The maximum time to wait in seconds.
+
+        returns:
+            bool: Whether the count was reached.
+        '''
+        with self.lock:
+            return self.lock.wait_for(lambda: self.total_written >= count, timeout)
+
+    def get_latest(self, num_samples: int) -> np.ndarray:
+        '''
+        Get the latest samples as a zero-copy view.
+
+        The view stays valid until the writer has written another (capacity - num_samples) samples; copy it to keep it longer.
+
+        args:
+            num_samples (int): The number of samples. At most the capacity and the number of samples written so far.
+
+        returns:
+            np.ndarray: The samples with shape (num_samples, num_columns), oldest first.
+        '''
+        with self.lock:
+            num_samples = min(int(num_samples), self.capacity, self.total_written)
+            end = self.position + self.capacity
+            return self.storage[end - num_samples: end]
+
+    def read_since(self, count: int) -> Tuple[np.ndarray, int, int]:
+        '''
+        Get the samples written since a previous read, e.g. to follow the stream without missing samples.
+
+        args:
+            count (int): The value of total_written at the previous read (0 to start from the oldest sample).
+
+        returns:
+            Tuple[np.ndarray, int, int]: A zero-copy view of the new samples, the count to pass to the next read and
+            the number of samples that were overwritten before they could be read.
+        '''
+        with self.lock:
+            total_written = self.total_written
+        num_new = total_written - count
+        num_dropped = max(0, num_new - self.capacity)
+        return self.get_latest_until(total_written, num_new - num_dropped), total_written, num_dropped
+
+    def get_latest_until(self, count: int, num_samples: int) -> np.ndarray:
+        '''
+        Get the num_samples samples that end at a given value of total_written.
+
+        args:
+            count (int): The value of total_written after the last requested sample.
+            num_samples (int): The number of samples.
+
+        returns:
+            np.ndarray: A zero-copy view of the samples, oldest first.
+        '''
+        with self.lock:
+            num_samples = max(0, min(int(num_samples), self.capacity - (self.total_written - count)))
+            end = (self.position - (self.total_written - count)) % self.capacity + self.capacity
+            return self.storage[end - num_samples: end]
+
+    def __len__(self) -> int:
+        return min(self.total_written, self.capacity)
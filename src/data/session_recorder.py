@@ -0,0 +1,358 @@
+'''
+Append-only session log for long recordings.
+
+Layout of a .smmrlog file:
+    header                  Magic number, format version, number of columns, length of the JSON metadata
+    JSON metadata           Board id, sampling rate, channel rows, start time, ...
+    records                 One record per appended chunk: (num_samples, first_sample, crc32) followed by
+                            num_samples rows of float64 values
+
+Every record is written whole and checksummed, so a session that was cut short by a crash can be recovered
+up to its last complete record. A .idx file next to the log holds the (offset, first_sample, num_samples)
+of every record, so readers can seek without scanning; it is rebuilt from the log if it is missing or stale.
+'''
+
+import os
+import json
+import time
+import zlib
+import struct
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+from data.label_alignment import label_by_markers, label_dataset, labels_from_markers
+
+# File extension of session logs
+LOG_EXTENSION = ".smmrlog"
+
+# Magic number written at the start of the file
+MAGIC = b"SMMRLOG\0"
+
+# Format version
+VERSION = 1
+
+# File header: magic, version, number of columns, length of the JSON metadata
+HEADER = struct.Struct("<8sIII")
+
+# Record header: number of samples, index of the first sample, crc32 of the payload
+RECORD = struct.Struct("<IQI")
+
+# Record of the index file
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('first_sample', '<i8'), ('num_samples', '<i8')])
+
+# Data type of the samples
+SAMPLE_DTYPE = np.dtype('<f8')
+
+
+class SessionRecorder():
+    '''
+    A class to append the samples of a recording to a session log as they arrive.
+    '''
+    def __init__(self, file_path: str, num_columns: int, metadata: Optional[dict]=None, flush_interval: float=1.0, fsync: bool=True) -> None:
+        '''
+        Constructor for the SessionRecorder class.
+
+        args:
+            file_path (str): Path to the session log.
+            num_columns (int): The number of values per sample (e.g. the rows of a BrainFlow board).
+            metadata (dict): Additional JSON-serializable metadata (e.g. board id and sampling rate).
+            flush_interval (float): The maximum time in seconds appended samples may stay in memory before they are flushed.
+            fsync (bool): Whether to also force flushed samples to the disk, so they survive a power loss.
+        '''
+        self.file_path = file_path
+        self.index_path = f"{file_path}.idx"
+        self.num_columns = int(num_columns)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.num_samples = 0
+        self.last_flush = time.monotonic()
+
+        # Write the file header
+        metadata = dict(metadata or {})
+        metadata.setdefault('start_time', time.time())
+        metadata_bytes = json.dumps(metadata).encode('utf-8')
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self.file = open(file_path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.num_columns, len(metadata_bytes)))
+        self.file.write(metadata_bytes)
+        self.index_file = open(self.index_path, 'wb')
+        self.flush()
+
+    def append(self, samples: np.ndarray) -> None:
+        '''
+        Append a chunk of samples as one record, flushing if the flush interval has passed.
+
+        args:
+            samples (np.ndarray): The samples with shape (num_samples, num_columns).
+
+        raises:
+            ValueError: If the samples do not have num_columns values.
+        '''
+        samples = np.asarray(samples)
+        if samples.ndim != 2 or samples.shape[1] != self.num_columns:
+            raise ValueError(f"Expected samples with {self.num_columns} columns, got shape {samples.shape}.")
+        if len(samples) == 0:
+            return
+
+        payload = np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE).tobytes()
+        index_record = np.array([(self.file.tell(), self.num_samples, len(samples))], dtype=INDEX_DTYPE)
+        self.file.write(RECORD.pack(len(samples), self.num_samples, zlib.crc32(payload)))
+        self.file.write(payload)
+        self.index_file.write(index_record.tobytes())
+        self.num_samples += len(samples)
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        '''
+        Write the buffered records to the operating system and, if enabled, to the disk.
+        '''
+        self.file.flush()
+        self.index_file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        '''
+        Flush the remaining records and close the session log.
+        '''
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        self.index_file.close()
+
+    def __enter__(self) -> 'SessionRecorder':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class SessionLog():
+    '''
+    A class to read a session log, recovering what can be read from incomplete logs.
+    '''
+    def __init__(self, file_path: str) -> None:
+        '''
+        Constructor for the SessionLog class.
+
+        args:
+            file_path (str): Path to the session log.
+
+        raises:
+            ValueError: If the file is not a session log.
+        '''
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            magic, version, self.num_columns, metadata_length = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"'{file_path}' is not a session log.")
+            self.metadata = json.loads(file.read(metadata_length).decode('utf-8'))
+        self.data_offset = HEADER.size + metadata_length
+        self.index = self._load_index()
+
+    def _load_index(self) -> np.ndarray:
+        '''
+        Load the index file, or rebuild it from the log if it is missing or does not match the log.
+        '''
+        index_path = f"{self.file_path}.idx"
+        file_size = os.path.getsize(self.file_path)
+        if os.path.exists(index_path):
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=os.path.getsize(index_path) // INDEX_DTYPE.itemsize)
+            expected_size = self.data_offset + int(np.sum(RECORD.size + index['num_samples'] * self.num_columns * SAMPLE_DTYPE.itemsize))
+            if expected_size == file_size:
+                return index
+        return self._scan()[0]
+
+    def _scan(self) -> Tuple[np.ndarray, int]:
+        '''
+        Read the records one by one, stopping at the first incomplete or corrupted record.
+
+        returns:
+            Tuple[np.ndarray, int]: The index of the valid records and the byte offset where they end.
+        '''
+        records = []
+        with open(self.file_path, 'rb') as file:
+            offset = self.data_offset
+            file.seek(offset)
+            while True:
+                record_header = file.read(RECORD.size)
+                if len(record_header) < RECORD.size:
+                    break
+                num_samples, first_sample, crc = RECORD.unpack(record_header)
+                payload = file.read(num_samples * self.num_columns * SAMPLE_DTYPE.itemsize)
+                if len(payload) < num_samples * self.num_columns * SAMPLE_DTYPE.itemsize or zlib.crc32(payload) != crc:
+                    break
+                records.append((offset, first_sample, num_samples))
+                offset = file.tell()
+        return np.array(records, dtype=INDEX_DTYPE), offset
+
+    @property
+    def num_samples(self) -> int:
+        '''
+        The number of samples in the valid records.
+        '''
+        return int(self.index['num_samples'].sum())
+
+    def iter_chunks(self, chunk_size: int=100000) -> Iterator[np.ndarray]:
+        '''
+        Read the samples in chunks of about chunk_size samples (whole records are never split).
+
+        args:
+            chunk_size (int): The number of samples per chunk.
+
+        returns:
+            Iterator[np.ndarray]: The chunks with shape (num_samples, num_columns).
+        '''
+        record_size = lambda num_samples: RECORD.size + num_samples * self.num_columns * SAMPLE_DTYPE.itemsize
+        with open(self.file_path, 'rb') as file:
+            start = 0
+            while start < len(self.index):
+                # Group consecutive records into one read
+                stop = start + 1
+                num_samples = int(self.index['num_samples'][start])
+                while stop < len(self.index) and num_samples + self.index['num_samples'][stop] <= chunk_size:
+                    num_samples += int(self.index['num_samples'][stop])
+                    stop += 1
+
+                file.seek(int(self.index['offset'][start]))
+                raw = file.read(int(self.index['offset'][stop-1]) + record_size(int(self.index['num_samples'][stop-1])) - int(self.index['offset'][start]))
+
+                # Drop the record headers
+                chunk = np.empty((num_samples, self.num_columns), dtype=SAMPLE_DTYPE)
+                position = 0
+                row = 0
+                for record_samples in self.index['num_samples'][start:stop]:
+                    payload_size = int(record_samples) * self.num_columns * SAMPLE_DTYPE.itemsize
+                    chunk[row: row + record_samples] = np.frombuffer(raw, dtype=SAMPLE_DTYPE, count=payload_size // SAMPLE_DTYPE.itemsize,
+                                                                     offset=position + RECORD.size).reshape(-1, self.num_columns)
+                    position += RECORD.size + payload_size
+                    row += int(record_samples)
+                yield chunk
+                start = stop
+
+    def to_array(self) -> np.ndarray:
+        '''
+        Read every sample.
+
+        returns:
+            np.ndarray: The samples with shape (num_samples, num_columns).
+        '''
+        chunks = list(self.iter_chunks())
+        return np.concatenate(chunks) if chunks else np.empty((0, self.num_columns), dtype=SAMPLE_DTYPE)
+
+    def export_csv(self, file_path: str, chunk_size: int=100000) -> str:
+        '''
+        Export the session in the format of BrainFlow's DataFilter.write_file (one tab-separated row per sample).
+
+        args:
+            file_path (str): Path to the CSV file.
+            chunk_size (int): The number of samples converted at once.
+
+        returns:
+            str: Path to the CSV file.
+        '''
+        # Format a whole chunk with one format string, which is several times faster than DataFrame.to_csv
+        row_format = '\t'.join(['%.6f'] * self.num_columns) + '\n'
+        with open(file_path, 'w', newline='') as file:
+            for chunk in self.iter_chunks(chunk_size):
+                file.write((row_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+        return file_path
+
+    def export_merged(self, file_path: str, class_dfs: Union[pd.DataFrame, Iterable[pd.DataFrame]], channels: Sequence[int]=range(1, 9),
+                      timestamp_column: int=-2, exclude: Iterable[str]=("Instructions",), chunk_size: int=100000) -> str:
+        '''
+        Export the session as a merged dataset (channel columns, 'Timestamp' and 'Class'), labeling the samples by cue interval.
+
+        args:
+            file_path (str): Path to the CSV file.
+            class_dfs (Union[pd.DataFrame, Iterable[pd.DataFrame]]): One or more marker files with 'Class' and 'Timestamp' columns.
+            channels (Sequence[int]): The columns of the EEG channels.
+            timestamp_column (int): The column of the timestamps.
+            exclude (Iterable[str]): The classes to drop.
+            chunk_size (int): The number of samples converted at once.
+
+        returns:
+            str: Path to the CSV file.
+        '''
+        if isinstance(class_dfs, pd.DataFrame):
+            class_dfs = [class_dfs]
+        class_dfs = list(class_dfs)
+        channels = list(channels)
+        columns = [f'Channel {n}' for n in range(1, len(channels) + 1)] + ['Timestamp']
+
+        with open(file_path, 'w', newline='') as file:
+            header = True
+            for chunk in self.iter_chunks(chunk_size):
+                dataset = pd.DataFrame(chunk[:, channels + [timestamp_column]], columns=columns)
+                label_dataset(dataset, class_dfs, exclude).to_csv(file, header=header, index=False)
+                header = False
+        return file_path
+
+    def export_marked(self, file_path: str, marker_classes: Optional[Dict[int, str]]=None, channels: Sequence[int]=range(1, 9),
+                      timestamp_column: int=-2, marker_column: Optional[int]=None, exclude: Iterable[str]=("Instructions",),
+                      chunk_size: int=100000) -> str:
+        '''
+        Export the session as a merged dataset (channel columns, 'Timestamp' and 'Class'), labeling the samples by the
+        cue markers stamped into the data stream during the session.
+
+        args:
+            file_path (str): Path to the CSV file.
+            marker_classes (Dict[int, str]): The class of each marker value. Defaults to the 'marker_classes' of the metadata.
+            channels (Sequence[int]): The columns of the EEG channels.
+            timestamp_column (int): The column of the timestamps.
+            marker_column (int): The column of the markers. Defaults to the 'marker_channel' of the metadata.
+            exclude (Iterable[str]): The classes to drop.
+            chunk_size (int): The number of samples converted at once.
+
+        returns:
+            str: Path to the CSV file.
+
+        raises:
+            ValueError: If the marker classes or the marker column are neither given nor in the metadata.
+        '''
+        if marker_classes is None:
+            marker_classes = self.metadata.get('marker_classes')
+        if marker_column is None:
+            marker_column = self.metadata.get('marker_channel')
+        if marker_classes is None or marker_column is None:
+            raise ValueError(f"'{self.file_path}' has no marker classes or marker channel in its metadata.")
+        marker_classes = {int(code): name for code, name in marker_classes.items()}
+        channels = list(channels)
+        columns = [f'Channel {n}' for n in range(1, len(channels) + 1)] + ['Timestamp']
+
+        with open(file_path, 'w', newline='') as file:
+            header = True
+            previous_code = 0
+            for chunk in self.iter_chunks(chunk_size):
+                # Carry the cue in effect over the chunk boundaries
+                codes = labels_from_markers(chunk[:, marker_column], previous_code)
+                previous_code = int(codes[-1])
+                dataset = pd.DataFrame(chunk[:, channels + [timestamp_column]], columns=columns)
+                label_by_markers(dataset, codes, marker_classes, exclude).to_csv(file, header=header, index=False)
+                header = False
+        return file_path
+
+
+def recover(file_path: str) -> int:
+    '''
+    Truncate an incomplete session log after its last complete record and rebuild its index.
+
+    args:
+        file_path (str): Path to the session log.
+
+    returns:
+        int: The number of samples that were recovered.
+    '''
+    log = SessionLog(file_path)
+    index, end_offset = log._scan()
+    if os.path.getsize(file_path) != end_offset:
+        print(f"Recovering '{file_path}': dropping {os.path.getsize(file_path) - end_offset} bytes of incomplete records")
+        with open(file_path, 'r+b') as file:
+            file.truncate(end_offset)
+    index.tofile(f"{file_path}.idx")
+    return int(index['num_samples'].sum())
@@ -0,0 +1,327 @@
+import numpy as np
+import pandas as pd
+import tifffile
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from data.dataset_handler import DatasetHandler, list_tiff_files, split_classes
+from data.montage import Montage, CYTON_MONTAGE
+from data.packed_dataset import PackedDataset, PACKED_EXTENSION
+
+
+class SlidingWindowSource():
+    '''
+    A class to serve overlapping windows lazily from continuous recordings.
+
+    Each segment is kept once as a continuous tensor and windows are strided views into it,
+    so overlap does not duplicate any data and window size and overlap can change without re-preprocessing.
+    '''
+    def __init__(self, segments: Sequence[Tuple[np.ndarray, int]], window_size: int=64, overlap: float=0.25, normalize: bool=True,
+                 class_names: Optional[List[str]]=None) -> None:
+        '''
+        Constructor for the SlidingWindowSource class.
+
+        args:
+            segments (Sequence[Tuple[np.ndarray, int]]): (continuous data, label) pairs, with the samples along the first axis.
+            window_size (int): The size of the window.
+            overlap (float): The overlap between windows.
+            normalize (bool): Whether to z-score each window about its depth axis when it is served.
+            class_names (List[str]): The name of each label.
+        '''
+        self.segments = list(segments)
+        self.window_size = int(window_size)
+        self.overlap = overlap
+        self.normalize = normalize
+        self.class_names = class_names
+
+        # Strided window views of every segment
+        self.segment_windows = [DatasetHandler.get_windows(data, self.window_size, overlap) for data, _ in self.segments]
+
+        # Map global window indices to (segment, window) pairs
+        counts = np.array([len(windows) for windows in self.segment_windows], dtype=np.int64)
+        self.segment_starts = np.concatenate(([0], np.cumsum(counts)))
+        self.labels = np.repeat(np.array([label for _, label in self.segments], dtype=np.int64), counts)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, window_size: int=64, overlap: float=0.25, normalize: bool=True, montage: Montage=CYTON_MONTAGE,
+                       class_names: Optional[List[str]]=None, compact: bool=False) -> 'SlidingWindowSource':
+        '''
+        Create a window source from a merged dataset.
+
+        As in DatasetHandler.preprocess_oneill, the samples of each class form one continuous tensor,
+        either on the spatial grid or, when compact, as the raw channel readings.
+
+        args:
+            df (pd.DataFrame): The dataset as a DataFrame, with the channels as the first columns and a 'Class' column.
+            window_size (int): The size of the window.
+            overlap (float): The overlap between windows.
+            normalize (bool): Whether to z-score each window when it is served.
+            montage (Montage): The electrode layout of the headset.
+            class_names (List[str]): The classes in label order. Defaults to their order of appearance.
+            compact (bool): Whether to serve (window_size, num_channels) windows instead of spatial grids.
+
+        returns:
+            SlidingWindowSource: The window source.
+        '''
+        classes = split_classes(df, montage)
+        class_names = list(class_names) if class_names is not None else [_class for _class, _, _ in classes]
+        segments = [(channel_values.astype(np.float64) if compact else DatasetHandler.get_spatial_matrices(channel_values, montage),
+                     class_names.index(_class))
+                    for _class, channel_values, _ in classes if _class in class_names]
+        return cls(segments, window_size, overlap, normalize, class_names)
+
+    def __len__(self) -> int:
+        return int(self.segment_starts[-1])
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, int]:
+        '''
+        Get a single window and its label.
+
+        args:
+            index (int): The index of the window.
+
+        returns:
+            Tuple[np.ndarray, int]: The window (a view into the segment unless normalized) and its label.
+        '''
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Window index {index} out of range for {len(self)} windows.")
+        segment = int(np.searchsorted(self.segment_starts, index, side='right')) - 1
+        window = self.segment_windows[segment][index - self.segment_starts[segment]]
+        if self.normalize:
+            window = DatasetHandler.normalize_windows(window[np.newaxis])[0]
+        return window, int(self.labels[index])
+
+    def get_batch(self, indices: Iterable[int], dtype: np.dtype=np.float32) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Gather and normalize a batch of windows.
+
+        args:
+            indices (Iterable[int]): The indices of the windows.
+            dtype (np.dtype): The data type of the batch.
+
+        returns:
+            Tuple[np.ndarray, np.ndarray]: The windows with shape (batch_size, window_size, ...) and their labels.
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        segments = np.searchsorted(self.segment_starts, indices, side='right') - 1
+
+        windows = np.empty((len(indices),) + self.window_shape, dtype=np.float64 if self.normalize else dtype)
+        for position, (segment, index) in enumerate(zip(segments, indices)):
+            windows[position] = self.segment_windows[segment][index - self.segment_starts[segment]]
+
+        # Normalize the whole batch at once
+        if self.normalize:
+            windows = DatasetHandler.normalize_windows(windows).astype(dtype, copy=False)
+        return windows, self.labels[indices]
+
+    @property
+    def window_shape(self) -> Tuple[int, ...]:
+        '''
+        The shape of a single window.
+        '''
+        return (self.window_size,) + self.segments[0][0].shape[1:] if self.segments else (self.window_size,)
+
+    def iter_batches(self, batch_size: int=32, shuffle: bool=False, rng: Optional[np.random.Generator]=None,
+                     dtype: np.dtype=np.float32) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        '''
+        Iterate over the windows in batches.
+
+        args:
+            batch_size (int): The number of windows per batch.
+            shuffle (bool): Whether to visit the windows in random order.
+            rng (np.random.Generator): The random generator used to shuffle.
+            dtype (np.dtype): The data type of the batches.
+
+        returns:
+            Iterator[Tuple[np.ndarray, np.ndarray]]: The batches of windows and labels.
+        '''
+        order = np.arange(len(self))
+        if shuffle:
+            (rng or np.random.default_rng()).shuffle(order)
+        for start in range(0, len(order), batch_size):
+            yield self.get_batch(order[start: start+batch_size], dtype)
+
+    def generator(self) -> Iterator[Tuple[np.ndarray, int]]:
+        '''
+        Yield every window and its label in order.
+
+        Without normalization the windows are zero-copy views into the segments.
+        '''
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_tf_dataset(self, batch_size: int=32, shuffle: bool=True, seed: Optional[int]=None):
+        '''
+        Wrap the source in a batched and prefetched tf.data.Dataset.
+
+        A shuffled dataset visits the windows in a new order on every epoch.
+
+        args:
+            batch_size (int): The number of windows per batch.
+            shuffle (bool): Whether to shuffle the windows on every epoch.
+            seed (int): The random seed.
+
+        returns:
+            tf.data.Dataset: The dataset of (windows, labels) batches.
+        '''
+        import tensorflow as tf
+
+        rng = np.random.default_rng(seed)
+        dataset = tf.data.Dataset.from_generator(lambda: self.iter_batches(batch_size, shuffle, rng),
+                                                 output_signature=(tf.TensorSpec(shape=(None,) + self.window_shape, dtype=tf.float32),
+                                                                   tf.TensorSpec(shape=(None,), dtype=tf.int64)))
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def split(self, fractions: Sequence[float]=(0.7, 0.15, 0.15)) -> List['SlidingWindowSource']:
+        '''
+        Split every segment in time into consecutive parts, e.g. train, validation and test.
+
+        Splitting the continuous segments (instead of the windows) keeps overlapping windows out of different parts.
+
+        args:
+            fractions (Sequence[float]): The fraction of each segment that goes to each part.
+
+        returns:
+            List[SlidingWindowSource]: One window source per fraction.
+        '''
+        bounds = np.concatenate(([0.0], np.cumsum(fractions)))
+        sources = []
+        for lower, upper in zip(bounds[:-1], bounds[1:]):
+            segments = [(data[int(round(lower * len(data))): int(round(upper * len(data)))], label) for data, label in self.segments]
+            sources.append(SlidingWindowSource(segments, self.window_size, self.overlap, self.normalize, self.class_names))
+        return sources
+
+
+class FileWindowSource():
+    '''
+    A class to serve the windows of a stored dataset (packed file or TIFF folder) from disk on demand.
+
+    Only the labels are read up front, so training starts immediately and the dataset does not have to fit in memory:
+    the windows of a packed file are gathered from its memory map and TIFF files are decoded when their batch is due.
+    '''
+    def __init__(self, data_path: str, shuffle_buffer: int=4096, cache: Optional[str]=None, num_parallel_reads: Optional[int]=None,
+                 class_names: Optional[List[str]]=None) -> None:
+        '''
+        Constructor for the FileWindowSource class.
+
+        args:
+            data_path (str): Path to the packed dataset file or to the TIFF folder.
+            shuffle_buffer (int): The number of windows shuffled at once when the dataset is cached.
+            cache (str): None to read the windows from disk on every epoch, "" to cache them in memory after the first epoch,
+                         or the path of a cache file (for datasets larger than memory that are slow to decode).
+            num_parallel_reads (int): The number of batches read concurrently. Defaults to tf.data.AUTOTUNE.
+            class_names (List[str]): The classes in label order, e.g. shared by the train, validation and test datasets.
+                                     Defaults to the classes of the dataset sorted by name.
+
+        raises:
+            ValueError: If the data path is not set.
+        '''
+        if data_path is None:
+            raise ValueError("Data path not set.")
+        self.data_path = data_path
+        self.shuffle_buffer = int(shuffle_buffer)
+        self.cache = cache
+        self.num_parallel_reads = num_parallel_reads
+
+        if data_path.endswith(PACKED_EXTENSION):
+            self.packed = PackedDataset(data_path)
+            self.file_paths = None
+            self.labels = self.packed.get_labels(class_names)
+            self.class_names = list(class_names) if class_names is not None else self.packed.class_names
+            self.window_shape = self.packed.window_shape
+        else:
+            self.packed = None
+            self.file_paths, self.labels, self.class_names = list_tiff_files(data_path, class_names)
+            self.labels = self.labels.astype(np.int64)
+            self.window_shape = ()
+            if self.file_paths:
+                with tifffile.TiffFile(self.file_paths[0]) as tif:
+                    self.window_shape = tuple(tif.series[0].shape)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def get_batch(self, indices: Iterable[int], dtype: np.dtype=np.float32) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Read a batch of windows from disk.
+
+        args:
+            indices (Iterable[int]): The indices of the windows.
+            dtype (np.dtype): The data type of the batch.
+
+        returns:
+            Tuple[np.ndarray, np.ndarray]: The windows with shape (batch_size, *window_shape) and their labels.
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.packed is not None:
+            # Gather in file order, so the pages of the memory map are read sequentially
+            indices = np.sort(indices)
+            return self.packed.windows[indices].astype(dtype, copy=False), self.labels[indices]
+
+        windows = np.empty((len(indices),) + self.window_shape, dtype=dtype)
+        for position, index in enumerate(indices):
+            with tifffile.TiffFile(self.file_paths[index]) as tif:
+                windows[position] = tif.asarray()
+        return windows, self.labels[indices]
+
+    def iter_indices(self, batch_size: int=32, shuffle: bool=False, rng: Optional[np.random.Generator]=None) -> Iterator[np.ndarray]:
+        '''
+        Iterate over the window indices in batches.
+
+        args:
+            batch_size (int): The number of windows per batch.
+            shuffle (bool): Whether to visit the windows in random order.
+            rng (np.random.Generator): The random generator used to shuffle.
+
+        returns:
+            Iterator[np.ndarray]: The indices of each batch.
+        '''
+        order = (rng or np.random.default_rng()).permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(order), batch_size):
+            yield order[start: start+batch_size]
+
+    def to_tf_dataset(self, batch_size: int=32, shuffle: bool=True, seed: Optional[int]=None):
+        '''
+        Build a tf.data input pipeline that reads the windows from disk.
+
+        Batches of indices are read by num_parallel_reads concurrent workers and prefetched, so reading overlaps training.
+        Without a cache, every epoch visits the windows in a new order (only the indices are shuffled, never the windows).
+        A cache stores the windows in one fixed random order after the first epoch, and every epoch then reshuffles them
+        through a buffer of shuffle_buffer windows.
+
+        args:
+            batch_size (int): The number of windows per batch.
+            shuffle (bool): Whether to shuffle the windows on every epoch.
+            seed (int): The random seed.
+
+        returns:
+            tf.data.Dataset: The dataset of (windows, labels) batches.
+        '''
+        import tensorflow as tf
+
+        rng = np.random.default_rng(seed)
+        cached = self.cache is not None
+        num_parallel_reads = self.num_parallel_reads or tf.data.AUTOTUNE
+
+        # Cached windows are read once, so the indices are shuffled once (and the same on every epoch)
+        if cached and shuffle:
+            order = rng.permutation(len(self))
+            index_batches = lambda: (order[start: start+batch_size] for start in range(0, len(order), batch_size))
+        else:
+            index_batches = lambda: self.iter_indices(batch_size, shuffle, rng)
+        dataset = tf.data.Dataset.from_generator(index_batches, output_signature=tf.TensorSpec(shape=(None,), dtype=tf.int64))
+
+        # Read the batches concurrently (in completion order when shuffling)
+        def read_batch(indices):
+            windows, labels = tf.numpy_function(self.get_batch, [indices], (tf.float32, tf.int64))
+            windows.set_shape((None,) + self.window_shape)
+            labels.set_shape((None,))
+            return windows, labels
+        dataset = dataset.map(read_batch, num_parallel_calls=num_parallel_reads, deterministic=not shuffle)
+
+        if cached:
+            dataset = dataset.cache(self.cache)
+            if shuffle:
+                dataset = dataset.unbatch().shuffle(self.shuffle_buffer, seed=seed, reshuffle_each_iteration=True).batch(batch_size)
+        return dataset.prefetch(tf.data.AUTOTUNE)
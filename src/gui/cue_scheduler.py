@@ -0,0 +1,176 @@
+import csv
+import random
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Label of the rest periods between cues
+REST = "Rest"
+
+
+def wait_until(deadline: float, spin_threshold: float=0.002) -> float:
+    '''
+    Wait until a time of the time.perf_counter clock: sleep until shortly before it, then spin for the rest.
+
+    Sleeping is cheap but can overshoot by the timer resolution of the operating system (up to about 15 ms on
+    Windows); spinning only for the last spin_threshold seconds gives sub-millisecond accuracy at little CPU cost.
+
+    args:
+        deadline (float): The time to wait for, in seconds of time.perf_counter.
+        spin_threshold (float): The time in seconds before the deadline when sleeping stops.
+
+    returns:
+        float: The time.perf_counter value when the wait ended.
+    '''
+    remaining = deadline - time.perf_counter()
+    if remaining > spin_threshold:
+        time.sleep(remaining - spin_threshold)
+    now = time.perf_counter()
+    while now < deadline:
+        now = time.perf_counter()
+    return now
+
+
+class CueScheduler():
+    '''
+    A class to show the cues of an experiment at precise times from a background thread.
+
+    The schedule is fixed before the first cue (onsets relative to the start), so delays do not accumulate from cue
+    to cue, and each onset is waited for with wait_until. The measured onset of every cue is recorded to quantify
+    the timing error of the labels.
+    '''
+    def __init__(self, class_list: Iterable[str], cue_period: float, on_cue: Callable[[str, float], None], num_trials: int=1,
+                 shuffle: bool=False, rest_range: Tuple[float, float]=(0.0, 0.0), seed: Optional[int]=None, spin_threshold: float=0.002) -> None:
+        '''
+        Constructor for the CueScheduler class.
+
+        args:
+            class_list (Iterable[str]): The classes, cued once per trial.
+            cue_period (float): The time in seconds each cue is shown.
+            on_cue (Callable[[str, float], None]): Called at each onset with the class (REST for the rest periods) and the unix time.
+            num_trials (int): The number of times each class is cued.
+            shuffle (bool): Whether to randomize the order of the classes within each trial.
+            rest_range (Tuple[float, float]): The minimum and maximum of the random rest period after each cue, in seconds.
+            seed (int): The seed of the random order and rest periods.
+            spin_threshold (float): The time in seconds before each onset when sleeping turns into spinning.
+        '''
+        self.class_list = list(class_list)
+        self.cue_period = float(cue_period)
+        self.on_cue = on_cue
+        self.num_trials = int(num_trials)
+        self.shuffle = shuffle
+        self.rest_range = rest_range
+        self.seed = seed
+        self.spin_threshold = spin_threshold
+
+        self.schedule = self.build_schedule()
+        self.onsets = []
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def build_schedule(self) -> List[Tuple[float, str]]:
+        '''
+        Build the onsets of the cues and rest periods.
+
+        returns:
+            List[Tuple[float, str]]: The onset in seconds from the start and the class of each cue, then the end of the last cue (class None).
+        '''
+        rng = random.Random(self.seed)
+        schedule = []
+        onset = 0.0
+        for _ in range(self.num_trials):
+            classes = list(self.class_list)
+            if self.shuffle:
+                rng.shuffle(classes)
+            for class_ in classes:
+                schedule.append((onset, class_))
+                onset += self.cue_period
+                rest = rng.uniform(*self.rest_range) if self.rest_range[1] > 0 else 0.0
+                if rest > 0:
+                    schedule.append((onset, REST))
+                    onset += rest
+        schedule.append((onset, None))
+        return schedule
+
+    @property
+    def duration(self) -> float:
+        '''
+        The duration of the experiment in seconds.
+        '''
+        return self.schedule[-1][0]
+
+    def start(self, on_done: Optional[Callable[[], None]]=None) -> None:
+        '''
+        Start showing the cues from a background thread.
+
+        args:
+            on_done (Callable[[], None]): Called from the thread at the end of the last cue.
+        '''
+        self.stop_event.clear()
+        self.onsets = []
+        self.thread = threading.Thread(target=self._run, args=(on_done,), name="cue_scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop showing cues, e.g. when the experiment is aborted.
+        '''
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def _run(self, on_done: Optional[Callable[[], None]]) -> None:
+        '''
+        Wait for each onset of the schedule and show its cue.
+        '''
+        start_time = time.perf_counter()
+        for onset, class_ in self.schedule:
+            # Sleep in steps, so stop is handled during long cues
+            deadline = start_time + onset
+            while deadline - time.perf_counter() > 0.1 + self.spin_threshold:
+                if self.stop_event.wait(deadline - time.perf_counter() - self.spin_threshold - 0.05):
+                    return
+            actual = wait_until(deadline, self.spin_threshold)
+            if class_ is not None:
+                self.on_cue(class_, time.time())
+            self.onsets.append((class_, onset, actual - start_time))
+        if on_done is not None:
+            on_done()
+
+    def get_jitter_stats(self) -> dict:
+        '''
+        Get statistics of the onset errors (measured minus scheduled onset) of the cues shown.
+
+        returns:
+            dict: The number of onsets and the mean, median, 99th percentile and maximum error in milliseconds.
+        '''
+        if not self.onsets:
+            return {'onsets': 0}
+        errors = np.array([actual - scheduled for _, scheduled, actual in self.onsets]) * 1e3
+        return {'onsets': len(errors),
+                'mean_ms': float(errors.mean()),
+                'p50_ms': float(np.median(errors)),
+                'p99_ms': float(np.percentile(errors, 99)),
+                'max_ms': float(errors.max())}
+
+
+def save_onsets(file_path: str, onsets: Iterable[Tuple[Optional[str], float, float]]) -> str:
+    '''
+    Save the scheduled and measured onsets of a session.
+
+    args:
+        file_path (str): Path to the CSV file.
+        onsets (Iterable[Tuple[Optional[str], float, float]]): The class (None for the end), scheduled and measured onset in seconds of each cue.
+
+    returns:
+        str: Path to the CSV file.
+    '''
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Class", "Scheduled", "Onset", "Error (ms)"])
+        for class_, scheduled, actual in onsets:
+            writer.writerow([class_ if class_ is not None else "End", f"{scheduled:.6f}", f"{actual:.6f}", f"{(actual - scheduled) * 1e3:.3f}"])
+    return file_path
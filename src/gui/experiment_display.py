@@ -0,0 +1,302 @@
+'''
+The subject's experiment screen, run in its own process.
+
+The process is started once and reused for every collection. It only imports Dear PyGui, so it starts in a
+fraction of a second. The main GUI sends it commands over a local connection, and it sends back an event as each cue is shown,
+so the data collector can stamp the cue into the data stream as a marker at that moment.
+
+Commands (main GUI -> display):
+    ("experiment", class_list, cue_period, options)     Show the instructions; the cues start when the subject clicks.
+                                                        options holds the CueScheduler arguments (num_trials, shuffle, rest_range, seed)
+    ("quit",)                                           Close the display
+
+Events (display -> main GUI):
+    ("ready", timestamp)                                The display is waiting for an experiment
+    ("start", timestamp)                                The subject dismissed the instructions
+    ("cue", class_name, timestamp)                      A cue (or a REST period) is shown
+    ("done", timestamp, onsets, jitter_stats)           The last cue period is over, with the measured onsets of the cues
+    ("closed", timestamp)                               The display window was closed
+'''
+
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Iterable, Optional, Tuple
+
+from gui.cue_scheduler import CueScheduler
+
+# Entry point of the display process
+SUBJECT_GUI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "subject_gui.py")
+
+# Environment variable passing the key that authenticates the display to the main GUI
+AUTHKEY_VARIABLE = "SMMR_DISPLAY_AUTHKEY"
+
+# Text of the cue button before the experiment starts
+INSTRUCTIONS = '''
+                                Welcome!
+
+In this experiment, you will be asked to perform different actions at specific cues.
+
+                          ... bla bla bla ...'''
+
+# Text of the cue button between experiments
+WAITING = "Waiting for the next experiment..."
+
+
+def run_display(connection: Optional[Connection], class_list: Optional[Iterable[str]]=None, cue_period: float=5.0, options: Optional[dict]=None,
+                viewport_width: int=800, viewport_height: int=600, icon_path: Optional[str]=None) -> Optional[list]:
+    '''
+    Run the experiment screen until it is closed or told to quit.
+
+    args:
+        connection (Connection): The display end of the connection to the main GUI. None runs a single experiment without a connection.
+        class_list (Iterable[str]): The classes of the experiment to show at once (needed without a connection).
+        cue_period (float): The time in seconds each cue is shown.
+        options (dict): Additional CueScheduler arguments of the experiment to show at once.
+        viewport_width (int): The width of the window.
+        viewport_height (int): The height of the window.
+        icon_path (str): Path to the window icon.
+
+    returns:
+        list: Without a connection, the (class, timestamp) of the instructions and of each cue. None with a connection.
+    '''
+    import dearpygui.dearpygui as dpg
+
+    cues = []
+    experiment = {'class_list': list(class_list) if class_list else None, 'cue_period': cue_period, 'options': options or {}, 'scheduler': None}
+
+    def send(*event) -> None:
+        if connection is not None:
+            connection.send(event)
+
+    def show_cue(class_: str, timestamp: float) -> None:
+        # Called by the scheduler thread at the onset of each cue
+        dpg.set_item_label("cue_button", class_)
+        cues.append((class_, timestamp))
+        send("cue", class_, timestamp)
+
+    def finish_experiment() -> None:
+        # Called by the scheduler thread at the end of the last cue
+        scheduler = experiment['scheduler']
+        send("done", time.time(), scheduler.onsets, scheduler.get_jitter_stats())
+
+        # Wait for the next experiment, or finish after a single experiment without a connection
+        dpg.set_item_label("cue_button", WAITING)
+        if connection is None:
+            dpg.stop_dearpygui()
+
+    def cue_button_cb(sender, app_data):
+        # Disable the button to avoid re-triggering the callback
+        dpg.configure_item(sender, enabled=False)
+        if not experiment['class_list']:
+            return
+
+        # Store the timestamp after the instructions are done
+        cues.append(("Instructions", time.time()))
+        send("start", cues[-1][1])
+
+        # Show the cues from the scheduler thread, so the window keeps rendering
+        experiment['scheduler'] = CueScheduler(experiment['class_list'], experiment['cue_period'], show_cue, **experiment['options'])
+        experiment['class_list'] = None
+        experiment['scheduler'].start(on_done=finish_experiment)
+
+    def show_experiment(class_list: Iterable[str], cue_period: float, options: dict) -> None:
+        if experiment['scheduler'] is not None:
+            experiment['scheduler'].stop()
+        experiment['class_list'] = list(class_list)
+        experiment['cue_period'] = cue_period
+        experiment['options'] = options
+        dpg.set_item_label("cue_button", INSTRUCTIONS)
+        dpg.configure_item("cue_button", enabled=True)
+
+    dpg.create_context()
+    with dpg.window(label="Experiment",
+                    width=viewport_width,
+                    height=viewport_height,
+                    no_close=True,
+                    no_move=True,
+                    no_background=True,
+                    no_scrollbar=True,
+                    no_title_bar=True,
+                    autosize=True,
+                    tag="experiment_window"):
+        dpg.add_button(label=WAITING,
+                       width=viewport_width-20,
+                       height=viewport_height-20,
+                       enabled=False,
+                       tag="cue_button",
+                       callback=cue_button_cb)
+
+    viewport_args = {'small_icon': icon_path, 'large_icon': icon_path} if icon_path else {}
+    dpg.create_viewport(title="Super Mega Mind Reader 3000 (Experiment Mode)", width=viewport_width, height=viewport_height, **viewport_args)
+    dpg.setup_dearpygui()
+    dpg.show_viewport()
+    if experiment['class_list']:
+        show_experiment(experiment['class_list'], cue_period, experiment['options'])
+    send("ready", time.time())
+
+    # Render manually, handling the commands of the main GUI between frames
+    while dpg.is_dearpygui_running():
+        while connection is not None and connection.poll():
+            try:
+                command = connection.recv()
+            except EOFError:
+                command = ("quit",)
+            if command[0] == "experiment":
+                show_experiment(command[1], command[2], command[3])
+            elif command[0] == "quit":
+                dpg.stop_dearpygui()
+                break
+        dpg.render_dearpygui_frame()
+
+    if experiment['scheduler'] is not None:
+        experiment['scheduler'].stop()
+    dpg.destroy_context()
+    try:
+        send("closed", time.time())
+    except (BrokenPipeError, OSError):
+        pass
+    return cues if connection is None else None
+
+
+class ExperimentDisplay():
+    '''
+    A class to start the experiment screen once and run experiments on it from the main GUI.
+    '''
+    def __init__(self, viewport_width: int=800, viewport_height: int=600, icon_path: Optional[str]=None, connect_timeout: float=30.0) -> None:
+        '''
+        Constructor for the ExperimentDisplay class.
+
+        args:
+            viewport_width (int): The width of the window.
+            viewport_height (int): The height of the window.
+            icon_path (str): Path to the window icon.
+            connect_timeout (float): The maximum time in seconds the display process may take to connect.
+        '''
+        self.viewport_width = viewport_width
+        self.viewport_height = viewport_height
+        self.icon_path = icon_path
+        self.connect_timeout = connect_timeout
+        self.process = None
+        self.connection = None
+
+    def start(self) -> None:
+        '''
+        Start the display process if it is not running, and wait until it is connected.
+
+        The display runs subject_gui.py in a new interpreter (not a fork or a multiprocessing spawn, which would
+        import the main GUI module and TensorFlow again), connected through an authenticated local socket or named pipe.
+
+        raises:
+            TimeoutError: If the display process does not connect in time.
+        '''
+        if self.is_alive():
+            return
+        authkey = os.urandom(16)
+        with Listener(authkey=authkey) as listener:
+            command = [sys.executable, "-u", SUBJECT_GUI_PATH, "--connect", str(listener.address),
+                       "--width", str(self.viewport_width), "--height", str(self.viewport_height)]
+            if self.icon_path:
+                command += ["--icon", self.icon_path]
+            self.process = subprocess.Popen(command, env=dict(os.environ, **{AUTHKEY_VARIABLE: authkey.hex()}))
+
+            # Accept in a thread, so a display that fails to start cannot block the GUI
+            accepted = {}
+
+            def accept():
+                try:
+                    accepted['connection'] = listener.accept()
+                except (OSError, EOFError, mp.AuthenticationError):
+                    pass
+
+            thread = threading.Thread(target=accept, name="experiment_display_accept", daemon=True)
+            thread.start()
+            thread.join(self.connect_timeout)
+        if 'connection' not in accepted:
+            self.process.kill()
+            self.process = None
+            raise TimeoutError("The experiment display did not start.")
+        self.connection = accepted['connection']
+
+    def is_alive(self) -> bool:
+        '''
+        Whether the display process is running.
+        '''
+        return self.process is not None and self.process.poll() is None
+
+    def run_experiment(self, class_list: Iterable[str], cue_period: float, num_trials: int=1, shuffle: bool=False,
+                       rest_range: Tuple[float, float]=(0.0, 0.0), seed: Optional[int]=None) -> None:
+        '''
+        Show the instructions of a new experiment, starting the display if needed. The events are read with get_event.
+
+        args:
+            class_list (Iterable[str]): The classes.
+            cue_period (float): The time in seconds each cue is shown.
+            num_trials (int): The number of times each class is cued.
+            shuffle (bool): Whether to randomize the order of the classes within each trial.
+            rest_range (Tuple[float, float]): The minimum and maximum of the random rest period after each cue, in seconds.
+            seed (int): The seed of the random order and rest periods.
+        '''
+        self.start()
+
+        # Drop the events left from the previous experiment
+        while self.connection.poll():
+            self.connection.recv()
+        options = {'num_trials': num_trials, 'shuffle': shuffle, 'rest_range': tuple(rest_range), 'seed': seed}
+        self.connection.send(("experiment", list(class_list), float(cue_period), options))
+
+    def get_event(self, timeout: Optional[float]=None) -> Optional[tuple]:
+        '''
+        Wait for the next event of the display.
+
+        args:
+            timeout (float): The maximum wait in seconds. None waits until an event arrives.
+
+        returns:
+            tuple: The event, ("closed", timestamp) if the display process ended, or None after the timeout.
+        '''
+        try:
+            if not self.connection.poll(timeout):
+                return None
+            return self.connection.recv()
+        except (EOFError, OSError):
+            return ("closed", time.time())
+
+    def close(self) -> None:
+        '''
+        Close the display process.
+        '''
+        if self.is_alive():
+            try:
+                self.connection.send(("quit",))
+                self.process.wait(timeout=5.0)
+            except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        if self.connection is not None:
+            self.connection.close()
+        self.process = None
+        self.connection = None
+
+
+def connect(address: str) -> Connection:
+    '''
+    Connect the display process to the main GUI.
+
+    args:
+        address (str): The address of the listener of the main GUI.
+
+    returns:
+        Connection: The display end of the connection.
+    '''
+    return Client(address, authkey=bytes.fromhex(os.environ[AUTHKEY_VARIABLE]))
+
+
+def get_icon_path() -> str:
+    '''
+    Get the path to the application icon.
+    '''
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "img", "icon.ico")
@@ -1,16 +1,31 @@
 import dearpygui.dearpygui as dpg
 from os import path
-from data.dataset_handler import DatasetHandler
+from data.dataset_handler import DatasetHandler, get_shared_class_names
 from data.data_collector import DataCollector
-from models.model import ModelHandler
+from brainflow.board_shim import BoardIds
+from data.session_recorder import SessionLog, LOG_EXTENSION
+from data.montage import CYTON_MONTAGE
+from data.packed_dataset import PACKED_EXTENSION
+from data.preprocessing_cache import PreprocessingCache
+from data.window_source import FileWindowSource, SlidingWindowSource
+from models.model import ModelHandler, BASE_LEARNING_RATE, scale_learning_rate
+from models.callbacks import ThroughputLogger
+from models.model_zoo import MODELS
+from models.live_inference import LivePredictor
+from models.prediction_server import PredictionClient, start_server_process
 import os
-import multiprocessing as mp
-import subprocess
 from gui.test_window import demo_
+from gui.plot_updater import PlotUpdater
+from gui.experiment_display import ExperimentDisplay
+from gui.cue_scheduler import REST, save_onsets
 from numpy import random
 import time
 import sys
+import tempfile
+import subprocess
 import pandas as pd
+import numpy as np
+from typing import Optional
 
 class GUI:
     '''
@@ -35,7 +50,128 @@ class GUI:
 
         # Initialize the model handler
         self.model_handler = ModelHandler(self.dataset_handler)
+
+        # Initialize the cache of processed datasets (least recently used datasets are evicted above 20 GiB)
+        self.preprocessing_cache = PreprocessingCache(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "processed"),
+                                                      max_size_bytes=20 * 2**30)
+
+        # Live inference state
+        self.live_collector = None
+        self.live_predictor = None
+        self.live_plot_updater = None
+
+        # Prediction server process started by this GUI for live inference, if any
+        self.prediction_server = None
+
+        # Experiment display on the subject's screen, started by the first collection and reused
+        self.experiment_display = ExperimentDisplay(self.viewport_width, self.viewport_height, self.icon_path)
+
+    def create_data_collector(self) -> DataCollector:
+        '''
+        Create a data collector for the board selected in the Collect section (headset, synthetic board or replay).
+
+        returns:
+            DataCollector: The data collector.
+        '''
+        source = dpg.get_value("board_source_combo")
+        if source == "Synthetic":
+            return DataCollector(board_id=BoardIds.SYNTHETIC_BOARD.value)
+        if source == "Replay":
+            return DataCollector(replay_file=dpg.get_value("replay_file_input_text"),
+                                 replay_speed=dpg.get_value("replay_speed_input"),
+                                 replay_loop=dpg.get_value("replay_loop_checkbox"))
+        return DataCollector()
+
+    def create_plot_updater(self, data_collector: DataCollector, seconds: float=2.0, frame_rate: float=30.0) -> PlotUpdater:
+        '''
+        Create a plot updater showing the latest samples of the EEG channels of a started acquisition.
+
+        args:
+            data_collector (DataCollector): The data collector, after start_acquisition.
+            seconds (float): The time span shown by the plots.
+            frame_rate (float): The number of refreshes per second.
+
+        returns:
+            PlotUpdater: The plot updater (not started).
+        '''
+        channels = data_collector.eeg_channels[:8]
+        return PlotUpdater(data_collector.ring_buffer,
+                           channels,
+                           [f"channel_{plot}_plot" for plot in range(1, len(channels) + 1)],
+                           dpg.set_value,
+                           num_samples=int(seconds * data_collector.sampling_rate),
+                           width=self.plot_width,
+                           frame_rate=frame_rate)
         
+    def stop_live_inference(self) -> None:
+        '''
+        Stop the live inference, release the board and stop the prediction server started for it.
+        '''
+        if self.live_predictor is None:
+            return
+        self.live_predictor.stop()
+        self.live_plot_updater.stop()
+        print(f"Live inference: {self.live_predictor.report()}")
+        self.live_collector.stop_acquisition()
+        self.live_collector.stop_streaming()
+        if isinstance(self.live_predictor.model, PredictionClient):
+            try:
+                print(f"Prediction server: {self.live_predictor.model.get_stats()}")
+            except (ConnectionError, OSError, RuntimeError) as e:
+                print(f"Prediction server unavailable: {e}")
+            self.live_predictor.model.close()
+        self.stop_prediction_server()
+        self.live_predictor = None
+        self.live_plot_updater = None
+        self.live_collector = None
+
+    def start_prediction_server(self, backend: str, quantization: Optional[str], calibration_data: Optional[np.ndarray]) -> None:
+        '''
+        Start a prediction server serving the current model, which is stopped with the live inference.
+
+        args:
+            backend (str): The inference backend of the server.
+            quantization (str): None, "float16" or "int8" quantization of the tflite backend.
+            calibration_data (np.ndarray): Representative windows to calibrate int8 quantization, or None.
+
+        raises:
+            RuntimeError: If the server exits before accepting clients.
+            TimeoutError: If the server does not start in time.
+        '''
+        # Hand the server the current weights (trained or loaded) through temporary files, removed once it has loaded them
+        server_files = os.path.join(tempfile.gettempdir(), f"smmr_prediction_server_{os.getpid()}")
+        weights_path = f"{server_files}.hdf5"
+        calibration_path = f"{server_files}_calibration.npy" if calibration_data is not None else None
+        try:
+            self.model_handler.model.save_weights(weights_path)
+            if calibration_path is not None:
+                np.save(calibration_path, calibration_data)
+            self.prediction_server = start_server_process(weights_path=weights_path, backend=backend,
+                                                          input_shape=self.model_handler.model.input_shape[1:],
+                                                          num_labels=self.model_handler.model.output_shape[-1],
+                                                          model_name=self.model_handler.model_name,
+                                                          quantization=quantization,
+                                                          calibration_path=calibration_path)
+        finally:
+            for file_path in (weights_path, calibration_path):
+                if file_path is not None and path.exists(file_path):
+                    os.remove(file_path)
+        print(f"Prediction server started (pid {self.prediction_server.pid})")
+
+    def stop_prediction_server(self) -> None:
+        '''
+        Stop the prediction server started by this GUI, if any.
+        '''
+        if self.prediction_server is None:
+            return
+        self.prediction_server.terminate()
+        try:
+            self.prediction_server.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            self.prediction_server.kill()
+        print(f"Prediction server stopped (pid {self.prediction_server.pid})")
+        self.prediction_server = None
+
     def setup_gui(self) -> None:
         '''
         Setup the GUI of the application.
@@ -52,20 +188,6 @@ class GUI:
                             small_icon=self.icon_path,
                             large_icon=self.icon_path)
     
-    def setup_subject_gui(self, args) -> None:
-        '''
-        Setup the GUI of the application for the subject.
-        '''
-        # Add experiment container
-        self.add_experiment_container(args)
-
-        # Create the viewport
-        dpg.create_viewport(title="Super Mega Mind Reader 3000 (Experiment Mode)",
-                            width=self.viewport_width,
-                            height=self.viewport_height,
-                            small_icon=self.icon_path,
-                            large_icon=self.icon_path)
-
     def add_data_container(self):
         '''
         Add the data container to the GUI.
@@ -100,8 +222,8 @@ class GUI:
 
             # Connect to the BCI headset if available
             print("Connecting to BCI headset...")
-            dc = DataCollector()
-            if not dc.port or not dc.board:
+            dc = self.create_data_collector()
+            if not dc.is_connected():
                 print("BCI headset not found. Please check the connection.")
                 return
             dc.print_device_info()
@@ -115,58 +237,75 @@ class GUI:
                 print("Failed to start streaming. Please check the headset connection.")
                 return
 
-            # Create a queue to communicate with the subject GUI
-            queue = mp.Queue()
-            
-            # Run the script in a separate process
-            print(f"pre: {class_list} {cue_period}")
-            subject_gui_process = mp.Process(target=self.run_subject_gui, args=(queue, class_list, cue_period))
+            # Show the experiment on the subject's screen, starting the display process the first time
+            try:
+                self.experiment_display.run_experiment(class_list,
+                                                       cue_period or 5.0,
+                                                       num_trials=dpg.get_value("trials_input"),
+                                                       shuffle=dpg.get_value("shuffle_cues_checkbox"),
+                                                       rest_range=(dpg.get_value("rest_min_input"), dpg.get_value("rest_max_input")))
+            except TimeoutError as e:
+                print(f"Error: {e}")
+                dc.stop_streaming()
+                return
+
+            # Drain the board in the background, appending the session to a crash-safe log. Each cue is stamped into
+            # the marker row of the data stream as it is shown, with the marker value of its class (rest periods are stamped too)
+            marker_codes = {class_: code for code, class_ in enumerate(class_list + [REST], start=1)}
+            end_marker = len(marker_codes) + 1
+            log_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'raw',
+                                    f"session_{time.strftime('%Y%m%d_%H%M%S')}{LOG_EXTENSION}")
+            dc.start_acquisition(poll_rate=50.0, record=False, log_path=log_path,
+                                 metadata={'marker_classes': {code: class_ for class_, code in marker_codes.items()}})
 
-            # Start the subject GUI process
-            subject_gui_process.start()
+            # Refresh the plots with the latest 2 seconds at 30 frames per second, decimated to the plot width
+            plot_updater = self.create_plot_updater(dc)
+            plot_updater.start()
 
-            # Collect data until the experiment is done
+            # Collect data until the experiment is done, stamping the cues as they arrive
             experiment_done = False
             while not experiment_done:
-                # Get the current data from the board (last 254 packages)
-                channel_data = dc.get_current_board_data()
-                try:
-                    # Update the plots with the new data
-                    for ch in range(1,9):
-                        dpg.set_value(f"channel_{ch}_plot", list(channel_data[ch]))
-                    
-                    # Check if the experiment is done
-                    experiment_done = queue.get_nowait()
-                except:
-                    pass
-                
-            # Get run dataset
-            dataset = dc.get_board_data()
+                event = self.experiment_display.get_event(timeout=1.0)
+                if event is None:
+                    continue
+                if event[0] == "cue":
+                    dc.insert_marker(marker_codes[event[1]])
+                    print(f"Cue: {event[1]}")
+                elif event[0] == "done":
+                    dc.insert_marker(end_marker)
+                    onsets, jitter = event[2], event[3]
+                    experiment_done = True
+                elif event[0] == "closed":
+                    print("The experiment display was closed before the end of the experiment.")
+                    onsets = None
+                    experiment_done = True
+
+            # Complete the session log
+            plot_updater.stop()
+            print(f"Plots: {plot_updater.report()}")
+            dc.stop_acquisition()
 
             # Stop streaming data
             print("\nStopping data collection...")
             dc.stop_streaming()
 
-            # Get the path to the class timestamps file
-            class_df_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'class_timestamps.csv')
-            # Load the class timestamps file
-            class_df = pd.read_csv(class_df_path, on_bad_lines='warn')
+            # Keep the measured cue onsets next to the session log, to quantify the timing error of the labels
+            if onsets is not None:
+                save_onsets(f"{log_path}.cues.csv", onsets)
+                print(f"Cue onset error: {jitter}")
 
-            # Drop unnecessary columns from the sensor dataset
-            dataset = dataset.iloc[:, list(range(1, 9)) + [-2]]
-            # Add headers
-            dataset.columns = [f'Channel {n}' for n in range(1, 9)] + ['Timestamp']
+            # Export the session next to its log, in BrainFlow's format and as the EEG channels and timestamps labeled
+            # with the cue markers stamped into the stream (without the rest periods), chunk by chunk
+            session_path = log_path[:-len(LOG_EXTENSION)]
+            session_log = SessionLog(log_path)
+            session_log.export_csv(f"{session_path}.csv")
+            merged_path = session_log.export_marked(f"{session_path}_merged.csv", channels=dc.eeg_channels[:CYTON_MONTAGE.num_channels],
+                                                    timestamp_column=dc.timestamp_channel, exclude=("Instructions", REST))
 
-            # Merge the sensor data dataset with the class timestamps
-            merged_df = pd.merge_asof(dataset, class_df, on='Timestamp', direction='nearest')
-            # Drop the rows with Class = Instructions
-            merged_df = merged_df[merged_df['Class'] != 'Instructions']
-            
-            # Save the dataset to a CSV file
-            merged_df.to_csv("merged_dataset.csv", index=False)
-            
-            # Wait for the subject GUI process to finish
-            subject_gui_process.join()
+            # Preprocess the new session by default
+            self.dataset_handler.raw_dataset_path = merged_path
+            dpg.set_value("current_raw_dataset_name", f"Raw Dataset: {path.basename(merged_path)}")
+            print(f"Session exported to {session_path}.csv and {merged_path}")
 
 
         def file_dialog_cb(sender: str, app_data: dict)->None:
@@ -246,7 +385,11 @@ class GUI:
             if dataset_type == "Raw":
                 dpg.show_item("load_data_file_dialog")
             elif dpg.get_value("load_data_combo_box") == "Train" or dpg.get_value("load_data_combo_box") == "Test" or dpg.get_value("load_data_combo_box") == "Valid":
-                dpg.show_item("load_data_folder_dialog")
+                # Packed datasets are single files, TIFF datasets are folders
+                if dpg.get_value("load_packed_checkbox"):
+                    dpg.show_item("load_packed_file_dialog")
+                else:
+                    dpg.show_item("load_data_folder_dialog")
             else:
                 raise ValueError("Invalid dataset type selected")
             
@@ -269,23 +412,55 @@ class GUI:
             # Get the selected preset
             preset = dpg.get_value("preprocess_preset_option")
             if preset == "O'Neill":
-                # Get current timestamp
-                timestamp = time.strftime("%Y%m%d_%H%M%S")
                 print("Preprocessing dataset using O'Neill's method...")
-                # Load the dataset as a dataframe
-                df = self.dataset_handler.load_csv_as_dataframe(self.dataset_handler.raw_dataset_path)
-
-                # Create a folder to store the processed dataset
-                store_folder_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "processed", f"oneill_{timestamp}")
-                print("store_folder_path: ", store_folder_path)
-                os.makedirs(store_folder_path, exist_ok=True)
-                
-                # Preprocess the dataset using O'Neill's method
-                self.dataset_handler.preprocess_oneill(df,
-                                                       window_size=64,
-                                                       overlap=0.25,
-                                                       store_folder=store_folder_path,
-                                                       normalize=True)
+                raw_dataset_path = self.dataset_handler.raw_dataset_path
+                output_format = "packed" if dpg.get_value("preprocess_packed_checkbox") else "tiff"
+                streaming = dpg.get_value("preprocess_streaming_checkbox")
+                compact = dpg.get_value("preprocess_compact_checkbox")
+                params = {'preset': "O'Neill",
+                          'window_size': 64,
+                          'overlap': 0.25,
+                          'normalize': True,
+                          'montage': CYTON_MONTAGE.name,
+                          'output_format': output_format,
+                          'streaming': streaming,
+                          'compact': compact,
+                          'dtype': "float64"}
+
+                def build(store_folder_path: str) -> str:
+                    print("store_folder_path: ", store_folder_path)
+
+                    # Read the recording in chunks to keep the memory use bounded
+                    if streaming:
+                        return self.dataset_handler.preprocess_oneill_streaming(raw_dataset_path,
+                                                                                window_size=params['window_size'],
+                                                                                overlap=params['overlap'],
+                                                                                store_folder=store_folder_path,
+                                                                                normalize=params['normalize'],
+                                                                                montage=CYTON_MONTAGE,
+                                                                                output_format=output_format,
+                                                                                dtype=np.dtype(params['dtype']),
+                                                                                compact=compact)
+
+                    # Load the dataset as a dataframe
+                    df = self.dataset_handler.load_csv_as_dataframe(raw_dataset_path)
+
+                    # Preprocess the dataset using O'Neill's method
+                    return self.dataset_handler.preprocess_oneill(df,
+                                                                  window_size=params['window_size'],
+                                                                  overlap=params['overlap'],
+                                                                  store_folder=store_folder_path,
+                                                                  normalize=params['normalize'],
+                                                                  montage=CYTON_MONTAGE,
+                                                                  output_format=output_format,
+                                                                  session=path.basename(raw_dataset_path),
+                                                                  num_workers=os.cpu_count() or 1,
+                                                                  compact=compact)
+
+                # Reuse the processed dataset if this recording was already preprocessed with the same parameters
+                output_path = self.preprocessing_cache.get_or_create(raw_dataset_path, params, build)
+                print(f"Processed dataset: {output_path}")
+                print(self.preprocessing_cache.report())
 
             elif preset == "Preset A":
                 print("Preprocessing dataset using Preset A...")
@@ -307,6 +482,10 @@ class GUI:
         with dpg.file_dialog(directory_selector=True, show=False, callback=folder_dialog_cb, tag="load_data_folder_dialog", width=700 ,height=400):
             dpg.add_file_extension("", color=(150, 150, 255, 255))
 
+        with dpg.file_dialog(directory_selector=False, show=False, callback=folder_dialog_cb, tag="load_packed_file_dialog", width=700 ,height=400):
+            dpg.add_file_extension("", color=(150, 150, 255, 255))
+            dpg.add_file_extension(PACKED_EXTENSION, color=(255, 200, 100, 255))
+
         with dpg.window(label="Data",
                         width=self.viewport_width//3,
                         height=self.viewport_height//2,
@@ -334,11 +513,20 @@ class GUI:
                 dpg.add_input_text(label="Seconds",
                                    decimal=True,
                                    tag="cue_period_input_text")
+                dpg.add_input_int(label="Trials", default_value=1, min_value=1, min_clamped=True, tag="trials_input")
+                dpg.add_checkbox(label="Randomize cue order", default_value=False, tag="shuffle_cues_checkbox")
+                dpg.add_input_float(label="Rest min (s)", default_value=0.0, min_value=0.0, min_clamped=True, tag="rest_min_input")
+                dpg.add_input_float(label="Rest max (s)", default_value=0.0, min_value=0.0, min_clamped=True, tag="rest_max_input")
+                dpg.add_combo(("Headset", "Synthetic", "Replay"), label="Board", default_value="Headset", tag="board_source_combo")
+                dpg.add_input_text(label="Replay file", hint=f"session{LOG_EXTENSION} or full_dataset.csv", tag="replay_file_input_text")
+                dpg.add_input_float(label="Replay speed", default_value=1.0, min_value=0.1, min_clamped=True, tag="replay_speed_input")
+                dpg.add_checkbox(label="Loop replay", default_value=False, tag="replay_loop_checkbox")
 
 
             with dpg.collapsing_header(label="Load"):
                 dpg.add_button(label="Load", callback=load_data_cb, tag="load_data_button")
                 dpg.add_combo(("Raw", "Train", "Test", "Valid"), default_value=None, tag="load_data_combo_box", callback=load_data_combo_cb)
+                dpg.add_checkbox(label=f"Packed ({PACKED_EXTENSION})", default_value=False, tag="load_packed_checkbox")
 
                 #with dpg.group(horizontal=True):
                  #   dpg.add_radio_button(("Raw", "Train", "Test", "Valid"), horizontal=True, default_value="Raw", tag="load_radio_button",)
@@ -350,6 +538,9 @@ class GUI:
                                 dpg.add_button(label="Preprocess", callback=preprocess_preset_cb, tag="preprocess_preset_button")
                                 dpg.add_text("This is the preset tab!")
                                 dpg.add_radio_button(("O'Neill", "Preset A", "Preset B"), tag="preprocess_preset_option", default_value="O'Neill")
+                                dpg.add_checkbox(label="Packed output", default_value=False, tag="preprocess_packed_checkbox")
+                                dpg.add_checkbox(label="Low memory (streaming)", default_value=False, tag="preprocess_streaming_checkbox")
+                                dpg.add_checkbox(label="Compact windows (no grid)", default_value=False, tag="preprocess_compact_checkbox")
                             
                             with dpg.tab(label="Custom"):
                                 dpg.add_button(label="Preprocess", callback=_log, tag="preprocess_custom_button")
@@ -382,32 +573,102 @@ class GUI:
         '''
         def model_file_dialog_cb(sender, app_data):
             model_path = app_data['file_path_name']
+            # The weights are loaded into the selected architecture
+            self.model_handler.match_window_shape(self.model_handler.model.input_shape[1:], self.model_handler.model.output_shape[-1],
+                                                  model_name=dpg.get_value("model_architecture_combo"))
             self.model_handler.load_h5_or_hdf5(model_path)
             print("Loaded Model Path: ", model_path)
 
         def summarize_model_cb():
             print("Model Summary")
             self.model_handler.model.summary()
+            self.model_handler.describe_model()
 
         def train_model_cb():
-            # Load train, test, and validation datasets
-            print("Loading train, test, and validation datasets...")
-            self.dataset_handler.load_train_test_val_directories()
+            if dpg.get_value("lazy_windows_checkbox"):
+                # Serve windows lazily from the raw dataset, split in time into train, validation and test
+                print("Creating train, test, and validation windows from the raw dataset...")
+                df = self.dataset_handler.load_csv_as_dataframe(self.dataset_handler.raw_dataset_path)
+                source = SlidingWindowSource.from_dataframe(df, window_size=64, overlap=0.25, normalize=True,
+                                                            compact=dpg.get_value("preprocess_compact_checkbox"))
+                train_source, val_source, test_source = source.split((0.7, 0.15, 0.15))
+                self.dataset_handler.train_images, self.dataset_handler.train_labels = train_source, train_source.labels
+                self.dataset_handler.val_images, self.dataset_handler.val_labels = val_source, val_source.labels
+                self.dataset_handler.test_images, self.dataset_handler.test_labels = test_source, test_source.labels
+                self.dataset_handler.class_names = source.class_names
+            elif dpg.get_value("stream_datasets_checkbox"):
+                # Read the windows of the stored datasets from disk while training, instead of loading them first
+                print("Opening train, test, and validation datasets...")
+                cache = "" if dpg.get_value("cache_windows_checkbox") else None
+                data_paths = (("train", self.dataset_handler.train_dataset_path),
+                              ("val", self.dataset_handler.validation_dataset_path),
+                              ("test", self.dataset_handler.test_dataset_path))
+                try:
+                    # Label the three datasets with the same class order
+                    class_names = get_shared_class_names([data_path for _, data_path in data_paths])
+                    sources = [(split, FileWindowSource(data_path, cache=cache, class_names=class_names)) for split, data_path in data_paths]
+                except (ValueError, OSError) as e:
+                    print(f"Error: {e}")
+                    return
+                self.dataset_handler.class_names = class_names
+                for split, source in sources:
+                    setattr(self.dataset_handler, f"{split}_images", source)
+                    setattr(self.dataset_handler, f"{split}_labels", source.labels)
+            else:
+                # Load train, test, and validation datasets
+                print("Loading train, test, and validation datasets...")
+                self.dataset_handler.load_train_test_val_directories()
+
+            # Match the model input to the stored window layout (grid or compact)
+            train_images = self.dataset_handler.train_images
+            window_shape = train_images.window_shape if isinstance(train_images, (SlidingWindowSource, FileWindowSource)) else train_images.shape[1:]
+            self.model_handler.match_window_shape(window_shape, num_labels=len(self.dataset_handler.class_names or set(self.dataset_handler.train_labels.tolist())),
+                                                  model_name=dpg.get_value("model_architecture_combo"))
 
             # Get the class weights (optional)
             print("Getting class weights...")
             class_weight_dict = self.model_handler.get_class_weights(self.dataset_handler.train_labels)
 
-            # Train the model
-            print("Training model...")
-            self.model_handler.train_model(self.dataset_handler.train_images,
-                                           self.dataset_handler.train_labels,
-                                           self.dataset_handler.val_images,
-                                           self.dataset_handler.val_labels,
-                                           epochs=10,
-                                           batch_size=32,
-                                           class_weight_dict=class_weight_dict
-                                           )
+            # Compile for the chosen batch size, scaling the learning rate to it if selected
+            batch_size = dpg.get_value("batch_size_input")
+            learning_rate = scale_learning_rate(batch_size) if dpg.get_value("scale_learning_rate_checkbox") else BASE_LEARNING_RATE
+            self.model_handler.compile_model(learning_rate, jit_compile=dpg.get_value("xla_checkbox"))
+
+            # Checkpoint the run into a new run directory, or continue the last run of the architecture
+            run_dir = None
+            resume = False
+            if dpg.get_value("checkpoint_checkbox"):
+                if dpg.get_value("resume_checkbox"):
+                    run_dir = self.model_handler.find_last_run()
+                    if run_dir is None:
+                        print(f"No {self.model_handler.model_name} run to resume, starting a new one")
+                resume = run_dir is not None
+                run_dir = run_dir or self.model_handler.create_run_dir()
+                print(f"Checkpointing into {run_dir}")
+
+            # Train the model, logging the throughput of every epoch
+            print(f"Training model (batch size {batch_size}, learning rate {learning_rate:g}, XLA {self.model_handler.jit_compile})...")
+            throughput_logger = ThroughputLogger(batch_size, num_examples=len(self.dataset_handler.train_labels))
+            history = self.model_handler.train_model(self.dataset_handler.train_images,
+                                                     self.dataset_handler.train_labels,
+                                                     self.dataset_handler.val_images,
+                                                     self.dataset_handler.val_labels,
+                                                     epochs=dpg.get_value("epochs_input"),
+                                                     batch_size=batch_size,
+                                                     class_weight_dict=class_weight_dict,
+                                                     callbacks=[throughput_logger],
+                                                     run_dir=run_dir,
+                                                     resume=resume,
+                                                     patience=dpg.get_value("patience_input")
+                                                     )
+            summary = throughput_logger.summary()
+            if summary:
+                print(f"Training throughput: {summary['examples_per_second']:.0f} examples/s, step {summary['step_time_ms']:.1f} ms")
+            # Report the validation accuracy of the epoch whose weights the model ends with
+            val_accuracies = history.history.get('val_accuracy', [])
+            epoch = self.model_handler.checkpoint.best_epoch.numpy() - 1 if self.model_handler.checkpoint is not None else None
+            val_accuracy = val_accuracies[history.epoch.index(epoch)] if epoch in history.epoch else (val_accuracies or [None])[-1]
+            self.model_handler.describe_model(val_accuracy=val_accuracy)
             
             # Save the model
             self.model_handler.save_model()
@@ -416,7 +677,92 @@ class GUI:
             self.model_handler.test_model(self.dataset_handler.test_images, self.dataset_handler.test_labels)
             
 
+        def show_prediction(prediction: dict) -> None:
+            # Publish a live prediction to the Output window
+            probabilities = ", ".join(f"{p:.2f}" for p in prediction['probabilities'])
+            dpg.set_value("prediction_text", f"Prediction: class {prediction['label']} ({probabilities})")
+            dpg.set_value("latency_text", f"Latency: {prediction['latency'] * 1e3:.1f} ms "
+                                          f"(inference {prediction['inference_time'] * 1e3:.1f} ms)")
+
+        def show_prediction_error(error: Exception, stopped: bool) -> None:
+            # Report a failed live prediction; the board keeps streaming until Test is pressed again
+            print(f"Live prediction failed: {error!r}")
+            if stopped:
+                print("Live inference stopped after repeated failures. Press Test again to release the headset.")
+                dpg.set_value("prediction_text", "Prediction: stopped after repeated failures")
+
+        def toggle_live_inference() -> None:
+            # Stop the running live inference
+            if self.live_predictor is not None:
+                self.stop_live_inference()
+                return
+
+            # Connect to the BCI headset if available
+            dc = self.create_data_collector()
+            if not dc.is_connected():
+                print("BCI headset not found. Please check the connection.")
+                return
+            try:
+                dc.start_streaming()
+            except:
+                print("Failed to start streaming. Please check the headset connection.")
+                return
+            dc.start_acquisition(poll_rate=100.0, buffer_seconds=10.0, record=False)
+
+            # Build the selected inference backend, calibrating int8 quantization on a slice of the training windows
+            backend, _, quantization = dpg.get_value("inference_backend_combo").lower().partition(" ")
+            calibration_data = None
+            train_images = self.dataset_handler.train_images
+            if quantization == "int8" and train_images is not None:
+                calibration_indices = np.random.default_rng(0).permutation(len(train_images))[:200]
+                if isinstance(train_images, (SlidingWindowSource, FileWindowSource)):
+                    calibration_data = train_images.get_batch(calibration_indices)[0]
+                else:
+                    calibration_data = np.asarray(train_images[np.sort(calibration_indices)])
+            try:
+                if dpg.get_value("prediction_server_checkbox"):
+                    # Share one model between GUI instances through the local prediction server, starting it if needed
+                    try:
+                        inference_backend = PredictionClient()
+                    except ConnectionError:
+                        print("Starting the prediction server...")
+                        self.start_prediction_server(backend, quantization or None, calibration_data)
+                        inference_backend = PredictionClient()
+                    # A server started by another GUI may serve a model the windows of this one do not fit
+                    if tuple(inference_backend.input_shape[1:]) != tuple(self.model_handler.model.input_shape[1:]):
+                        inference_backend.close()
+                        raise ValueError(f"the running prediction server serves a model with input shape {inference_backend.input_shape[1:]}, "
+                                         f"not {self.model_handler.model.input_shape[1:]}")
+                else:
+                    inference_backend = self.model_handler.set_inference_backend(backend, quantization or None, calibration_data)
+            except Exception as e:
+                # Stop the board and the server whatever failed, e.g. a model that cannot be converted to TFLite
+                print(f"Error: {e}")
+                dc.stop_acquisition()
+                dc.stop_streaming()
+                self.stop_prediction_server()
+                return
+
+            # Predict on the latest window every stride samples
+            self.live_collector = dc
+            self.live_predictor = LivePredictor(inference_backend,
+                                                dc.ring_buffer,
+                                                channels=dc.eeg_channels[:CYTON_MONTAGE.num_channels],
+                                                timestamp_channel=dc.timestamp_channel,
+                                                window_size=inference_backend.input_shape[1],
+                                                stride=dpg.get_value("live_stride_input"),
+                                                montage=CYTON_MONTAGE,
+                                                on_prediction=show_prediction,
+                                                on_error=show_prediction_error)
+            self.live_predictor.start()
+            self.live_plot_updater = self.create_plot_updater(dc)
+            self.live_plot_updater.start()
+            print("Live inference started. Press Test again to stop.")
+
         def test_model_cb():
+            if dpg.get_value("test_option_radio_button") == "Live":
+                toggle_live_inference()
+                return
             self.model_handler.test_model(self.dataset_handler.test_images, self.dataset_handler.test_labels)
 
         def test_option_cb():
@@ -438,9 +784,24 @@ class GUI:
                         no_background=False):
             dpg.add_button(label="Load", callback=lambda: dpg.show_item("model_file_dialog_tag"))
             dpg.add_button(label="Model Summary", callback=summarize_model_cb)
+            dpg.add_combo(list(MODELS), label="Architecture", default_value="oneill", tag="model_architecture_combo")
             dpg.add_button(label="Train", callback=train_model_cb)
+            dpg.add_checkbox(label="Lazy windows from raw dataset", default_value=False, tag="lazy_windows_checkbox")
+            dpg.add_checkbox(label="Stream datasets from disk", default_value=False, tag="stream_datasets_checkbox")
+            dpg.add_checkbox(label="Cache streamed windows in memory", default_value=False, tag="cache_windows_checkbox")
+            dpg.add_input_int(label="Epochs", default_value=10, min_value=1, min_clamped=True, tag="epochs_input")
+            dpg.add_input_int(label="Batch size", default_value=32, min_value=1, min_clamped=True, tag="batch_size_input")
+            dpg.add_checkbox(label="Scale learning rate to batch size", default_value=True, tag="scale_learning_rate_checkbox")
+            dpg.add_checkbox(label="XLA compilation", default_value=False, tag="xla_checkbox")
+            dpg.add_checkbox(label="Checkpoint training runs", default_value=True, tag="checkpoint_checkbox")
+            dpg.add_checkbox(label="Resume last run", default_value=False, tag="resume_checkbox")
+            dpg.add_input_int(label="Early stopping patience (0: off)", default_value=5, min_value=0, min_clamped=True, tag="patience_input")
             dpg.add_button(label="Test", callback=test_model_cb)
             dpg.add_radio_button(("Live", "From Dataset"), callback=test_option_cb, horizontal=True, default_value=0, tag="test_option_radio_button")
+            dpg.add_input_int(label="Live stride (samples)", default_value=16, min_value=1, min_clamped=True, tag="live_stride_input")
+            dpg.add_combo(("Keras", "Graph", "TFLite", "TFLite float16", "TFLite int8"), label="Inference backend", default_value="Graph",
+                          tag="inference_backend_combo")
+            dpg.add_checkbox(label="Use prediction server", default_value=False, tag="prediction_server_checkbox")
             
     def add_output_container(self):
         '''
@@ -456,7 +817,12 @@ class GUI:
                         no_background=False,
                         tag="output_window"):
             dpg.add_text("Output goes here", label="output_text")
+            dpg.add_text("Prediction: -", tag="prediction_text")
+            dpg.add_text("Latency: -", tag="latency_text")
             
+            # Width of the channel plots in pixels (the plot updater decimates the signals to it)
+            self.plot_width = self.viewport_width//3-40
+
             for i in range(1, 9, 2):
                 with dpg.group(horizontal=True):
                     dpg.add_text((f"Channel {i}"), tag=f"channel_{i}_text")
@@ -464,84 +830,16 @@ class GUI:
                 with dpg.group(horizontal=True):
                     dpg.add_simple_plot(default_value=[0,0],
                                         tag=f"channel_{i}_plot",
-                                        width=self.viewport_width//3-40,
+                                        width=self.plot_width,
                                         height=self.viewport_height//12,
                                         )
                     
                     dpg.add_simple_plot(default_value=[0,0],
                                         tag=f"channel_{i+1}_plot",
-                                        width=self.viewport_width//3-40,
+                                        width=self.plot_width,
                                         height=self.viewport_height//12,
                                         )
 
-    def add_experiment_container(self, args):
-        '''
-        Add the experiment container to the GUI.
-        '''
-        def cue_button_cb(sender, app_data):
-            # Disable the button to avoid re-triggering the callback
-            dpg.configure_item(sender, enabled=False)
-
-            # Initialize the dataframe that holds the current class and the timestamp
-            class_df = pd.DataFrame(columns=["Class", "Timestamp"])
-
-            # Store the timestamp after the instructions are done
-            # This will come handy later to remove any readings that were taken before the cues
-            class_df.loc[len(class_df.index)] = ["Instructions", time.time()]
-
-            print("Starting data collection...")
-            print(args)
-            classes = args.classes
-            if not classes:
-                classes = ["Move", "Relax"]
-            else:
-                classes = classes[0]
-            print("classes @ cue_button_cb: ", classes)
-
-            start_time = time.time()
-            for class_ in classes:
-                # Add the class and the timestamp in unix time to the dataframe
-                class_df.loc[len(class_df.index)] = [class_, time.time()]
-                print(f"Perform action for class {class_}")
-                # Set cue button text to class name
-                dpg.set_item_label(sender, class_)
-                # Wait for cue period
-                start_time = time.time()
-                current_time = time.time()
-                while current_time - start_time < args.cue_period:
-                    current_time = time.time()
-
-            # Save the dataframe to a csv file
-            class_df.to_csv(f"class_timestamps.csv", index=False)
-            # Finish the program
-            sys.exit()
-
-
-        with dpg.window(label="Experiment",
-                        width=self.viewport_width,
-                        height=self.viewport_height,
-                        no_close=True,
-                        no_move=True,
-                        no_background=True,
-                        no_scrollbar=True,
-                        no_title_bar=True,
-                        autosize=True,
-                        tag="experiment_window",
-                        user_data=args
-                        ):
-            instructions = '''
-                                Welcome!
-
-In this experiment, you will be asked to perform different actions at specific cues.
-
-                          ... bla bla bla ...'''
-
-            dpg.add_button(label=instructions,
-                           width=self.viewport_width-20,
-                           height=self.viewport_height-20,
-                           tag="cue_button",
-                           callback=cue_button_cb)
-
     def run(self):
         '''
         Run the GUI of the application.
@@ -549,27 +847,10 @@ In this experiment, you will be asked to perform different actions at specific c
         dpg.setup_dearpygui()
         dpg.show_viewport()
         dpg.start_dearpygui()
-        dpg.destroy_context()
 
-    def run_subject_gui(self, queue, class_list=None, cue_period=None):
-        '''
-        Run the GUI of the application for the subject.
-        '''
-        # Set the class list and cue period to default values if not provided
-        if not class_list:
-            class_list = ["Move", "Relax"]
-        if not cue_period:
-            cue_period = 5.0
-        
-        # Set the command to run the script
-        script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "subject_gui.py")
-        formatted_class_list = " ".join(class_list)
-        flags = '-u'
-        command = f"python {flags} {script_path} --classes {formatted_class_list} --cue-period={cue_period}"
-        
-        # Run the script
-        subprocess.run(command, shell=True)
+        # Stop the live inference and its prediction server before the plots it updates are destroyed
+        self.stop_live_inference()
+        dpg.destroy_context()
 
-        # Signal that the experiment has stopped
-        queue.put(True)  
-    
\ No newline at end of file
+        # Close the experiment display with the application
+        self.experiment_display.close()
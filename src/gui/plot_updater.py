@@ -0,0 +1,185 @@
+import threading
+import time
+from typing import Callable, Sequence
+
+import numpy as np
+
+from data.ring_buffer import RingBuffer
+
+
+def decimate_min_max(values: np.ndarray, bucket_size: int) -> np.ndarray:
+    '''
+    Reduce each column of a signal to the minimum and maximum of consecutive buckets.
+
+    Plotting the minimum and maximum of every pixel column draws the same envelope as plotting every sample,
+    so spikes and artifacts stay visible however many samples fall on one pixel.
+
+    args:
+        values (np.ndarray): The signal with shape (num_buckets * bucket_size, num_columns).
+        bucket_size (int): The number of samples per bucket.
+
+    returns:
+        np.ndarray: The minimum and maximum of each bucket, interleaved, with shape (2 * num_buckets, num_columns).
+    '''
+    buckets = values.reshape(-1, bucket_size, values.shape[1])
+    points = np.empty((2 * len(buckets), values.shape[1]), dtype=values.dtype)
+    np.min(buckets, axis=1, out=points[0::2])
+    np.max(buckets, axis=1, out=points[1::2])
+    return points
+
+
+class PlotUpdater():
+    '''
+    A class to refresh the channel plots at a fixed frame rate from the acquisition ring buffer.
+
+    The updater runs in its own thread and only reads the ring buffer, so plotting never delays acquisition.
+    Each frame folds the samples that arrived since the previous frame into the minimum and maximum of one bucket
+    of samples per pixel, kept in a small ring buffer of plot points, so the work per frame does not depend on
+    the time span shown and the plots receive at most 2 * width points.
+    '''
+    def __init__(self, ring_buffer: RingBuffer, channels: Sequence[int], plot_tags: Sequence[str], set_value: Callable,
+                 num_samples: int=512, width: int=256, frame_rate: float=30.0) -> None:
+        '''
+        Constructor for the PlotUpdater class.
+
+        args:
+            ring_buffer (RingBuffer): The ring buffer filled by the acquisition thread.
+            channels (Sequence[int]): The columns of the plotted channels in the ring buffer.
+            plot_tags (Sequence[str]): The tag of the plot of each channel.
+            set_value (Callable): Sets the values of a plot from its tag, e.g. dearpygui.dearpygui.set_value.
+            num_samples (int): The number of latest samples shown.
+            width (int): The width of the plots in pixels.
+            frame_rate (float): The number of refreshes per second.
+
+        raises:
+            ValueError: If the number of channels and plots differ.
+        '''
+        if len(channels) != len(plot_tags):
+            raise ValueError(f"Got {len(channels)} channels for {len(plot_tags)} plots.")
+        self.ring_buffer = ring_buffer
+        self.channels = list(channels)
+        self.plot_tags = list(plot_tags)
+        self.set_value = set_value
+        self.frame_rate = frame_rate
+
+        # One bucket of samples per pixel, each plotted as its minimum and maximum
+        self.bucket_size = max(1, int(np.ceil(num_samples / width)))
+        self.num_buckets = int(np.ceil(num_samples / self.bucket_size))
+        self.points = RingBuffer(2 * self.num_buckets, len(self.channels))
+
+        # Minimum and maximum of the bucket being filled, and buffer of the plotted values (float32, as plotted)
+        self.partial_min = np.empty(len(self.channels))
+        self.partial_max = np.empty(len(self.channels))
+        self.partial_count = 0
+        self.plot_buffer = np.empty((len(self.channels), 2 * self.num_buckets), dtype=np.float32)
+        self.count = None
+
+        self.num_frames = 0
+        self.num_skipped = 0
+        self.frame_times = []
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self) -> None:
+        '''
+        Start refreshing the plots.
+        '''
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="plot_updater", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop refreshing the plots.
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        '''
+        Refresh the plots at the frame rate until stop is called.
+        '''
+        period = 1.0 / self.frame_rate
+        next_frame = time.monotonic()
+        while not self.stop_event.is_set():
+            start_time = time.perf_counter()
+            self.update()
+            self.frame_times.append(time.perf_counter() - start_time)
+            if len(self.frame_times) > 1000:
+                del self.frame_times[:500]
+
+            # Wait for the next frame, skipping the frames that were missed
+            next_frame += period
+            now = time.monotonic()
+            if next_frame < now:
+                self.num_skipped += int((now - next_frame) / period) + 1
+                next_frame = now
+            self.stop_event.wait(next_frame - now)
+
+    def _add_samples(self, values: np.ndarray) -> None:
+        '''
+        Fold new samples into the buckets.
+
+        args:
+            values (np.ndarray): The plotted channels of the new samples with shape (num_samples, num_channels).
+        '''
+        # Complete the bucket being filled
+        if self.partial_count:
+            num_missing = min(self.bucket_size - self.partial_count, len(values))
+            np.minimum(self.partial_min, values[:num_missing].min(axis=0), out=self.partial_min)
+            np.maximum(self.partial_max, values[:num_missing].max(axis=0), out=self.partial_max)
+            self.partial_count += num_missing
+            values = values[num_missing:]
+            if self.partial_count < self.bucket_size:
+                return
+            self.points.write(np.stack((self.partial_min, self.partial_max)))
+            self.partial_count = 0
+
+        # Whole buckets, then start a new bucket with the rest
+        num_whole = len(values) // self.bucket_size * self.bucket_size
+        if num_whole:
+            self.points.write(decimate_min_max(values[:num_whole], self.bucket_size))
+        if num_whole < len(values):
+            values[num_whole:].min(axis=0, out=self.partial_min)
+            values[num_whole:].max(axis=0, out=self.partial_max)
+            self.partial_count = len(values) - num_whole
+
+    def update(self) -> None:
+        '''
+        Refresh the plots once with the samples that arrived since the previous refresh.
+        '''
+        if self.count is None:
+            # Start from the samples already shown by the time span
+            self.count = max(0, self.ring_buffer.total_written - self.bucket_size * self.num_buckets)
+        samples, self.count, _ = self.ring_buffer.read_since(self.count)
+        if len(samples):
+            self._add_samples(samples[:, self.channels])
+
+        # The completed buckets, followed by the bucket being filled
+        num_points = 2 * self.num_buckets - (2 if self.partial_count else 0)
+        points = self.points.get_latest(num_points)
+        plot_values = self.plot_buffer[:, :len(points) + (2 if self.partial_count else 0)]
+        if len(plot_values[0]) == 0:
+            return
+        plot_values[:, :len(points)] = points.T
+        if self.partial_count:
+            plot_values[:, -2] = self.partial_min
+            plot_values[:, -1] = self.partial_max
+        for tag, values in zip(self.plot_tags, plot_values):
+            self.set_value(tag, values)
+        self.num_frames += 1
+
+    def report(self) -> str:
+        '''
+        Get a summary of the refreshes.
+
+        returns:
+            str: The number of frames, skipped frames and the median and maximum frame time.
+        '''
+        if not self.frame_times:
+            return "0 frames"
+        frame_times = np.asarray(self.frame_times) * 1e3
+        return (f"{self.num_frames} frames, {self.num_skipped} skipped, "
+                f"frame time median {np.median(frame_times):.2f} ms, max {frame_times.max():.2f} ms")
@@ -0,0 +1,285 @@
+'''
+Benchmarks for the models.
+
+Run from the src folder, e.g.:
+    python -m models.benchmark backends --weights ../models/model.hdf5
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+from data.benchmark import make_synthetic_dataset
+from data.dataset_handler import DatasetHandler
+from data.window_source import FileWindowSource, SlidingWindowSource
+from models.callbacks import ThroughputLogger
+from models.inference import compare_backends, measure_latency
+from models.model import ModelHandler, configure_threads, scale_learning_rate
+from models.model_zoo import MODELS, format_model_costs, get_model_costs
+from models.prediction_server import PredictionClient, PredictionServer, get_address
+
+
+def benchmark_backends(weights_path: str=None, num_samples: int=20000, num_calibration: int=200, batch_size: int=32, num_runs: int=200,
+                       train_epochs: int=0) -> None:
+    '''
+    Compare the accuracy and the single-sample and batched latency of the inference backends.
+
+    args:
+        weights_path (str): Weights of a trained O'Neill model. Without weights the model is trained for train_epochs on synthetic data.
+        num_samples (int): The number of samples of the synthetic evaluation recording.
+        num_calibration (int): The number of windows used to calibrate int8 quantization.
+        batch_size (int): The batch size of the batched latency.
+        num_runs (int): The number of timed calls per latency measurement.
+        train_epochs (int): The number of epochs to train the model on synthetic data when no weights are given.
+    '''
+    model_handler = ModelHandler(None)
+    if weights_path:
+        model_handler.load_h5_or_hdf5(weights_path)
+
+    # Windows of a synthetic recording, split in time into calibration/training and evaluation data
+    source = SlidingWindowSource.from_dataframe(make_synthetic_dataset(num_samples), window_size=64, overlap=0.25, normalize=True)
+    train_source, eval_source = source.split((0.5, 0.5))
+    train_images, train_labels = train_source.get_batch(np.arange(len(train_source)))
+    eval_images, eval_labels = eval_source.get_batch(np.arange(len(eval_source)))
+    train_images, eval_images = train_images[..., np.newaxis], eval_images[..., np.newaxis]
+    if not weights_path and train_epochs:
+        model_handler.model.fit(train_images, train_labels, epochs=train_epochs, batch_size=32, verbose=0)
+
+    calibration_data = train_images[np.random.default_rng(0).permutation(len(train_images))[:num_calibration]]
+    reference = model_handler.set_inference_backend("keras")
+    configurations = [("keras", None), ("graph", None), ("tflite", None), ("tflite", "float16"), ("tflite", "int8")]
+
+    print(f"Evaluation windows: {len(eval_images)}, calibration windows: {len(calibration_data)}")
+    print(f"{'backend':15s} {'acc':>6s} {'dacc':>7s} {'agree':>6s} {'max dp':>8s} {'1x p50':>8s} {'1x p99':>8s} {f'{batch_size}x p50':>9s} {'win/s':>8s}")
+    for backend_name, quantization in configurations:
+        try:
+            backend = reference if backend_name == "keras" else model_handler.set_inference_backend(backend_name, quantization, calibration_data)
+        except ValueError as e:
+            # e.g. int8 quantization of a model with operations that have no TFLite builtin kernel
+            print(f"{backend_name + ('-' + quantization if quantization else ''):15s} skipped: {e}")
+            continue
+        delta = compare_backends(reference, backend, eval_images, eval_labels, batch_size)
+        single = measure_latency(backend, eval_images[:1], num_runs)
+        batched = measure_latency(backend, eval_images[:batch_size], max(10, num_runs // 10))
+        print(f"{backend.name:15s} {delta['accuracy']:6.3f} {delta['accuracy_delta']:+7.3f} {delta['label_agreement']:6.3f} "
+              f"{delta['max_probability_delta']:8.4f} {single['p50']:7.2f}ms {single['p99']:7.2f}ms {batched['p50']:8.2f}ms "
+              f"{batched['windows_per_second']:8.0f}")
+
+
+def benchmark_server(num_clients: int=4, num_requests: int=200, max_waits: tuple=(0.0, 0.002, 0.005, 0.01), backend: str="graph") -> None:
+    '''
+    Measure the throughput and request latency of the prediction server for several batching waits.
+
+    args:
+        num_clients (int): The number of concurrent clients, each sending single windows.
+        num_requests (int): The number of requests per client.
+        max_waits (tuple): The maximum batching waits in seconds to compare.
+        backend (str): The inference backend of the server.
+    '''
+    model_handler = ModelHandler(None)
+    inference_backend = model_handler.set_inference_backend(backend)
+    window = np.random.default_rng(0).standard_normal((1,) + tuple(model_handler.model.input_shape[1:])).astype(np.float32)
+
+    for max_wait in max_waits:
+        address = get_address(f"smmr_benchmark_{os.getpid()}")
+        server = PredictionServer(inference_backend, address, max_batch_size=32, max_wait=max_wait)
+        server.start()
+
+        def run_client(latencies):
+            client = PredictionClient(address)
+            for _ in range(num_requests):
+                start_time = time.perf_counter()
+                client.predict(window)
+                latencies.append(time.perf_counter() - start_time)
+            client.close()
+
+        latencies = []
+        threads = [threading.Thread(target=run_client, args=(latencies,)) for _ in range(num_clients)]
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start_time
+        stats = server.get_stats()
+        server.stop()
+
+        p50, p99 = np.percentile(np.array(latencies) * 1e3, (50, 99))
+        print(f"max wait {max_wait * 1e3:4.1f} ms: {len(latencies) / elapsed:7.0f} windows/s, mean batch {stats['mean_batch_size']:5.1f}, "
+              f"max queue depth {stats['max_queue_depth']:3d}, client latency p50 {p50:6.2f} ms p99 {p99:6.2f} ms")
+
+
+class StepTimer(tf.keras.callbacks.Callback):
+    '''
+    A callback to record the end time of every training step.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.epoch_steps = []
+
+    def on_epoch_begin(self, epoch, logs=None) -> None:
+        self.epoch_steps.append([time.perf_counter()])
+
+    def on_train_batch_end(self, batch, logs=None) -> None:
+        self.epoch_steps[-1].append(time.perf_counter())
+
+
+def benchmark_pipeline(num_samples: int=100000, batch_size: int=32, epochs: int=2) -> None:
+    '''
+    Compare training on in-memory arrays with training from the tf.data pipeline that streams the windows from disk.
+
+    Reports the time until the first training step (including loading), the training steps per second of the last epoch
+    and the steps per second of the input pipeline alone (an upper bound on the training speed it allows).
+
+    args:
+        num_samples (int): The number of samples of the synthetic recording.
+        batch_size (int): The batch size.
+        epochs (int): The number of epochs; the first one includes tracing and filling the caches.
+    '''
+    handler = DatasetHandler()
+    work_dir = tempfile.mkdtemp(prefix="smmr_benchmark_")
+    try:
+        tiff_dir = handler.preprocess_oneill(make_synthetic_dataset(num_samples), 64, 0.25, os.path.join(work_dir, "tiff"))
+        packed_path = handler.convert_tiff_to_packed(tiff_dir, os.path.join(work_dir, "dataset.smmr"))
+        configurations = [
+            ("arrays from TIFF", lambda: handler.load_tiff_data(tiff_dir)),
+            ("arrays from packed", lambda: tuple(np.asarray(data) for data in handler.load_packed_data(packed_path))),
+            ("stream TIFF", lambda: (FileWindowSource(tiff_dir), None)),
+            ("stream TIFF, memory cache", lambda: (FileWindowSource(tiff_dir, cache=""), None)),
+            ("stream TIFF, file cache", lambda: (FileWindowSource(tiff_dir, cache=os.path.join(work_dir, "cache")), None)),
+            ("stream packed", lambda: (FileWindowSource(packed_path), None)),
+        ]
+
+        print(f"{'input':27s} {'first step':>10s} {'train steps/s':>14s} {'input steps/s':>14s}")
+        for name, load in configurations:
+            model_handler = ModelHandler(None)
+            timer = StepTimer()
+            start_time = time.perf_counter()
+            images, labels = load()
+            dataset = model_handler.as_tf_dataset(images, batch_size, shuffle=True)
+            if dataset is None:
+                model_handler.model.fit(images, labels, epochs=epochs, batch_size=batch_size, callbacks=[timer], verbose=0)
+            else:
+                model_handler.model.fit(dataset, epochs=epochs, callbacks=[timer], verbose=0)
+            first_step = timer.epoch_steps[0][1] - start_time
+            last_epoch = timer.epoch_steps[-1]
+            train_rate = (len(last_epoch) - 1) / (last_epoch[-1] - last_epoch[0])
+
+            # Iterate the (warm) input pipeline alone
+            input_rate = float('nan')
+            if dataset is not None:
+                start_time = time.perf_counter()
+                num_steps = sum(1 for _ in dataset)
+                input_rate = num_steps / (time.perf_counter() - start_time)
+            print(f"{name:27s} {first_step:9.2f}s {train_rate:14.1f} {input_rate:14.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_training(num_samples: int=100000, batch_sizes: tuple=(32, 128, 512), epochs: int=3) -> None:
+    '''
+    Compare the training throughput of the O'Neill model for several batch sizes, with and without XLA compilation.
+
+    The learning rate is scaled linearly with the batch size. The thread pools are set once for the whole run
+    (see the --intra-op-threads and --inter-op-threads options).
+
+    args:
+        num_samples (int): The number of samples of the synthetic recording.
+        batch_sizes (tuple): The batch sizes to compare.
+        epochs (int): The number of epochs per configuration; the first one includes tracing and compilation.
+    '''
+    source = SlidingWindowSource.from_dataframe(make_synthetic_dataset(num_samples), window_size=64, overlap=0.25, normalize=True)
+    images, labels = source.get_batch(np.arange(len(source)))
+    print(f"Windows: {len(images)}, intra-op threads: {tf.config.threading.get_intra_op_parallelism_threads() or 'default'}, "
+          f"inter-op threads: {tf.config.threading.get_inter_op_parallelism_threads() or 'default'}")
+
+    print(f"{'batch':>6s} {'xla':>5s} {'lr':>8s} {'examples/s':>11s} {'step ms':>8s} {'peak MiB':>9s} {'accuracy':>9s}")
+    for batch_size in batch_sizes:
+        for jit_compile in (False, True):
+            model_handler = ModelHandler(None)
+            model_handler.compile_model(scale_learning_rate(batch_size), jit_compile=jit_compile)
+            throughput_logger = ThroughputLogger(batch_size, num_examples=len(images), verbose=False)
+            history = model_handler.model.fit(images, labels, epochs=epochs, batch_size=batch_size, callbacks=[throughput_logger], verbose=0)
+            summary = throughput_logger.summary()
+            peak_memory = summary['peak_memory_mib'] or float('nan')
+            print(f"{batch_size:6d} {str(jit_compile):>5s} {model_handler.learning_rate:8.4f} {summary['examples_per_second']:11.0f} "
+                  f"{summary['step_time_ms']:8.1f} {peak_memory:9.0f} {history.history['accuracy'][-1]:9.3f}")
+
+
+def benchmark_zoo(num_samples: int=100000, epochs: int=5, compact: bool=False, num_runs: int=200) -> None:
+    '''
+    Compare the architectures of the model zoo: parameters, FLOPs per window, single-window CPU latency and validation accuracy.
+
+    args:
+        num_samples (int): The number of samples of the synthetic recording.
+        epochs (int): The number of training epochs of each model.
+        compact (bool): Whether to train on compact (window, channels) windows instead of spatial grids.
+        num_runs (int): The number of timed single-window predictions.
+    '''
+    source = SlidingWindowSource.from_dataframe(make_synthetic_dataset(num_samples), window_size=64, overlap=0.25, normalize=True, compact=compact)
+    train_source, val_source = source.split((0.8, 0.2))
+    train_images, train_labels = train_source.get_batch(np.arange(len(train_source)))
+    val_images, val_labels = val_source.get_batch(np.arange(len(val_source)))
+    print(f"Training windows: {len(train_images)}, validation windows: {len(val_images)}, window shape: {source.window_shape}")
+
+    for model_name in MODELS:
+        model_handler = ModelHandler(None)
+        model_handler.match_window_shape(source.window_shape, num_labels=len(source.class_names), model_name=model_name)
+        history = model_handler.model.fit(train_images, train_labels, epochs=epochs, batch_size=32,
+                                          validation_data=(val_images, val_labels), verbose=0)
+        costs = get_model_costs(model_handler.model, num_runs)
+        print(format_model_costs(model_name, costs, history.history['val_accuracy'][-1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the models.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    backends_parser = subparsers.add_parser("backends", help="Accuracy delta and latency of the inference backends.")
+    backends_parser.add_argument("--weights", type=str, default=None, help="Weights of a trained O'Neill model.")
+    backends_parser.add_argument("--samples", type=int, default=20000, help="Number of samples in the synthetic recording.")
+    backends_parser.add_argument("--calibration", type=int, default=200, help="Number of windows used to calibrate int8 quantization.")
+    backends_parser.add_argument("--batch-size", type=int, default=32, help="Batch size of the batched latency.")
+    backends_parser.add_argument("--runs", type=int, default=200, help="Number of timed calls per measurement.")
+    backends_parser.add_argument("--train-epochs", type=int, default=1, help="Epochs on synthetic data when no weights are given.")
+
+    server_parser = subparsers.add_parser("server", help="Throughput of the micro-batching prediction server.")
+    server_parser.add_argument("--clients", type=int, default=4, help="Number of concurrent clients.")
+    server_parser.add_argument("--requests", type=int, default=200, help="Number of requests per client.")
+    server_parser.add_argument("--backend", choices=("keras", "graph", "tflite"), default="graph", help="Inference backend of the server.")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Training steps/s from in-memory arrays and from the streaming tf.data pipeline.")
+    pipeline_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic recording.")
+    pipeline_parser.add_argument("--batch-size", type=int, default=32, help="Batch size.")
+    pipeline_parser.add_argument("--epochs", type=int, default=2, help="Number of epochs per configuration.")
+
+    training_parser = subparsers.add_parser("training", help="Training throughput for several batch sizes, with and without XLA.")
+    training_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic recording.")
+    training_parser.add_argument("--batch-sizes", type=int, nargs='+', default=[32, 128, 512], help="Batch sizes to compare.")
+    training_parser.add_argument("--epochs", type=int, default=3, help="Number of epochs per configuration.")
+    training_parser.add_argument("--intra-op-threads", type=int, default=0, help="Threads used inside one operation (0: one per core).")
+    training_parser.add_argument("--inter-op-threads", type=int, default=0, help="Operations run concurrently (0: TensorFlow default).")
+
+    zoo_parser = subparsers.add_parser("zoo", help="Parameters, FLOPs, latency and validation accuracy of every model architecture.")
+    zoo_parser.add_argument("--samples", type=int, default=100000, help="Number of samples in the synthetic recording.")
+    zoo_parser.add_argument("--epochs", type=int, default=5, help="Number of training epochs per model.")
+    zoo_parser.add_argument("--compact", action="store_true", help="Train on compact (window, channels) windows.")
+    zoo_parser.add_argument("--runs", type=int, default=200, help="Number of timed single-window predictions.")
+
+    args = parser.parse_args()
+    if args.benchmark == "backends":
+        benchmark_backends(args.weights, args.samples, args.calibration, args.batch_size, args.runs, args.train_epochs)
+    elif args.benchmark == "server":
+        benchmark_server(args.clients, args.requests, backend=args.backend)
+    elif args.benchmark == "training":
+        configure_threads(args.intra_op_threads, args.inter_op_threads)
+        benchmark_training(args.samples, tuple(args.batch_sizes), args.epochs)
+    elif args.benchmark == "zoo":
+        benchmark_zoo(args.samples, args.epochs, args.compact, args.runs)
+    elif args.benchmark == "pipeline":
+        benchmark_pipeline(args.samples, args.batch_size, args.epochs)
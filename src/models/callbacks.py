@@ -0,0 +1,252 @@
+import os
+import sys
+import glob
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+def get_peak_memory():
+    '''
+    Get the peak resident memory of the process
+
+    Returns:
+        peak_memory: float or None
+            The peak resident memory in MiB, or None where the platform does not report it
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_memory / 2**20 if sys.platform == 'darwin' else peak_memory / 2**10
+
+
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    '''
+    Log the training throughput of every epoch: examples per second, step time and peak memory
+
+    Only the training steps are timed, not the validation at the end of the epoch. The first epoch includes
+    tracing (and XLA compilation), so the later epochs show the steady-state throughput.
+    '''
+    def __init__(self, batch_size, num_examples=None, verbose=True)-> None:
+        '''
+        Args:
+            batch_size: int
+                Number of examples per step
+            num_examples: int
+                Number of training examples per epoch, to count the smaller last batch
+            verbose: bool
+                Whether to print a line per epoch
+        '''
+        super().__init__()
+        self.batch_size = batch_size
+        self.num_examples = num_examples
+        self.verbose = verbose
+        self.history = []
+
+    def on_epoch_begin(self, epoch, logs=None)-> None:
+        self.step_times = []
+        self.num_steps = 0
+        self.epoch_start = None
+        self.epoch_end = None
+
+    def on_train_batch_begin(self, batch, logs=None)-> None:
+        self.batch_start = time.perf_counter()
+        if self.epoch_start is None:
+            self.epoch_start = self.batch_start
+
+    def on_train_batch_end(self, batch, logs=None)-> None:
+        self.epoch_end = time.perf_counter()
+        # With steps_per_execution > 1 the callback runs once for several steps, and batch is the index of the last one
+        num_steps = max(1, batch + 1 - self.num_steps)
+        self.step_times.append((self.epoch_end - self.batch_start) / num_steps)
+        self.num_steps = batch + 1
+
+    def on_epoch_end(self, epoch, logs=None)-> None:
+        if not self.step_times:
+            return
+        num_examples = self.num_steps * self.batch_size
+        if self.num_examples is not None:
+            num_examples = min(num_examples, self.num_examples)
+        train_time = self.epoch_end - self.epoch_start
+        step_times = np.asarray(self.step_times) * 1e3
+        stats = {'epoch': epoch + 1,
+                 'steps': self.num_steps,
+                 'examples_per_second': num_examples / train_time if train_time > 0 else float('nan'),
+                 'step_time_ms': train_time / self.num_steps * 1e3,
+                 'median_step_time_ms': float(np.median(step_times)),
+                 'peak_memory_mib': get_peak_memory()}
+        self.history.append(stats)
+        if self.verbose:
+            print(self.format(stats))
+
+    @staticmethod
+    def format(stats)-> str:
+        '''
+        Format the throughput of one epoch
+
+        Args:
+            stats: dict
+                An entry of the history
+
+        Returns:
+            line: str
+                The throughput as one line of text
+        '''
+        peak_memory = "n/a" if stats['peak_memory_mib'] is None else f"{stats['peak_memory_mib']:.0f} MiB"
+        return (f"Epoch {stats['epoch']}: {stats['examples_per_second']:.0f} examples/s, "
+                f"step {stats['step_time_ms']:.1f} ms (median {stats['median_step_time_ms']:.1f} ms), peak memory {peak_memory}")
+
+    def summary(self)-> dict:
+        '''
+        Get the steady-state throughput, over every epoch but the first when there are several
+
+        Returns:
+            summary: dict
+                Mean examples per second and step time, and the peak memory
+        '''
+        epochs = self.history[1:] or self.history
+        if not epochs:
+            return {}
+        return {'examples_per_second': float(np.mean([stats['examples_per_second'] for stats in epochs])),
+                'step_time_ms': float(np.mean([stats['step_time_ms'] for stats in epochs])),
+                'peak_memory_mib': self.history[-1]['peak_memory_mib']}
+
+
+class TrainingCheckpoint(tf.keras.callbacks.Callback):
+    '''
+    Checkpoint a training run so it can be resumed, keep the weights of its best epoch and stop it early
+
+    The run directory holds the periodic checkpoints (model, optimizer state and the early stopping state) in
+    checkpoints/ and the weights of the best epoch so far, named after the epoch and the monitored value, e.g.
+    eegnet_best_epoch012_val_loss0.4311.hdf5. Only the latest best file is kept, so it is the best artifact of the run.
+    '''
+    def __init__(self, run_dir, model_name="model", save_every=1, patience=None, monitor='val_loss', min_delta=0.0, max_to_keep=3,
+                 restore_best_weights=True)-> None:
+        '''
+        Args:
+            run_dir: str
+                Directory of the training run
+            model_name: str
+                Name of the architecture, the prefix of the best weights file
+            save_every: int
+                Number of epochs between checkpoints (a new best epoch is always checkpointed)
+            patience: int
+                Number of epochs without improvement before training stops, None or 0 to train every epoch
+            monitor: str
+                The metric that decides the best epoch; lower is better unless its name contains "acc"
+            min_delta: float
+                Minimum change of the metric that counts as an improvement
+            max_to_keep: int
+                Number of periodic checkpoints kept
+            restore_best_weights: bool
+                Whether to load the weights of the best epoch when training ends
+        '''
+        super().__init__()
+        self.run_dir = run_dir
+        self.model_name = model_name
+        self.save_every = max(1, int(save_every))
+        self.patience = patience or None
+        self.monitor = monitor
+        self.min_delta = abs(min_delta)
+        self.max_to_keep = max_to_keep
+        self.restore_best_weights = restore_best_weights
+        self.sign = -1.0 if "acc" in monitor else 1.0
+
+        # State saved in the checkpoints, so a resumed run continues early stopping where it was
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.best = tf.Variable(np.inf, dtype=tf.float64, trainable=False)
+        self.best_epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.wait = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+        self.best_path = None
+        self.checkpoint = None
+        self.manager = None
+        self.stopped_epoch = None
+
+    def setup(self, model, resume=False)-> int:
+        '''
+        Attach the checkpoints to a compiled model, restoring the latest one when resuming
+
+        Must be called before training, with the optimizer the model trains with.
+
+        Args:
+            model: tf.keras.Model
+                The compiled model
+            resume: bool
+                Whether to continue from the latest checkpoint of the run directory
+
+        Returns:
+            initial_epoch: int
+                The epoch to continue from (0 for a new run)
+        '''
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self.epoch, best=self.best,
+                                              best_epoch=self.best_epoch, wait=self.wait)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, os.path.join(self.run_dir, "checkpoints"), max_to_keep=self.max_to_keep)
+        if resume and self.manager.latest_checkpoint:
+            # The optimizer slots are restored when the first training step creates them
+            self.checkpoint.restore(self.manager.latest_checkpoint)
+            best_paths = sorted(glob.glob(os.path.join(self.run_dir, f"{self.model_name}_best_*.hdf5")), key=os.path.getmtime)
+            self.best_path = best_paths[-1] if best_paths else None
+            print(f"Resuming from {self.manager.latest_checkpoint} (epoch {int(self.epoch.numpy())})")
+        return int(self.epoch.numpy())
+
+    @property
+    def best_tag(self)-> str:
+        '''
+        Description of the best epoch used in file names, e.g. best_epoch012_val_loss0.4311
+        '''
+        return f"best_epoch{int(self.best_epoch.numpy()):03d}_{self.monitor}{self.sign * float(self.best.numpy()):.4f}"
+
+    def save(self)-> str:
+        '''
+        Write a checkpoint of the current epoch
+
+        Returns:
+            path: str
+                Path prefix of the checkpoint
+        '''
+        return self.manager.save(checkpoint_number=int(self.epoch.numpy()))
+
+    def on_epoch_end(self, epoch, logs=None)-> None:
+        self.epoch.assign(epoch + 1)
+        value = (logs or {}).get(self.monitor)
+        improved = False
+        if value is None:
+            print(f"Checkpoint: '{self.monitor}' is not logged, the best epoch and early stopping are skipped")
+        elif self.sign * value < float(self.best.numpy()) - self.min_delta:
+            improved = True
+            self.best.assign(self.sign * value)
+            self.best_epoch.assign(epoch + 1)
+            self.wait.assign(0)
+
+            # Replace the weights of the previous best epoch
+            previous_path = self.best_path
+            self.best_path = os.path.join(self.run_dir, f"{self.model_name}_{self.best_tag}.hdf5")
+            self.model.save_weights(self.best_path)
+            if previous_path and previous_path != self.best_path and os.path.exists(previous_path):
+                os.remove(previous_path)
+        else:
+            self.wait.assign_add(1)
+            if self.patience and int(self.wait.numpy()) >= self.patience:
+                self.model.stop_training = True
+                self.stopped_epoch = epoch + 1
+
+        if improved or (epoch + 1) % self.save_every == 0 or self.model.stop_training:
+            self.save()
+
+    def on_train_end(self, logs=None)-> None:
+        # Keep the last epoch resumable, whatever the checkpoint interval
+        latest = self.manager.latest_checkpoint
+        if int(self.epoch.numpy()) and (latest is None or not latest.endswith(f"-{int(self.epoch.numpy())}")):
+            self.save()
+        if self.stopped_epoch is not None:
+            print(f"Early stopping at epoch {self.stopped_epoch}: no improvement of {self.monitor} for {self.patience} epochs")
+        if self.best_path is not None:
+            if self.restore_best_weights:
+                self.model.load_weights(self.best_path)
+            print(f"Best epoch {int(self.best_epoch.numpy())}: {self.monitor} {self.sign * float(self.best.numpy()):.4f}, weights saved to {self.best_path}")
@@ -0,0 +1,274 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+# Available inference backends and TFLite quantization modes
+INFERENCE_BACKENDS = ("keras", "graph", "tflite")
+QUANTIZATIONS = (None, "float16", "int8")
+
+
+class KerasBackend:
+    '''
+    Run the model with eager Keras calls (the reference backend)
+    '''
+    def __init__(self, model)-> None:
+        '''
+        Constructor for the KerasBackend class
+
+        Args:
+            model: tf.keras.Model
+                The model
+        '''
+        self.model = model
+        self.input_shape = model.input_shape
+        self.name = "keras"
+
+    def __call__(self, inputs, training=False)-> np.ndarray:
+        return self.model(inputs, training=False).numpy()
+
+
+class GraphBackend:
+    '''
+    Run the model as a tf.function traced once for a fixed input signature
+    '''
+    def __init__(self, model)-> None:
+        '''
+        Constructor for the GraphBackend class
+
+        Args:
+            model: tf.keras.Model
+                The model
+        '''
+        self.model = model
+        self.input_shape = model.input_shape
+        self.name = "graph"
+
+        # Leave only the batch size free, so every call reuses the same graph
+        signature = [tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]), dtype=tf.float32)]
+        self.function = tf.function(lambda inputs: model(inputs, training=False), input_signature=signature)
+
+    def __call__(self, inputs, training=False)-> np.ndarray:
+        return self.function(tf.convert_to_tensor(inputs, dtype=tf.float32)).numpy()
+
+
+class TFLiteBackend:
+    '''
+    Run the model with the TFLite interpreter (XNNPACK delegate), optionally quantized
+
+    Operations without a TFLite builtin kernel (e.g. the MaxPool3D of the O'Neill network) run with the TensorFlow
+    kernels instead, which XNNPACK does not accelerate; see export_tflite.
+    '''
+    def __init__(self, model, quantization=None, calibration_data=None, num_threads=None)-> None:
+        '''
+        Constructor for the TFLiteBackend class
+
+        Args:
+            model: tf.keras.Model
+                The model
+            quantization: str
+                None, "float16" or "int8"
+            calibration_data: np.array
+                Representative inputs used to calibrate int8 quantization (e.g. a few hundred training windows)
+            num_threads: int
+                Number of interpreter threads (defaults to the number of CPUs)
+
+        Raises:
+            ValueError: If the quantization is not supported, int8 quantization has no calibration data or the model cannot be converted
+        '''
+        self.input_shape = model.input_shape
+        self.quantization = quantization
+        self.name = "tflite" if quantization is None else f"tflite-{quantization}"
+        self.model_content = export_tflite(model, quantization, calibration_data)
+
+        # The default op resolver applies the XNNPACK delegate to the supported operations
+        self.interpreter = tf.lite.Interpreter(model_content=self.model_content, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def __call__(self, inputs, training=False)-> np.ndarray:
+        inputs = np.asarray(inputs, dtype=np.float32)
+
+        # Resize the input tensor only when the batch size changes
+        if len(inputs) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, inputs.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(inputs)
+
+        self.interpreter.set_tensor(self.input_index, inputs)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def export_tflite(model, quantization=None, calibration_data=None, file_path=None)-> bytes:
+    '''
+    Convert a Keras model to a TFLite flatbuffer
+
+    Models with operations that have no TFLite builtin kernel (e.g. MaxPool3D, used by the O'Neill network) are converted
+    with those operations as TensorFlow ops, without quantization or with float16 weights. They run through the Flex
+    delegate without XNNPACK acceleration, so such a model gains little from TFLite. int8 quantization needs builtin
+    kernels for every operation.
+
+    Args:
+        model: tf.keras.Model
+            The model
+        quantization: str
+            None, "float16" (weights stored as float16) or "int8" (weights and activations, calibrated on calibration_data)
+        calibration_data: np.array
+            Representative inputs used to calibrate int8 quantization
+        file_path: str
+            If set, the flatbuffer is also written to this file
+
+    Returns:
+        model_content: bytes
+            The TFLite flatbuffer
+
+    Raises:
+        ValueError: If the quantization is not supported, int8 quantization has no calibration data or the model cannot be converted
+    '''
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Invalid quantization '{quantization}'")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calibration_data is None or len(calibration_data) == 0:
+            raise ValueError("int8 quantization needs calibration data")
+        calibration_data = np.asarray(calibration_data, dtype=np.float32).reshape((-1,) + tuple(model.input_shape[1:]))
+
+        def representative_dataset():
+            for window in calibration_data:
+                yield [window[np.newaxis]]
+
+        # Quantize weights and activations; the model keeps float32 inputs and outputs
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    try:
+        model_content = converter.convert()
+    except Exception as e:
+        if quantization == "int8":
+            raise ValueError(f"The model cannot be quantized to int8, it has operations without a TFLite builtin kernel: {e}") from e
+
+        # Keep the operations without a builtin kernel as TensorFlow ops
+        print("TFLite: the model has operations without a builtin kernel, they run as TensorFlow ops without XNNPACK")
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        try:
+            model_content = converter.convert()
+        except Exception as e:
+            raise ValueError(f"The model cannot be converted to TFLite: {e}") from e
+
+    if file_path is not None:
+        with open(file_path, 'wb') as file:
+            file.write(model_content)
+    return model_content
+
+
+def create_backend(model, backend="keras", quantization=None, calibration_data=None, num_threads=None):
+    '''
+    Create an inference backend for a model
+
+    Args:
+        model: tf.keras.Model
+            The model
+        backend: str
+            "keras", "graph" or "tflite"
+        quantization: str
+            None, "float16" or "int8" (TFLite only)
+        calibration_data: np.array
+            Representative inputs used to calibrate int8 quantization
+        num_threads: int
+            Number of TFLite interpreter threads
+
+    Returns:
+        backend: KerasBackend, GraphBackend or TFLiteBackend
+            A callable taking a float32 batch and returning the class probabilities
+
+    Raises:
+        ValueError: If the backend is not supported, quantization is requested for a non-TFLite backend or the model
+                    cannot be converted to TFLite
+    '''
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Invalid inference backend '{backend}'")
+    if quantization is not None and backend != "tflite":
+        raise ValueError(f"Quantization is only supported by the tflite backend, not '{backend}'")
+
+    if backend == "keras":
+        return KerasBackend(model)
+    if backend == "graph":
+        return GraphBackend(model)
+    return TFLiteBackend(model, quantization, calibration_data, num_threads)
+
+
+def measure_latency(backend, inputs, num_runs=200, num_warmup=10)-> dict:
+    '''
+    Measure the latency of a backend on a fixed batch
+
+    Args:
+        backend: callable
+            The inference backend
+        inputs: np.array
+            The batch (use a batch of one window for the single-sample latency)
+        num_runs: int
+            Number of timed calls
+        num_warmup: int
+            Number of untimed calls first (tracing, tensor allocation)
+
+    Returns:
+        latency: dict
+            p50, p95 and p99 latency per call in milliseconds, and windows per second
+    '''
+    inputs = np.asarray(inputs, dtype=np.float32)
+    for _ in range(num_warmup):
+        backend(inputs)
+
+    times = np.empty(num_runs)
+    for run in range(num_runs):
+        start_time = time.perf_counter()
+        backend(inputs)
+        times[run] = time.perf_counter() - start_time
+
+    p50, p95, p99 = np.percentile(times * 1e3, (50, 95, 99))
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'windows_per_second': len(inputs) / np.median(times)}
+
+
+def compare_backends(reference, candidate, inputs, labels=None, batch_size=32)-> dict:
+    '''
+    Check how much a backend changes the predictions of a reference backend
+
+    Args:
+        reference: callable
+            The reference backend (usually keras)
+        candidate: callable
+            The backend to check
+        inputs: np.array
+            The evaluation windows
+        labels: np.array
+            The labels of the windows, to compare accuracies
+        batch_size: int
+            Batch size of the evaluation
+
+    Returns:
+        delta: dict
+            The maximum absolute probability difference, the fraction of matching predicted labels and,
+            given labels, the accuracy of both backends and their difference
+    '''
+    inputs = np.asarray(inputs, dtype=np.float32)
+    reference_probabilities = np.concatenate([reference(inputs[start: start+batch_size]) for start in range(0, len(inputs), batch_size)])
+    candidate_probabilities = np.concatenate([candidate(inputs[start: start+batch_size]) for start in range(0, len(inputs), batch_size)])
+
+    reference_labels = np.argmax(reference_probabilities, axis=1)
+    candidate_labels = np.argmax(candidate_probabilities, axis=1)
+    delta = {'max_probability_delta': float(np.max(np.abs(reference_probabilities - candidate_probabilities))),
+             'label_agreement': float(np.mean(reference_labels == candidate_labels))}
+    if labels is not None:
+        labels = np.asarray(labels)
+        delta['reference_accuracy'] = float(np.mean(reference_labels == labels))
+        delta['accuracy'] = float(np.mean(candidate_labels == labels))
+        delta['accuracy_delta'] = delta['accuracy'] - delta['reference_accuracy']
+    return delta
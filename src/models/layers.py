@@ -0,0 +1,124 @@
+import numpy as np
+import tensorflow as tf
+
+from data.montage import Montage
+
+
+class GridExpansion(tf.keras.layers.Layer):
+    '''
+    A fixed layer that scatters compact (window, channels) readings into the spatial grid of a montage.
+
+    The layer has no weights, so it can be put in front of a grid model and loads the weights of that model unchanged.
+    '''
+    def __init__(self, grid_shape, rows, cols, **kwargs)-> None:
+        '''
+        Constructor for the GridExpansion class.
+
+        Args:
+            grid_shape: tuple
+                The (rows, columns) of the spatial grid
+            rows: list
+                The grid row of each channel
+            cols: list
+                The grid column of each channel
+        '''
+        super().__init__(trainable=False, **kwargs)
+        self.grid_shape = tuple(int(n) for n in grid_shape)
+        self.rows = [int(row) for row in rows]
+        self.cols = [int(col) for col in cols]
+
+        # Index of the channel shown at each grid position, num_channels (an appended zero channel) where there is no electrode
+        num_channels = len(self.rows)
+        gather_index = np.full(self.grid_shape[0] * self.grid_shape[1], num_channels, dtype=np.int32)
+        gather_index[np.array(self.rows) * self.grid_shape[1] + np.array(self.cols)] = np.arange(num_channels)
+        self.gather_index = tf.constant(gather_index)
+
+    @classmethod
+    def from_montage(cls, montage: Montage, **kwargs)-> 'GridExpansion':
+        '''
+        Create the layer of a montage
+
+        Args:
+            montage: Montage
+                The electrode layout of the headset
+
+        Returns:
+            layer: GridExpansion
+                The grid expansion layer
+        '''
+        return cls(montage.grid_shape, montage.rows.tolist(), montage.cols.tolist(), **kwargs)
+
+    def call(self, inputs):
+        '''
+        Expand (batch, window, channels) readings into (batch, window, grid rows, grid columns, 1) grids
+        '''
+        padded = tf.concat([inputs, tf.zeros_like(inputs[..., :1])], axis=-1)
+        grids = tf.gather(padded, self.gather_index, axis=-1)
+        return tf.reshape(grids, tf.concat([tf.shape(inputs)[:-1], [self.grid_shape[0], self.grid_shape[1], 1]], axis=0))
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape[:-1]).concatenate([self.grid_shape[0], self.grid_shape[1], 1])
+
+    def get_config(self)-> dict:
+        config = super().get_config()
+        config.update({'grid_shape': self.grid_shape, 'rows': self.rows, 'cols': self.cols})
+        config.pop('trainable', None)
+        return config
+
+
+class GridCompaction(tf.keras.layers.Layer):
+    '''
+    A fixed layer that gathers the electrode positions of a montage out of spatial grids, the inverse of GridExpansion.
+
+    It lets models that work on channel readings train on datasets stored on the spatial grid.
+    '''
+    def __init__(self, grid_shape, rows, cols, **kwargs)-> None:
+        '''
+        Constructor for the GridCompaction class.
+
+        Args:
+            grid_shape: tuple
+                The (rows, columns) of the spatial grid
+            rows: list
+                The grid row of each channel
+            cols: list
+                The grid column of each channel
+        '''
+        super().__init__(trainable=False, **kwargs)
+        self.grid_shape = tuple(int(n) for n in grid_shape)
+        self.rows = [int(row) for row in rows]
+        self.cols = [int(col) for col in cols]
+
+        # Position of each channel in the flattened grid
+        self.gather_index = tf.constant(np.array(self.rows) * self.grid_shape[1] + np.array(self.cols), dtype=tf.int32)
+
+    @classmethod
+    def from_montage(cls, montage: Montage, **kwargs)-> 'GridCompaction':
+        '''
+        Create the layer of a montage
+
+        Args:
+            montage: Montage
+                The electrode layout of the headset
+
+        Returns:
+            layer: GridCompaction
+                The grid compaction layer
+        '''
+        return cls(montage.grid_shape, montage.rows.tolist(), montage.cols.tolist(), **kwargs)
+
+    def call(self, inputs):
+        '''
+        Gather (batch, window, grid rows, grid columns[, 1]) grids into (batch, window, channels) readings
+        '''
+        flat = tf.reshape(inputs, tf.concat([tf.shape(inputs)[:2], [self.grid_shape[0] * self.grid_shape[1]]], axis=0))
+        return tf.gather(flat, self.gather_index, axis=-1)
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape[:2]).concatenate([len(self.rows)])
+
+    def get_config(self)-> dict:
+        config = super().get_config()
+        config.update({'grid_shape': self.grid_shape, 'rows': self.rows, 'cols': self.cols})
+        config.pop('trainable', None)
+        return config
@@ -0,0 +1,205 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from data.montage import CYTON_MONTAGE
+from data.normalization import RunningNormalizer
+
+
+class LivePredictor:
+    '''
+    Run a model on the latest window of a live stream in a background thread.
+
+    The predictor follows the ring buffer of the acquisition thread, keeps running normalization statistics of the
+    latest window, and predicts at a fixed stride. When a prediction takes longer than the stride, the windows that
+    became stale in the meantime are dropped and the newest window is predicted instead. A prediction that raises
+    is counted as a failure and skipped; after max_failures consecutive failures the predictor stops.
+    '''
+    def __init__(self, model, ring_buffer, channels, timestamp_channel=None, window_size=64, stride=16, montage=CYTON_MONTAGE,
+                 on_prediction=None, on_error=None, num_latencies=1000, max_failures=10)-> None:
+        '''
+        Constructor for the LivePredictor class
+
+        Args:
+            model: tf.keras.Model or inference backend
+                The trained model (grid or compact input), or a backend from ModelHandler.set_inference_backend
+            ring_buffer: RingBuffer
+                The ring buffer filled by the acquisition thread
+            channels: list
+                The columns of the EEG channels in the ring buffer
+            timestamp_channel: int
+                The column of the arrival timestamps (unix time) in the ring buffer, used to measure the latency
+            window_size: int
+                The number of samples per window
+            stride: int
+                The number of new samples between two predictions
+            montage: Montage
+                The electrode layout of the headset
+            on_prediction: callable
+                Called from the predictor thread with a dict describing each prediction
+            on_error: callable
+                Called from the predictor thread with the exception of each failed prediction, and with
+                stopped=True when the predictor gives up
+            num_latencies: int
+                The number of recent latencies kept for the percentiles
+            max_failures: int
+                The number of consecutive failed predictions after which the predictor stops
+        '''
+        self.model = model
+        self.ring_buffer = ring_buffer
+        self.channels = list(channels)
+        self.timestamp_channel = timestamp_channel
+        self.window_size = int(window_size)
+        self.stride = int(stride)
+        self.montage = montage
+        self.on_prediction = on_prediction
+        self.on_error = on_error
+        self.max_failures = int(max_failures)
+
+        # Grid models take (batch, window, rows, columns, 1), compact models take (batch, window, channels)
+        self.compact = len(model.input_shape) == 3
+
+        self.normalizer = RunningNormalizer("window", window_size=self.window_size)
+        self.latencies = deque(maxlen=num_latencies)
+        self.inference_times = deque(maxlen=num_latencies)
+        self.num_predictions = 0
+        self.num_dropped = 0
+        self.num_failures = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self)-> None:
+        '''
+        Start predicting from the next complete window
+        '''
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="live_predictor", daemon=True)
+        self.thread.start()
+
+    def stop(self)-> None:
+        '''
+        Stop the predictor thread
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def is_running(self)-> bool:
+        '''
+        Whether the predictor thread is running, i.e. it was started and neither stopped nor gave up after failures
+        '''
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self)-> None:
+        '''
+        Predict every stride samples until stop is called
+        '''
+        count = self.ring_buffer.total_written
+        next_window_end = count + self.window_size
+        self.normalizer.reset()
+
+        while not self.stop_event.is_set():
+            if not self.ring_buffer.wait_for(next_window_end, timeout=0.1):
+                continue
+
+            # Feed every new sample to the running statistics, restarting them if samples were lost
+            samples, count, num_lost = self.ring_buffer.read_since(count)
+            if num_lost:
+                self.normalizer.reset()
+            self.normalizer.update(samples[:, self.channels])
+
+            # Predict the newest window only, dropping the windows that became stale while the last prediction ran
+            self.num_dropped += (count - next_window_end) // self.stride
+            next_window_end = count + self.stride
+            try:
+                self.predict_latest(count)
+                self.consecutive_failures = 0
+            except Exception as e:
+                # Skip the window rather than let the thread die silently, and give up if the model keeps failing
+                self.num_failures += 1
+                self.consecutive_failures += 1
+                self.last_error = e
+                stopped = self.consecutive_failures >= self.max_failures
+                if self.on_error is not None:
+                    self.on_error(e, stopped=stopped)
+                if stopped:
+                    break
+
+    def predict_latest(self, count)-> dict:
+        '''
+        Predict the window that ends at a given sample count of the ring buffer
+
+        Args:
+            count: int
+                The value of ring_buffer.total_written after the last sample of the window
+
+        Returns:
+            prediction: dict
+                The label, the class probabilities, the end-to-end latency and the inference time in seconds
+        '''
+        window = self.ring_buffer.get_latest_until(count, self.window_size)
+        channel_values = window[:, self.channels]
+
+        # Normalize in channel space (the empty grid positions normalize to zero) and build the model input
+        normalized = self.normalizer.normalize_window(channel_values)
+        if self.compact:
+            inputs = normalized[np.newaxis].astype(np.float32)
+        else:
+            inputs = self.montage.expand(normalized)[np.newaxis, ..., np.newaxis].astype(np.float32)
+
+        start_time = time.perf_counter()
+        probabilities = np.asarray(self.model(inputs, training=False))[0]
+        inference_time = time.perf_counter() - start_time
+
+        # End-to-end latency from the arrival of the newest sample of the window
+        latency = time.time() - window[-1, self.timestamp_channel] if self.timestamp_channel is not None else inference_time
+        self.latencies.append(latency)
+        self.inference_times.append(inference_time)
+        self.num_predictions += 1
+
+        prediction = {'label': int(np.argmax(probabilities)),
+                      'probabilities': probabilities,
+                      'latency': latency,
+                      'inference_time': inference_time}
+        if self.on_prediction is not None:
+            self.on_prediction(prediction)
+        return prediction
+
+    def get_latency_percentiles(self, percentiles=(50, 95, 99))-> dict:
+        '''
+        Get percentiles of the recent end-to-end latencies
+
+        Args:
+            percentiles: tuple
+                The percentiles to compute
+
+        Returns:
+            latencies: dict
+                The latency in milliseconds of each percentile, e.g. {'p50': 12.3, ...}
+        '''
+        if not self.latencies:
+            return {f"p{percentile}": float('nan') for percentile in percentiles}
+        values = np.percentile(np.asarray(self.latencies) * 1e3, percentiles)
+        return {f"p{percentile}": float(value) for percentile, value in zip(percentiles, values)}
+
+    def report(self)-> str:
+        '''
+        Get a summary of the predictions
+
+        Returns:
+            report: str
+                The number of predictions, dropped windows and failures and the latency percentiles
+        '''
+        latencies = ", ".join(f"{name} {value:.1f} ms" for name, value in self.get_latency_percentiles().items())
+        inference = np.median(self.inference_times) * 1e3 if self.inference_times else float('nan')
+        report = (f"{self.num_predictions} predictions, {self.num_dropped} stale windows dropped, "
+                  f"latency {latencies} (median inference {inference:.1f} ms)")
+        if self.num_failures:
+            report += f", {self.num_failures} failed predictions (last error: {self.last_error!r})"
+        return report
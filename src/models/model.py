@@ -1,22 +1,110 @@
 import tensorflow as tf
-from tensorflow.keras import Sequential
-from keras.layers import Dense, Conv3D, Dropout, Flatten, MaxPooling3D
 from sklearn.utils.class_weight import compute_class_weight
 import numpy as np
 import time
 import os
 
+from data.montage import get_montage
+from data.window_source import FileWindowSource, SlidingWindowSource
+from models.callbacks import TrainingCheckpoint
+from models.inference import create_backend
+from models.model_zoo import build_model, format_model_costs, get_model_costs
+
+# Folder of the saved models and of the checkpointed training runs
+MODELS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models")
+RUNS_FOLDER = os.path.join(MODELS_FOLDER, "runs")
+
+# Learning rate of Adam at the reference batch size, scaled for other batch sizes by scale_learning_rate
+BASE_LEARNING_RATE = 0.001
+BASE_BATCH_SIZE = 32
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None)-> bool:
+    '''
+    Set the sizes of the TensorFlow thread pools
+
+    Must be called before TensorFlow runs its first operation (i.e. before a ModelHandler is created).
+
+    Args:
+        intra_op_threads: int
+            Threads used inside one operation (e.g. a convolution), None or 0 for one per core
+        inter_op_threads: int
+            Operations run concurrently, None or 0 for the TensorFlow default
+
+    Returns:
+        configured: bool
+            Whether the thread pools were set
+    '''
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        print(f"Thread pools not changed: {e}")
+        return False
+    return True
+
+
+def scale_learning_rate(batch_size, base_learning_rate=BASE_LEARNING_RATE, base_batch_size=BASE_BATCH_SIZE, rule="linear")-> float:
+    '''
+    Scale the learning rate to the batch size, so larger batches train with fewer but larger steps
+
+    Args:
+        batch_size: int
+            Batch size
+        base_learning_rate: float
+            Learning rate at the reference batch size
+        base_batch_size: int
+            Reference batch size
+        rule: str
+            "linear" (proportional to the batch size) or "sqrt" (proportional to its square root)
+
+    Returns:
+        learning_rate: float
+            The learning rate for the batch size
+    '''
+    if rule == "linear":
+        return base_learning_rate * batch_size / base_batch_size
+    if rule == "sqrt":
+        return base_learning_rate * np.sqrt(batch_size / base_batch_size)
+    raise ValueError(f"Unknown learning rate scaling rule '{rule}', expected 'linear' or 'sqrt'")
+
 
 class ModelHandler:
-    def __init__(self, dataset_handler)-> None:
+    def __init__(self, dataset_handler, window_shape=None, num_labels=2, model_name="oneill")-> None:
+        '''
+        Constructor for the ModelHandler class
+
+        Args:
+            dataset_handler: DatasetHandler
+                The dataset handler, or None
+            window_shape: tuple
+                Shape of a single window the model is built for (see match_window_shape), the default O'Neill grid if None
+            num_labels: int
+                Number of output labels
+            model_name: str
+                Name of the architecture (see models.model_zoo.MODELS)
+        '''
         self.model_path = None
         self.model = None
+        self.model_name = None
+        self.inference_backend = None
+        self.checkpoint = None
+
+        # Compile options, kept when the model is recreated
+        self.learning_rate = BASE_LEARNING_RATE
+        self.jit_compile = False
+        self.steps_per_execution = 1
 
         # Initialize the dataset handler
         self.dataset_handler = dataset_handler
         
-        # Create an O'Neill model by default
-        self.create_oneill_model(input_shape=(64, 10, 11, 1), num_labels=2)
+        # Create the requested model directly, or an O'Neill model by default
+        if window_shape is not None:
+            self.match_window_shape(window_shape, num_labels, model_name)
+        else:
+            self.create_model(model_name, (64, 10, 11, 1), num_labels)
 
     def load_h5_or_hdf5(self, model_path)-> None:
         '''
@@ -30,53 +118,219 @@ class ModelHandler:
             None
         '''
         self.model.load_weights(model_path)
+        self.model_path = model_path
+        self.inference_backend = None
         print(f"Model weights loaded from {model_path}")
 
-    def create_oneill_model(self, input_shape, num_labels):
+    def create_oneill_model(self, input_shape, num_labels, montage=None):
         '''
         Create a CNN model based on the O'Neill paper
         
         Args:
             input_shape: tuple
-                Shape of the input data
+                Shape of the input data on the spatial grid
+            num_labels: int
+                Number of output labels
+            montage: Montage
+                If set, the model takes compact (window, channels) windows and expands them onto the grid of the montage
+
+        Returns:
+            None
+        '''
+        if montage is not None:
+            input_shape = (input_shape[0], montage.num_channels)
+        self.create_model("oneill", input_shape, num_labels, montage)
+
+    def create_model(self, model_name, input_shape, num_labels, montage=None)-> None:
+        '''
+        Create a model of the model zoo and compile it with the current compile options
+
+        Args:
+            model_name: str
+                Name of the architecture (see models.model_zoo.MODELS)
+            input_shape: tuple
+                Compact (window, channels) or grid (window, rows, columns, 1) input shape
             num_labels: int
                 Number of output labels
+            montage: Montage
+                The electrode layout of the headset
 
         Returns:
             None
         '''
-        # Create CNN model
-        self.model = Sequential()
-        self.model.add(Conv3D(32, kernel_size=(3, 3, 3), padding='same', input_shape=input_shape))
-        self.model.add(MaxPooling3D(pool_size=(2, 2, 2)))
-        self.model.add(Conv3D(64, kernel_size=(3, 3, 3), padding='same'))
-        self.model.add(MaxPooling3D(pool_size=(2, 2, 2)))
-        self.model.add(Conv3D(128, kernel_size=(5, 4, 3), padding='same'))
-        self.model.add(MaxPooling3D(pool_size=(2, 2, 2)))
-        self.model.add(Flatten())
-        self.model.add(Dense(1024, activation=tf.nn.relu))
-        self.model.add(Dropout(0.5))
-        self.model.add(Dense(1024, activation=tf.nn.relu))
-        self.model.add(Dropout(0.5))
-        self.model.add(Dense(1024, activation=tf.nn.relu))
-        self.model.add(Dropout(0.5))
-        self.model.add(Dense(num_labels, activation=tf.nn.softmax))
+        self.model = build_model(model_name, input_shape, num_labels, montage)
+        self.model_name = model_name
+        # The new weights are not saved anywhere yet
+        self.model_path = None
 
         # Compile model
-        self.model.compile(optimizer='adam',
+        self.compile_model(self.learning_rate, self.jit_compile, self.steps_per_execution)
+
+    def compile_model(self, learning_rate=BASE_LEARNING_RATE, jit_compile=False, steps_per_execution=1)-> None:
+        '''
+        Compile the current model for training, keeping its weights
+
+        Args:
+            learning_rate: float
+                Learning rate of the Adam optimizer
+            jit_compile: bool
+                Whether to compile the training step with XLA, which fuses the operations of the network
+            steps_per_execution: int
+                Number of training steps per call into the compiled function, to cut the per-step overhead
+
+        Returns:
+            None
+        '''
+        self.learning_rate = learning_rate
+        self.jit_compile = jit_compile
+        self.steps_per_execution = steps_per_execution
+        self.model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
                     loss='sparse_categorical_crossentropy',
-                    metrics=['accuracy'])
+                    metrics=['accuracy'],
+                    jit_compile=jit_compile,
+                    steps_per_execution=steps_per_execution)
+        self.inference_backend = None
+
+    def set_inference_backend(self, backend="keras", quantization=None, calibration_data=None, num_threads=None):
+        '''
+        Choose how predict (and live inference) runs the model
+
+        The backend is built from the current weights; it is reset to keras when the model is recreated, loaded or trained.
 
-    def train_model(self, train_images, train_labels, val_images, val_labels, class_weight_dict=None, epochs=100, batch_size=32)-> tf.keras.callbacks.History:
+        Args:
+            backend: str
+                "keras" (eager calls), "graph" (tf.function with a fixed input signature) or "tflite" (TFLite with XNNPACK)
+            quantization: str
+                None, "float16" or "int8" post-training quantization of the tflite backend
+            calibration_data: np.array
+                Representative inputs to calibrate int8 quantization, e.g. a slice of the training windows
+            num_threads: int
+                Number of TFLite interpreter threads
+
+        Returns:
+            backend: KerasBackend, GraphBackend or TFLiteBackend
+                The inference backend
+        '''
+        if calibration_data is not None:
+            calibration_data = np.asarray(calibration_data, dtype=np.float32).reshape((-1,) + tuple(self.model.input_shape[1:]))
+        self.inference_backend = create_backend(self.model, backend, quantization, calibration_data, num_threads)
+        print(f"Inference backend: {self.inference_backend.name}")
+        return self.inference_backend
+
+    def get_inference_backend(self):
+        '''
+        Get the current inference backend, creating the keras backend if none was chosen
+
+        Returns:
+            backend: KerasBackend, GraphBackend or TFLiteBackend
+                The inference backend
+        '''
+        if self.inference_backend is None:
+            self.set_inference_backend("keras")
+        return self.inference_backend
+
+    def predict(self, images, batch_size=32)-> np.ndarray:
+        '''
+        Predict the class probabilities of windows with the current inference backend
+
+        Args:
+            images: np.array
+                The windows, with or without the trailing channel axis
+            batch_size: int
+                Batch size
+
+        Returns:
+            probabilities: np.array
+                The class probabilities of each window
+        '''
+        backend = self.get_inference_backend()
+        images = np.asarray(images, dtype=np.float32).reshape((-1,) + tuple(self.model.input_shape[1:]))
+        return np.concatenate([backend(images[start: start+batch_size]) for start in range(0, len(images), batch_size)])
+
+    def match_window_shape(self, window_shape, num_labels=2, model_name=None)-> None:
+        '''
+        Recreate the model if it does not take windows of the given shape, does not have num_labels outputs or is not of the given architecture
+
+        Compact (window, channels) windows get a model with the montage of their number of channels.
+
+        Args:
+            window_shape: tuple
+                Shape of a single window of the dataset
+            num_labels: int
+                Number of output labels
+            model_name: str
+                Name of the architecture (see models.model_zoo.MODELS), the current one if None
+
+        Returns:
+            None
+        '''
+        model_name = model_name or self.model_name
+        window_shape = tuple(window_shape)
+        if self.model is not None:
+            model_shape = tuple(self.model.input_shape[1:])
+            if (model_name == self.model_name and self.model.output_shape[-1] == num_labels
+                    and (model_shape == window_shape or model_shape == window_shape + (1,))):
+                return
+
+        if len(window_shape) == 2:
+            montage = get_montage(window_shape[1])
+            print(f"Creating a {model_name} model for compact {montage.name} windows of shape {window_shape}")
+            self.create_model(model_name, window_shape, num_labels, montage)
+        else:
+            print(f"Creating a {model_name} model for grid windows of shape {window_shape}")
+            self.create_model(model_name, window_shape[:3] + (1,), num_labels)
+
+    def describe_model(self, val_accuracy=None, num_runs=200)-> dict:
+        '''
+        Print the parameter count, FLOPs per window and single-window CPU latency of the model
+
+        Args:
+            val_accuracy: float
+                Validation accuracy to print next to the costs
+            num_runs: int
+                Number of timed single-window predictions
+
+        Returns:
+            costs: dict
+                The costs from models.model_zoo.get_model_costs
+        '''
+        costs = get_model_costs(self.model, num_runs)
+        print(format_model_costs(self.model_name, costs, val_accuracy))
+        return costs
+
+    def as_tf_dataset(self, data, batch_size=32, shuffle=False):
+        '''
+        Convert a lazy window source into a tf.data.Dataset
+
+        Args:
+            data: SlidingWindowSource, FileWindowSource or tf.data.Dataset
+                The data to convert
+            batch_size: int
+                Batch size
+            shuffle: bool
+                Whether to shuffle the windows on every epoch
+
+        Returns:
+            dataset: tf.data.Dataset or None
+                The batched dataset, or None if the data are in-memory arrays
+        '''
+        if isinstance(data, (SlidingWindowSource, FileWindowSource)):
+            return data.to_tf_dataset(batch_size=batch_size, shuffle=shuffle)
+        if isinstance(data, tf.data.Dataset):
+            return data
+        return None
+
+    def train_model(self, train_images, train_labels=None, val_images=None, val_labels=None, class_weight_dict=None, epochs=100, batch_size=32,
+                    callbacks=None, run_dir=None, resume=False, patience=None, checkpoint_every=1)-> tf.keras.callbacks.History:
         '''
         Train the model
         
         Args:
-            train_images: np.array
-                Training images
+            train_images: np.array, SlidingWindowSource, FileWindowSource or tf.data.Dataset
+                Training images (the labels are taken from the source or dataset if it is not an array)
             train_labels: np.array
                 Training labels
-            val_images: np.array
+            val_images: np.array, SlidingWindowSource, FileWindowSource or tf.data.Dataset
                 Validation images
             val_labels: np.array
                 Validation labels
@@ -85,54 +339,143 @@ class ModelHandler:
             epochs: int
                 Number of epochs
             batch_size: int
-                Batch size
+                Batch size (ignored for a tf.data.Dataset, which is already batched)
+            callbacks: list
+                Keras callbacks, e.g. a ThroughputLogger
+            run_dir: str
+                If set, the run is checkpointed into this directory, which keeps the weights of the best epoch
+                (see create_run_dir); the model ends with the weights of the best epoch
+            resume: bool
+                Whether to continue the run from the latest checkpoint in run_dir, up to the same total number of epochs
+            patience: int
+                Number of epochs without improvement of the validation loss before training stops, None to train every epoch
+            checkpoint_every: int
+                Number of epochs between checkpoints
                 
         Returns:
             history: tf.keras.callbacks.History
                 Training history
         '''
+        callbacks = list(callbacks or [])
+        initial_epoch = 0
+        self.checkpoint = None
+        if run_dir is not None:
+            self.checkpoint = TrainingCheckpoint(run_dir, self.model_name, save_every=checkpoint_every, patience=patience)
+            initial_epoch = self.checkpoint.setup(self.model, resume)
+            callbacks.append(self.checkpoint)
+        elif patience:
+            callbacks.append(tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True))
+
+        train_dataset = self.as_tf_dataset(train_images, batch_size, shuffle=True)
+        if train_dataset is not None:
+            val_dataset = self.as_tf_dataset(val_images, batch_size)
+            history = self.model.fit(train_dataset,
+                                epochs=epochs,
+                                validation_data=val_dataset if val_dataset is not None else (val_images, val_labels),
+                                class_weight=class_weight_dict,
+                                callbacks=callbacks,
+                                initial_epoch=initial_epoch
+                                )
+            self.inference_backend = None
+            self.model_path = None
+            return history
+
         history = self.model.fit(train_images, train_labels,
                             epochs=epochs,
                             batch_size=batch_size,
                             validation_data=(val_images, val_labels),
-                            class_weight=class_weight_dict
+                            class_weight=class_weight_dict,
+                            callbacks=callbacks,
+                            initial_epoch=initial_epoch
                             )
+        self.inference_backend = None
+        self.model_path = None
         return history
         
-    def test_model(self, test_images, test_labels)-> None:
+    def test_model(self, test_images, test_labels=None, batch_size=32)-> None:
         '''
         Test the model
         
         Args:
-            test_images: np.array
-                Test images
+            test_images: np.array, SlidingWindowSource, FileWindowSource or tf.data.Dataset
+                Test images (the labels are taken from the source or dataset if it is not an array)
             test_labels: np.array
                 Test labels
+            batch_size: int
+                Batch size used for lazy window sources and files streamed from disk
                 
         Returns:
             None
         '''
-        test_loss, test_accuracy = self.model.evaluate(test_images, test_labels)
+        test_dataset = self.as_tf_dataset(test_images, batch_size)
+        if test_dataset is not None:
+            test_loss, test_accuracy = self.model.evaluate(test_dataset)
+        else:
+            test_loss, test_accuracy = self.model.evaluate(test_images, test_labels)
         print(f"Test Loss: {test_loss:.4f}")
         print(f"Test Accuracy: {test_accuracy:.4f}")
 
-    def save_model(self)-> None:
+    def save_model(self, tag=None)-> str:
         '''
         Save the model
 
+        The file is named after the architecture, the time and, after a checkpointed run, its best epoch,
+        e.g. eegnet_20240601_153000_best_epoch012_val_loss0.4311.hdf5
+
         Args:
-            None
+            tag: str
+                Suffix of the file name. Defaults to the best epoch of the last checkpointed run
 
         Returns:
-            None
+            save_path: str
+                Path of the saved model
         '''
         # Get current timestamp
         timestamp = time.strftime("%Y%m%d_%H%M%S")
+        if tag is None and self.checkpoint is not None and self.checkpoint.best_path is not None:
+            tag = self.checkpoint.best_tag
         # Set the save path
-        save_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", f"model_{timestamp}.hdf5")
+        save_path = os.path.join(MODELS_FOLDER, "_".join([self.model_name, timestamp] + ([tag] if tag else [])) + ".hdf5")
         # Save the model
         self.model.save(save_path)
+        self.model_path = save_path
         print(f"Model saved to {save_path}")
+        return save_path
+
+    def create_run_dir(self, runs_folder=RUNS_FOLDER)-> str:
+        '''
+        Create the directory of a new checkpointed training run
+
+        Args:
+            runs_folder: str
+                Folder of the training runs
+
+        Returns:
+            run_dir: str
+                The run directory, named after the architecture and the time
+        '''
+        run_dir = os.path.join(runs_folder, f"{self.model_name}_{time.strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(run_dir, exist_ok=True)
+        return run_dir
+
+    def find_last_run(self, runs_folder=RUNS_FOLDER)-> str:
+        '''
+        Find the most recent training run of the current architecture that can be resumed
+
+        Args:
+            runs_folder: str
+                Folder of the training runs
+
+        Returns:
+            run_dir: str or None
+                The run directory, or None if no run of the architecture has a checkpoint
+        '''
+        if not os.path.isdir(runs_folder):
+            return None
+        run_dirs = [os.path.join(runs_folder, name) for name in os.listdir(runs_folder) if name.startswith(f"{self.model_name}_")]
+        run_dirs = [run_dir for run_dir in run_dirs if tf.train.latest_checkpoint(os.path.join(run_dir, "checkpoints"))]
+        # The most recently checkpointed run, which may be an older run that was resumed
+        return max(run_dirs, key=lambda run_dir: os.path.getmtime(os.path.join(run_dir, "checkpoints", "checkpoint"))) if run_dirs else None
 
     def get_class_weights(self, train_labels)-> dict:
         '''
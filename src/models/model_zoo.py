@@ -0,0 +1,249 @@
+'''
+Registry of the model architectures.
+
+Every builder takes the model input shape, either compact (window, channels) or a grid (window, rows, columns, 1),
+the number of labels and the montage of the headset, and returns an uncompiled Keras model. The architectures
+other than O'Neill work on channel readings, so grid inputs are first gathered back into the electrode channels.
+'''
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import Sequential
+from keras.layers import (Activation, AveragePooling2D, BatchNormalization, Conv1D, Conv2D, Conv3D, Dense, DepthwiseConv2D, Dropout, Flatten,
+                          GlobalAveragePooling1D, MaxPooling1D, MaxPooling3D, Reshape, SeparableConv2D)
+from keras.constraints import max_norm
+
+from data.montage import CYTON_MONTAGE
+from models.inference import create_backend, measure_latency
+from models.layers import GridCompaction, GridExpansion
+
+# Registered architectures: name -> (builder, description)
+MODELS = {}
+
+
+def register_model(name, description):
+    '''
+    Register a model builder under a name
+
+    Args:
+        name: str
+            Name of the architecture, as selected in the GUI
+        description: str
+            One line describing the architecture
+
+    Returns:
+        decorator: callable
+            Registers the decorated builder and returns it unchanged
+    '''
+    def decorator(builder):
+        MODELS[name] = (builder, description)
+        return builder
+    return decorator
+
+
+def build_model(name, input_shape, num_labels, montage=None)-> tf.keras.Model:
+    '''
+    Build a registered architecture
+
+    Args:
+        name: str
+            Name of the architecture
+        input_shape: tuple
+            Compact (window, channels) or grid (window, rows, columns, 1) input shape
+        num_labels: int
+            Number of output labels
+        montage: Montage
+            The electrode layout of the headset. Defaults to the Cyton montage for grid inputs
+
+    Returns:
+        model: tf.keras.Model
+            The uncompiled model
+
+    Raises:
+        ValueError: If the architecture is not registered
+    '''
+    if name not in MODELS:
+        raise ValueError(f"Unknown model '{name}', expected one of {list(MODELS)}")
+    builder, _ = MODELS[name]
+    return builder(tuple(input_shape), num_labels, montage)
+
+
+def _channel_input(model, input_shape, montage)-> int:
+    '''
+    Add the input of a channel model, gathering grid inputs back into channel readings
+
+    Returns:
+        num_channels: int
+            Number of channels the following layers see
+    '''
+    model.add(tf.keras.Input(shape=input_shape))
+    if len(input_shape) == 2:
+        return input_shape[1]
+    montage = montage or CYTON_MONTAGE
+    model.add(GridCompaction.from_montage(montage))
+    return montage.num_channels
+
+
+@register_model("oneill", "O'Neill Conv3D network on the spatial grid (heavy dense head)")
+def build_oneill(input_shape, num_labels, montage=None)-> tf.keras.Model:
+    '''
+    CNN based on the O'Neill paper, with three Dense(1024) layers on the flattened 3D feature map
+    '''
+    model = Sequential()
+    if len(input_shape) == 2:
+        # Rebuild the spatial grid inside the model, so datasets can be stored without the empty grid positions
+        model.add(tf.keras.Input(shape=input_shape))
+        model.add(GridExpansion.from_montage(montage))
+        model.add(Conv3D(32, kernel_size=(3, 3, 3), padding='same'))
+    else:
+        model.add(Conv3D(32, kernel_size=(3, 3, 3), padding='same', input_shape=input_shape))
+    model.add(MaxPooling3D(pool_size=(2, 2, 2)))
+    model.add(Conv3D(64, kernel_size=(3, 3, 3), padding='same'))
+    model.add(MaxPooling3D(pool_size=(2, 2, 2)))
+    model.add(Conv3D(128, kernel_size=(5, 4, 3), padding='same'))
+    model.add(MaxPooling3D(pool_size=(2, 2, 2)))
+    model.add(Flatten())
+    model.add(Dense(1024, activation=tf.nn.relu))
+    model.add(Dropout(0.5))
+    model.add(Dense(1024, activation=tf.nn.relu))
+    model.add(Dropout(0.5))
+    model.add(Dense(1024, activation=tf.nn.relu))
+    model.add(Dropout(0.5))
+    model.add(Dense(num_labels, activation=tf.nn.softmax))
+    return model
+
+
+@register_model("eegnet", "EEGNet-style temporal, depthwise spatial and separable convolutions")
+def build_eegnet(input_shape, num_labels, montage=None, temporal_filters=8, depth_multiplier=2, separable_filters=16, dropout=0.25)-> tf.keras.Model:
+    '''
+    Compact CNN after EEGNet (Lawhern et al., 2018): a temporal convolution, a depthwise convolution across all
+    channels per temporal filter, then a depthwise-separable convolution, with average pooling in time
+
+    The pooling sizes (4, then 8) are clamped to the remaining window, so windows shorter than 32 samples work too.
+    '''
+    model = Sequential()
+    num_channels = _channel_input(model, input_shape, montage)
+    window_size = input_shape[0]
+    first_pool = min(4, window_size)
+    second_pool = min(8, window_size // first_pool)
+    model.add(Reshape((window_size, num_channels, 1)))
+
+    # Temporal filters over half the window, then one spatial filter per temporal filter
+    model.add(Conv2D(temporal_filters, (max(1, window_size // 2), 1), padding='same', use_bias=False))
+    model.add(BatchNormalization())
+    model.add(DepthwiseConv2D((1, num_channels), depth_multiplier=depth_multiplier, use_bias=False, depthwise_constraint=max_norm(1.0)))
+    model.add(BatchNormalization())
+    model.add(Activation('elu'))
+    model.add(AveragePooling2D((first_pool, 1)))
+    model.add(Dropout(dropout))
+
+    # Summarize each feature map in time and mix them
+    model.add(SeparableConv2D(separable_filters, (16, 1), padding='same', use_bias=False))
+    model.add(BatchNormalization())
+    model.add(Activation('elu'))
+    model.add(AveragePooling2D((second_pool, 1)))
+    model.add(Dropout(dropout))
+    model.add(Flatten())
+    model.add(Dense(num_labels, activation=tf.nn.softmax, kernel_constraint=max_norm(0.25)))
+    return model
+
+
+@register_model("temporal_cnn", "1D temporal convolutions over the raw channels with global pooling")
+def build_temporal_cnn(input_shape, num_labels, montage=None, filters=(32, 64, 64), dropout=0.5)-> tf.keras.Model:
+    '''
+    Stack of 1D convolutions in time over the channel readings, followed by global average pooling, so the head
+    has a single small dense layer whatever the window size
+    '''
+    model = Sequential()
+    _channel_input(model, input_shape, montage)
+    for layer, (num_filters, kernel_size) in enumerate(zip(filters, (7, 5, 3))):
+        model.add(Conv1D(num_filters, kernel_size, padding='same', use_bias=False))
+        model.add(BatchNormalization())
+        model.add(Activation('relu'))
+        if layer < len(filters) - 1:
+            model.add(MaxPooling1D(2))
+    model.add(GlobalAveragePooling1D())
+    model.add(Dropout(dropout))
+    model.add(Dense(num_labels, activation=tf.nn.softmax))
+    return model
+
+
+def count_flops(model)-> int:
+    '''
+    Count the floating point operations of one window through the model
+
+    Counts two operations per multiply-add of the convolution and dense layers, which dominate the cost;
+    normalization, pooling and activations are left out.
+
+    Args:
+        model: tf.keras.Model
+            The model
+
+    Returns:
+        flops: int
+            Floating point operations per window
+    '''
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            flops += count_flops(layer)
+            continue
+        if not layer.weights:
+            continue
+        output_elements = int(np.prod(layer.output_shape[1:-1]))
+        if isinstance(layer, SeparableConv2D):
+            kernel_size = int(np.prod(layer.kernel_size))
+            depthwise_channels = layer.input_shape[-1] * layer.depth_multiplier
+            flops += 2 * output_elements * depthwise_channels * (kernel_size + layer.filters)
+        elif isinstance(layer, DepthwiseConv2D):
+            flops += 2 * output_elements * layer.input_shape[-1] * layer.depth_multiplier * int(np.prod(layer.kernel_size))
+        elif isinstance(layer, (Conv1D, Conv2D, Conv3D)):
+            flops += 2 * output_elements * layer.filters * int(np.prod(layer.kernel_size)) * layer.input_shape[-1] // layer.groups
+        elif isinstance(layer, Dense):
+            flops += 2 * int(np.prod(layer.input_shape[1:-1])) * layer.input_shape[-1] * layer.units
+    return flops
+
+
+def get_model_costs(model, num_runs=200)-> dict:
+    '''
+    Measure the cost of a model: parameters, FLOPs per window and single-window CPU latency
+
+    The latency is measured with the graph backend, the default of live inference.
+
+    Args:
+        model: tf.keras.Model
+            The model
+        num_runs: int
+            Number of timed single-window predictions
+
+    Returns:
+        costs: dict
+            Parameter count, FLOPs per window and p50 and p99 single-window latency in milliseconds
+    '''
+    window = np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+    latency = measure_latency(create_backend(model, "graph"), window, num_runs)
+    return {'parameters': int(model.count_params()),
+            'flops': count_flops(model),
+            'latency_p50_ms': float(latency['p50']),
+            'latency_p99_ms': float(latency['p99'])}
+
+
+def format_model_costs(name, costs, val_accuracy=None)-> str:
+    '''
+    Format the costs of a model, next to its validation accuracy if known
+
+    Args:
+        name: str
+            Name of the architecture
+        costs: dict
+            The costs from get_model_costs
+        val_accuracy: float
+            Validation accuracy
+
+    Returns:
+        line: str
+            The costs as one line of text
+    '''
+    accuracy = "" if val_accuracy is None else f", validation accuracy {val_accuracy:.3f}"
+    return (f"{name}: {costs['parameters']:,} parameters, {costs['flops'] / 1e6:.1f} MFLOPs/window, "
+            f"latency p50 {costs['latency_p50_ms']:.2f} ms (p99 {costs['latency_p99_ms']:.2f} ms){accuracy}")
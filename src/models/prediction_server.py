@@ -0,0 +1,535 @@
+'''
+Local prediction server that shares one loaded model between many clients.
+
+Run from the src folder, e.g.:
+    python -m models.prediction_server --weights ../models/model.hdf5 --max-wait-ms 5
+
+Protocol (multiprocessing.connection messages: a Unix domain socket, or a named pipe on Windows; little-endian):
+    message                 (type: uint8, request id: uint64) followed by the payload
+    PREDICT payload         ndim (uint8), shape (uint32 * ndim) and the float32 windows
+    RESULT payload          the same layout with the float32 class probabilities
+    INFO / STATS payload    JSON (empty in the request)
+    ERROR payload           UTF-8 error message
+'''
+
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import argparse
+import threading
+import subprocess
+from collections import deque
+from multiprocessing.connection import Client, Listener, address_type
+
+import numpy as np
+
+
+# Message types
+PREDICT, RESULT, INFO, STATS, ERROR = range(5)
+
+# Message header: type, request id
+MESSAGE = struct.Struct("<BQ")
+
+
+def get_address(name)-> str:
+    '''
+    Get the local address of a server: a named pipe on Windows, a Unix domain socket elsewhere
+
+    Args:
+        name: str
+            The name of the server
+
+    Returns:
+        address: str
+            The address for multiprocessing.connection
+    '''
+    if sys.platform == "win32":
+        return rf"\\.\pipe\{name}"
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), f"{name}.sock")
+
+
+# Default server address
+DEFAULT_ADDRESS = get_address("smmr_prediction_server")
+
+# Default model input: 64-sample windows on the Cyton grid
+DEFAULT_INPUT_SHAPE = (64, 10, 11, 1)
+
+
+def send_message(connection, message_type, request_id, payload=b"")-> None:
+    '''
+    Send one message
+
+    Args:
+        connection: multiprocessing.connection.Connection
+            The connection
+        message_type: int
+            The message type
+        request_id: int
+            The id the response is matched with
+        payload: bytes
+            The payload
+    '''
+    connection.send_bytes(MESSAGE.pack(message_type, request_id) + payload)
+
+
+def receive_message(connection)-> tuple:
+    '''
+    Receive one message
+
+    Args:
+        connection: multiprocessing.connection.Connection
+            The connection
+
+    Returns:
+        message: tuple
+            The message type, the request id and the payload
+
+    Raises:
+        ConnectionError: If the connection is closed
+    '''
+    try:
+        message = connection.recv_bytes()
+    except EOFError as e:
+        raise ConnectionError("Connection closed") from e
+    message_type, request_id = MESSAGE.unpack_from(message)
+    return message_type, request_id, message[MESSAGE.size:]
+
+
+def encode_array(array)-> bytes:
+    '''
+    Encode a float32 array as ndim, shape and data
+    '''
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return struct.pack(f"<B{array.ndim}I", array.ndim, *array.shape) + array.tobytes()
+
+
+def decode_array(payload)-> np.ndarray:
+    '''
+    Decode an array encoded by encode_array
+
+    Raises:
+        ValueError: If the payload is not an encoded array
+    '''
+    if not payload:
+        raise ValueError("Empty array payload")
+    ndim = payload[0]
+    shape = struct.unpack_from(f"<{ndim}I", payload, 1)
+    return np.frombuffer(payload, dtype=np.float32, offset=1 + 4 * ndim).reshape(shape)
+
+
+class PredictionServer:
+    '''
+    Serve predictions of one model to many local clients, combining concurrent requests into micro-batches
+    '''
+    def __init__(self, backend, address=DEFAULT_ADDRESS, max_batch_size=32, max_wait=0.005)-> None:
+        '''
+        Constructor for the PredictionServer class
+
+        Args:
+            backend: callable
+                The inference backend (see models.inference), taking a float32 batch and returning class probabilities
+            address: str
+                The local address to listen on (see get_address)
+            max_batch_size: int
+                Maximum number of windows per batch
+            max_wait: float
+                Maximum time in seconds the first request of a batch waits for more requests
+        '''
+        self.backend = backend
+        self.address = address
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max_wait
+
+        self.requests = queue.Queue()
+        self.stop_event = threading.Event()
+        self.listener = None
+        self.threads = []
+
+        # Statistics
+        self.start_time = time.monotonic()
+        self.num_requests = 0
+        self.num_windows = 0
+        self.num_batches = 0
+        self.max_queue_depth = 0
+        self.recent = deque(maxlen=1000)
+
+    def start(self)-> None:
+        '''
+        Listen on the address and start the accept and batching threads
+        '''
+        # Remove the socket left by a server that did not stop cleanly
+        if address_type(self.address) == 'AF_UNIX' and os.path.exists(self.address):
+            os.remove(self.address)
+        self.listener = Listener(self.address)
+        self.start_time = time.monotonic()
+
+        for target, name in ((self._accept, "accept"), (self._batch, "batching")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        print(f"Prediction server listening on {self.address}")
+
+    def serve_forever(self)-> None:
+        '''
+        Serve until interrupted
+        '''
+        self.start()
+        try:
+            while not self.stop_event.wait(10.0):
+                print(self.report())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self)-> None:
+        '''
+        Stop serving and remove the socket
+        '''
+        if self.listener is None:
+            return
+        self.stop_event.set()
+
+        # Wake the accept thread, which closing the listener does not do on every platform
+        try:
+            Client(self.address).close()
+        except OSError:
+            pass
+        self.listener.close()
+        self.listener = None
+
+    def _accept(self)-> None:
+        '''
+        Accept clients, each served by its own reader thread
+        '''
+        listener = self.listener
+        while not self.stop_event.is_set():
+            try:
+                connection = listener.accept()
+            except OSError:
+                break
+            if self.stop_event.is_set():
+                connection.close()
+                break
+            threading.Thread(target=self._read, args=(connection,), name="client", daemon=True).start()
+
+    def _read(self, connection)-> None:
+        '''
+        Read the requests of one client and queue the predictions
+
+        Args:
+            connection: multiprocessing.connection.Connection
+                The client connection
+        '''
+        send_lock = threading.Lock()
+        try:
+            while not self.stop_event.is_set():
+                message_type, request_id, payload = receive_message(connection)
+                if message_type == PREDICT:
+                    # Reject malformed requests here, so they cannot fail the other requests of their batch
+                    try:
+                        windows = self._check_windows(decode_array(payload))
+                    except (ValueError, struct.error) as e:
+                        with send_lock:
+                            send_message(connection, ERROR, request_id, f"Invalid windows: {e}".encode('utf-8'))
+                        continue
+                    self.requests.put((connection, send_lock, request_id, windows, time.monotonic()))
+                    self.max_queue_depth = max(self.max_queue_depth, self.requests.qsize())
+                elif message_type in (INFO, STATS):
+                    response = {'input_shape': list(self.backend.input_shape), 'backend': getattr(self.backend, 'name', "")}
+                    if message_type == STATS:
+                        response = self.get_stats()
+                    with send_lock:
+                        send_message(connection, message_type, request_id, json.dumps(response).encode('utf-8'))
+                else:
+                    with send_lock:
+                        send_message(connection, ERROR, request_id, f"Unknown message type {message_type}".encode('utf-8'))
+        except (ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            connection.close()
+
+    def _check_windows(self, windows)-> np.ndarray:
+        '''
+        Check that a batch of windows has the input shape of the model
+
+        Args:
+            windows: np.array
+                The decoded windows
+
+        Returns:
+            windows: np.array
+                The windows
+
+        Raises:
+            ValueError: If the windows do not have the shape of the model input
+        '''
+        window_shape = tuple(self.backend.input_shape[1:])
+        if windows.ndim != len(window_shape) + 1 or any(size is not None and size != expected
+                                                         for size, expected in zip(windows.shape[1:], window_shape)):
+            raise ValueError(f"expected windows of shape {window_shape}, got {windows.shape[1:]}")
+        return windows
+
+    def _batch(self)-> None:
+        '''
+        Combine queued requests into batches, run the model and send the results back
+        '''
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            # Wait up to max_wait for more requests, until the batch is full
+            num_windows = len(batch[0][3])
+            deadline = time.monotonic() + self.max_wait
+            while num_windows < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                num_windows += len(request[3])
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch)-> None:
+        '''
+        Predict a batch of requests and send each client its part of the result
+
+        Args:
+            batch: list
+                The queued requests
+        '''
+        try:
+            probabilities = np.asarray(self.backend(np.concatenate([request[3] for request in batch])))
+            error = None
+        except Exception as e:
+            probabilities, error = None, str(e)
+
+        done_time = time.monotonic()
+        start = 0
+        for connection, send_lock, request_id, windows, arrival_time in batch:
+            try:
+                with send_lock:
+                    if error is None:
+                        send_message(connection, RESULT, request_id, encode_array(probabilities[start: start + len(windows)]))
+                    else:
+                        send_message(connection, ERROR, request_id, error.encode('utf-8'))
+            except OSError:
+                pass
+            start += len(windows)
+            self.recent.append((done_time, len(windows), done_time - arrival_time))
+
+        self.num_requests += len(batch)
+        self.num_windows += start
+        self.num_batches += 1
+
+    def get_stats(self)-> dict:
+        '''
+        Get the throughput, batching and queue statistics
+
+        Returns:
+            stats: dict
+                Totals since start, the current and maximum queue depth, the mean batch size,
+                and the throughput and request latency percentiles over the last 1000 requests
+        '''
+        stats = {'uptime': time.monotonic() - self.start_time,
+                 'requests': self.num_requests,
+                 'windows': self.num_windows,
+                 'batches': self.num_batches,
+                 'mean_batch_size': self.num_windows / self.num_batches if self.num_batches else 0.0,
+                 'queue_depth': self.requests.qsize(),
+                 'max_queue_depth': self.max_queue_depth}
+        recent = list(self.recent)
+        if len(recent) > 1:
+            times, windows, latencies = (np.array(values) for values in zip(*recent))
+            elapsed = times[-1] - times[0]
+            stats['windows_per_second'] = float(windows[1:].sum() / elapsed) if elapsed > 0 else float('nan')
+            stats['latency_p50_ms'], stats['latency_p99_ms'] = (float(value) for value in np.percentile(latencies * 1e3, (50, 99)))
+        return stats
+
+    def report(self)-> str:
+        '''
+        Get a one-line summary of the statistics
+        '''
+        stats = self.get_stats()
+        return (f"{stats['requests']} requests, {stats['windows']} windows in {stats['batches']} batches "
+                f"(mean batch {stats['mean_batch_size']:.1f}), queue depth {stats['queue_depth']} (max {stats['max_queue_depth']}), "
+                f"{stats.get('windows_per_second', 0.0):.0f} windows/s, p50 {stats.get('latency_p50_ms', float('nan')):.1f} ms")
+
+
+class PredictionClient:
+    '''
+    Request predictions from a prediction server, usable in place of an in-process model or inference backend
+    '''
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=10.0)-> None:
+        '''
+        Constructor for the PredictionClient class
+
+        Args:
+            address: str
+                The address of the server (see get_address)
+            timeout: float
+                Maximum time in seconds to wait for a response
+
+        Raises:
+            ConnectionError: If the server is not running
+        '''
+        try:
+            self.connection = Client(address)
+        except OSError as e:
+            raise ConnectionError(f"No prediction server at '{address}': {e}") from e
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.request_id = 0
+
+        info = self._request(INFO)
+        self.input_shape = tuple(info['input_shape'])
+        self.name = f"server ({info['backend']})"
+
+    def _request(self, message_type, payload=b""):
+        '''
+        Send a request and wait for its response
+        '''
+        with self.lock:
+            self.request_id += 1
+            send_message(self.connection, message_type, self.request_id, payload)
+            if not self.connection.poll(self.timeout):
+                raise TimeoutError(f"The prediction server did not respond within {self.timeout} s")
+            response_type, request_id, response = receive_message(self.connection)
+        if response_type == ERROR:
+            raise RuntimeError(f"Prediction server error: {response.decode('utf-8')}")
+        if response_type == RESULT:
+            return decode_array(response)
+        return json.loads(response.decode('utf-8'))
+
+    def predict(self, windows)-> np.ndarray:
+        '''
+        Predict the class probabilities of a batch of windows
+
+        Args:
+            windows: np.array
+                The windows, shaped like the model input
+
+        Returns:
+            probabilities: np.array
+                The class probabilities of each window
+        '''
+        return self._request(PREDICT, encode_array(windows))
+
+    def __call__(self, inputs, training=False)-> np.ndarray:
+        return self.predict(inputs)
+
+    def get_stats(self)-> dict:
+        '''
+        Get the statistics of the server
+
+        Returns:
+            stats: dict
+                See PredictionServer.get_stats
+        '''
+        return self._request(STATS)
+
+    def close(self)-> None:
+        self.connection.close()
+
+
+def start_server_process(address=DEFAULT_ADDRESS, weights_path=None, backend="graph", max_batch_size=32, max_wait=0.005,
+                         input_shape=DEFAULT_INPUT_SHAPE, num_labels=2, timeout=60.0, model_name="oneill", quantization=None,
+                         calibration_path=None)-> subprocess.Popen:
+    '''
+    Start a prediction server in a separate process and wait until it accepts clients
+
+    Args:
+        address: str
+            The local address of the server (see get_address)
+        weights_path: str
+            Weights of the model, saved with the same architecture, input shape and number of labels
+        backend: str
+            The inference backend
+        max_batch_size: int
+            Maximum number of windows per batch
+        max_wait: float
+            Maximum time in seconds the first request of a batch waits for more requests
+        input_shape: tuple
+            Shape of one model input, compact (window, channels) or grid (window, rows, columns, 1)
+        num_labels: int
+            Number of output labels
+        timeout: float
+            Maximum time in seconds to wait for the server
+        model_name: str
+            Architecture of the model (see models.model_zoo.MODELS)
+        quantization: str
+            None, "float16" or "int8" quantization of the tflite backend
+        calibration_path: str
+            .npy file of representative windows to calibrate int8 quantization
+
+    Returns:
+        process: subprocess.Popen
+            The server process
+
+    Raises:
+        RuntimeError: If the server process exits before accepting clients (e.g. the weights do not match the model)
+        TimeoutError: If the server does not start in time
+    '''
+    command = [sys.executable, "-m", "models.prediction_server", "--address", address, "--backend", backend,
+               "--max-batch-size", str(max_batch_size), "--max-wait-ms", str(max_wait * 1e3), "--model", model_name,
+               "--input-shape", *(str(size) for size in input_shape), "--num-labels", str(num_labels)]
+    if weights_path:
+        command += ["--weights", weights_path]
+    if quantization:
+        command += ["--quantization", quantization]
+    if calibration_path:
+        command += ["--calibration-data", calibration_path]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            PredictionClient(address).close()
+            return process
+        except ConnectionError:
+            time.sleep(0.2)
+    if process.poll() is not None:
+        raise RuntimeError(f"The prediction server exited with code {process.returncode}, see its output above")
+    process.terminate()
+    raise TimeoutError(f"The prediction server did not start within {timeout} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve predictions of one model to local clients.")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS,
+                        help="Local address: the path of a Unix domain socket, or a named pipe (\\\\.\\pipe\\name) on Windows.")
+    parser.add_argument("--weights", type=str, default=None, help="Weights of the model.")
+    parser.add_argument("--model", type=str, default="oneill", help="Architecture of the model (see models.model_zoo.MODELS).")
+    parser.add_argument("--backend", choices=("keras", "graph", "tflite"), default="graph", help="Inference backend.")
+    parser.add_argument("--quantization", choices=("float16", "int8"), default=None, help="TFLite quantization.")
+    parser.add_argument("--calibration-data", type=str, default=None, help=".npy file of windows to calibrate int8 quantization.")
+    parser.add_argument("--input-shape", type=int, nargs='+', default=list(DEFAULT_INPUT_SHAPE),
+                        help="Shape of one model input, compact (window channels) or grid (window rows columns 1).")
+    parser.add_argument("--num-labels", type=int, default=2, help="Number of output labels.")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Maximum number of windows per batch.")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Maximum time the first request of a batch waits for more.")
+    args = parser.parse_args()
+
+    # Load the model once for all clients
+    from models.model import ModelHandler
+
+    model_handler = ModelHandler(None, args.input_shape, num_labels=args.num_labels, model_name=args.model)
+    if args.weights:
+        model_handler.load_h5_or_hdf5(args.weights)
+    else:
+        print("Warning: no weights given, serving an untrained model")
+    calibration_data = np.load(args.calibration_data) if args.calibration_data else None
+    server = PredictionServer(model_handler.set_inference_backend(args.backend, args.quantization, calibration_data),
+                              address=args.address,
+                              max_batch_size=args.max_batch_size,
+                              max_wait=args.max_wait_ms / 1e3)
+    server.serve_forever()
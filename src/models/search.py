@@ -0,0 +1,293 @@
+'''
+Cross-validation and hyperparameter search over merged recordings.
+
+Every trial (one configuration on one fold) runs in a worker process with a fixed budget of CPU threads, so several
+trials train side by side without oversubscribing the machine. Windows are cut lazily from the recordings, so
+window size and overlap are searched without preprocessing the datasets again.
+
+Run from the src folder, e.g.:
+    python -m models.search ../data/session_*.csv --cv loso --model eegnet temporal_cnn --window-size 64 128 --overlap 0.25 0.5
+    python -m models.search ../data/merged.csv --folds 5 --search random --trials 20 --learning-rate 0.003 0.001 0.0003 --workers 8 --threads-per-trial 4
+'''
+
+import os
+import time
+import argparse
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from data.window_source import SlidingWindowSource
+
+# Values of the parameters a configuration leaves out
+DEFAULT_PARAMETERS = {'model': "eegnet", 'window_size': 64, 'overlap': 0.25, 'learning_rate': 0.001, 'batch_size': 32, 'epochs': 10,
+                      'compact': True}
+
+# Recordings already loaded by this worker process
+_sessions = {}
+
+
+def grid_search(space)-> list:
+    '''
+    List every combination of the parameter values
+
+    Args:
+        space: dict
+            The values to try for each parameter, e.g. {'window_size': [64, 128], 'model': ["eegnet", "oneill"]}
+
+    Returns:
+        configurations: list
+            One dict of parameters per combination
+    '''
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_search(space, num_trials, seed=None)-> list:
+    '''
+    Draw random combinations of the parameter values
+
+    Args:
+        space: dict
+            The values to draw from for each parameter
+        num_trials: int
+            Number of configurations (fewer if the space has fewer distinct combinations)
+        seed: int
+            The random seed
+
+    Returns:
+        configurations: list
+            One dict of parameters per distinct combination
+    '''
+    rng = np.random.default_rng(seed)
+    configurations = []
+    for _ in range(num_trials * 10):
+        configuration = {name: values[rng.integers(len(values))] for name, values in space.items()}
+        if configuration not in configurations:
+            configurations.append(configuration)
+        if len(configurations) == num_trials:
+            break
+    return configurations
+
+
+def split_segments(segments, num_folds, fold)-> tuple:
+    '''
+    Split every segment in time into num_folds consecutive parts and hold one part out
+
+    The parts before and after the held-out part stay separate segments, so no training window spans it.
+
+    Args:
+        segments: list
+            (continuous data, label) pairs
+        num_folds: int
+            Number of folds
+        fold: int
+            The held-out part
+
+    Returns:
+        train_segments, val_segments: tuple
+            The segments to train on and the held-out segments
+    '''
+    train_segments = []
+    val_segments = []
+    for data, label in segments:
+        bounds = np.linspace(0, len(data), num_folds + 1).round().astype(int)
+        val_segments.append((data[bounds[fold]: bounds[fold + 1]], label))
+        train_segments += [(part, label) for part in (data[:bounds[fold]], data[bounds[fold + 1]:]) if len(part)]
+    return train_segments, val_segments
+
+
+def _init_worker(threads_per_trial)-> None:
+    '''
+    Limit the CPU threads of a worker process, before TensorFlow runs its first operation
+    '''
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_trial)
+    from models.model import configure_threads
+    configure_threads(intra_op_threads=threads_per_trial, inter_op_threads=1)
+
+
+def _load_session(file_path)-> pd.DataFrame:
+    '''
+    Load a recording once per worker process
+    '''
+    if file_path not in _sessions:
+        _sessions[file_path] = pd.read_csv(file_path)
+    return _sessions[file_path]
+
+
+def run_trial(task)-> dict:
+    '''
+    Train one configuration on one fold and evaluate it on the held-out data
+
+    Runs in the worker processes of run_search.
+
+    Args:
+        task: dict
+            The parameters, the recordings, the cross-validation scheme and the fold
+
+    Returns:
+        result: dict
+            The parameters and fold with the validation accuracy and loss, the window counts and the training time,
+            or the error if the trial failed
+    '''
+    parameters = task['parameters']
+    result = dict(parameters, fold=task['fold'])
+    try:
+        import tensorflow as tf
+        from models.model import ModelHandler
+
+        # Cut the windows of every recording, with the classes in the same label order
+        sources = [SlidingWindowSource.from_dataframe(_load_session(file_path), parameters['window_size'], parameters['overlap'],
+                                                      normalize=True, class_names=task['class_names'], compact=parameters['compact'])
+                   for file_path in task['file_paths']]
+        if task['cv'] == "loso":
+            train_segments = [segment for number, source in enumerate(sources) if number != task['fold'] for segment in source.segments]
+            val_segments = sources[task['fold']].segments
+        else:
+            train_segments, val_segments = split_segments([segment for source in sources for segment in source.segments],
+                                                          task['num_folds'], task['fold'])
+        train_source, val_source = (SlidingWindowSource(segments, parameters['window_size'], parameters['overlap'], True, task['class_names'])
+                                    for segments in (train_segments, val_segments))
+
+        # Build the requested architecture directly and train it on windows cut batch by batch, never all at once
+        tf.keras.utils.set_random_seed(task['seed'])
+        model_handler = ModelHandler(None, train_source.window_shape, num_labels=len(task['class_names']), model_name=parameters['model'])
+        model_handler.compile_model(parameters['learning_rate'])
+        start_time = time.perf_counter()
+        model_handler.model.fit(train_source.to_tf_dataset(parameters['batch_size'], shuffle=True, seed=task['seed']),
+                                epochs=parameters['epochs'], verbose=0)
+        train_seconds = time.perf_counter() - start_time
+        val_loss, val_accuracy = model_handler.model.evaluate(val_source.to_tf_dataset(256, shuffle=False), verbose=0)
+
+        result.update(val_accuracy=val_accuracy, val_loss=val_loss, train_windows=len(train_source), val_windows=len(val_source),
+                      train_seconds=train_seconds, error="")
+    except Exception as e:
+        result.update(error=f"{type(e).__name__}: {e}")
+    return result
+
+
+def summarize_results(results)-> pd.DataFrame:
+    '''
+    Aggregate the folds of every configuration
+
+    Args:
+        results: pd.DataFrame
+            One row per trial, as written by run_search
+
+    Returns:
+        summary: pd.DataFrame
+            Mean and standard deviation of the validation accuracy, mean training time and number of folds of each
+            configuration, best first
+    '''
+    parameter_columns = [column for column in DEFAULT_PARAMETERS if column in results.columns]
+    succeeded = results[results['error'] == ""]
+    if succeeded.empty:
+        return pd.DataFrame(columns=parameter_columns)
+    summary = (succeeded.groupby(parameter_columns, dropna=False)
+               .agg(mean_accuracy=('val_accuracy', 'mean'), std_accuracy=('val_accuracy', 'std'),
+                    mean_train_seconds=('train_seconds', 'mean'), folds=('fold', 'count'))
+               .reset_index())
+    return summary.sort_values('mean_accuracy', ascending=False, ignore_index=True)
+
+
+def run_search(file_paths, configurations, cv="kfold", num_folds=5, num_workers=None, threads_per_trial=None, output_path=None,
+               seed=0)-> pd.DataFrame:
+    '''
+    Cross-validate every configuration, running the trials in a pool of processes
+
+    Args:
+        file_paths: list
+            Merged recordings (channels, then a 'Class' column), one per session
+        configurations: list
+            One dict of parameters per configuration (see grid_search and random_search); missing parameters take
+            the values of DEFAULT_PARAMETERS
+        cv: str
+            "kfold" (every recording split in time into num_folds parts) or "loso" (leave one session out)
+        num_folds: int
+            Number of folds of k-fold cross-validation
+        num_workers: int
+            Number of trials run at once. Defaults to the number of cores divided by threads_per_trial
+        threads_per_trial: int
+            CPU threads of each trial. Defaults to the number of cores divided by num_workers, or 4 if neither is set
+        output_path: str
+            CSV file the trials are written to as they finish; the summary goes next to it
+        seed: int
+            The random seed of every trial
+
+    Returns:
+        results: pd.DataFrame
+            One row per trial
+
+    Raises:
+        ValueError: If the cross-validation scheme is unknown or has fewer than two folds
+    '''
+    if cv not in ("kfold", "loso"):
+        raise ValueError(f"Unknown cross-validation '{cv}', expected 'kfold' or 'loso'")
+    file_paths = list(file_paths)
+    num_folds = len(file_paths) if cv == "loso" else num_folds
+    if num_folds < 2:
+        raise ValueError(f"Cross-validation needs at least two folds, got {num_folds}")
+
+    # Share the CPU cores between the trials
+    num_cores = os.cpu_count() or 1
+    threads_per_trial = threads_per_trial or (max(1, num_cores // num_workers) if num_workers else min(4, num_cores))
+    num_workers = num_workers or max(1, num_cores // threads_per_trial)
+
+    # The classes of all recordings, in one label order for every trial
+    class_names = sorted(set().union(*(pd.read_csv(file_path, usecols=['Class'])['Class'].astype(str).unique() for file_path in file_paths)))
+
+    # One task per configuration and fold, so the pool balances the work at the finest grain
+    tasks = [{'parameters': dict(DEFAULT_PARAMETERS, **configuration), 'fold': fold, 'cv': cv, 'num_folds': num_folds,
+              'file_paths': file_paths, 'class_names': class_names, 'seed': seed}
+             for configuration in configurations for fold in range(num_folds)]
+    print(f"{len(configurations)} configurations x {num_folds} folds = {len(tasks)} trials, "
+          f"{num_workers} workers x {threads_per_trial} threads")
+
+    rows = []
+    # Spawn the workers: TensorFlow does not survive a fork
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker, initargs=(threads_per_trial,)) as executor:
+        futures = [executor.submit(run_trial, task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Searching", colour="green", unit="trials"):
+            rows.append(future.result())
+            if rows[-1]['error']:
+                print(f"Trial of {rows[-1]['model']} on fold {rows[-1]['fold']} failed: {rows[-1]['error']}")
+            if output_path:
+                pd.DataFrame(rows).to_csv(output_path, index=False)
+
+    results = pd.DataFrame(rows)
+    summary = summarize_results(results)
+    if output_path:
+        summary.to_csv(f"{os.path.splitext(output_path)[0]}_summary.csv", index=False)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cross-validate and search hyperparameters over merged recordings.")
+    parser.add_argument("file_paths", nargs='+', help="Merged recordings (one per session).")
+    parser.add_argument("--cv", choices=("kfold", "loso"), default="kfold", help="K-fold or leave-one-session-out cross-validation.")
+    parser.add_argument("--folds", type=int, default=5, help="Number of folds of k-fold cross-validation.")
+    parser.add_argument("--search", choices=("grid", "random"), default="grid", help="Try every combination or random ones.")
+    parser.add_argument("--trials", type=int, default=20, help="Number of configurations of a random search.")
+    parser.add_argument("--model", nargs='+', default=[DEFAULT_PARAMETERS['model']], help="Architectures (see models.model_zoo.MODELS).")
+    parser.add_argument("--window-size", type=int, nargs='+', default=[DEFAULT_PARAMETERS['window_size']], help="Window sizes in samples.")
+    parser.add_argument("--overlap", type=float, nargs='+', default=[DEFAULT_PARAMETERS['overlap']], help="Overlaps between windows.")
+    parser.add_argument("--learning-rate", type=float, nargs='+', default=[DEFAULT_PARAMETERS['learning_rate']], help="Learning rates.")
+    parser.add_argument("--batch-size", type=int, nargs='+', default=[DEFAULT_PARAMETERS['batch_size']], help="Batch sizes.")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_PARAMETERS['epochs'], help="Training epochs of each trial.")
+    parser.add_argument("--grid", action="store_true", help="Train on spatial grids instead of compact (window, channels) windows.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of trials run at once.")
+    parser.add_argument("--threads-per-trial", type=int, default=None, help="CPU threads of each trial.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the search and of every trial.")
+    parser.add_argument("--output", type=str, default="search.csv", help="CSV file of the trials; the summary is written next to it.")
+    args = parser.parse_args()
+
+    space = {'model': args.model, 'window_size': args.window_size, 'overlap': args.overlap, 'learning_rate': args.learning_rate,
+             'batch_size': args.batch_size, 'epochs': [args.epochs], 'compact': [not args.grid]}
+    configurations = grid_search(space) if args.search == "grid" else random_search(space, args.trials, args.seed)
+    results = run_search(args.file_paths, configurations, args.cv, args.folds, args.workers, args.threads_per_trial, args.output, args.seed)
+    print(summarize_results(results).to_string(index=False))
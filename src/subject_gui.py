@@ -1,14 +1,22 @@
-import dearpygui.dearpygui as dpg
-from gui.gui import GUI
 import argparse
+import csv
 import sys
-from typing import Iterable
+
+from gui.experiment_display import connect, get_icon_path, run_display
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description="Run the data collection experiment.")
 parser.add_argument("--classes", nargs='+', action='append', help="Classes to collect data for.")
 #parser.add_argument("--skip_instructions", action="store_true", help="Skip instructions screen.")
 parser.add_argument("--cue-period", type=float, default=5.0, help="Amount of time spent in each cue.")
+parser.add_argument("--trials", type=int, default=1, help="Number of times each class is cued.")
+parser.add_argument("--shuffle", action="store_true", help="Randomize the order of the classes within each trial.")
+parser.add_argument("--rest", type=float, nargs=2, default=[0.0, 0.0], metavar=("MIN", "MAX"), help="Random rest period after each cue, in seconds.")
+parser.add_argument("--seed", type=int, default=None, help="Seed of the random order and rest periods.")
+parser.add_argument("--connect", type=str, default=None, help="Address of the main GUI; the display then runs the experiments it sends.")
+parser.add_argument("--width", type=int, default=800, help="Width of the window.")
+parser.add_argument("--height", type=int, default=600, help="Height of the window.")
+parser.add_argument("--icon", type=str, default=None, help="Path to the window icon.")
 
 # Parse the arguments
 try:
@@ -23,12 +31,23 @@ except:
 def main(args: argparse.Namespace) -> None:
     '''
     Main function to run the application.
+
+    With --connect, the display stays open and runs the experiments sent by the main GUI. Otherwise a single
+    experiment is run and its cues are written to class_timestamps.csv.
     '''
-    print(f'args @ main: {args}')
-    app = GUI()
-    app.setup_subject_gui(args)
-    app.run()
-    
+    icon_path = args.icon or get_icon_path()
+    if args.connect is not None:
+        run_display(connect(args.connect), viewport_width=args.width, viewport_height=args.height, icon_path=icon_path)
+        return
+
+    classes = args.classes[0] if args.classes else ["Move", "Relax"]
+    options = {'num_trials': args.trials, 'shuffle': args.shuffle, 'rest_range': tuple(args.rest), 'seed': args.seed}
+    cues = run_display(None, classes, args.cue_period, options, args.width, args.height, icon_path)
+    with open("class_timestamps.csv", 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Class", "Timestamp"])
+        writer.writerows(cues)
+
 
 if __name__ == '__main__':
-    main(args)
\ No newline at end of file
+    main(args)
@@ -1,4 +1,6 @@
+import argparse
 from gui.gui import GUI
+from models.model import configure_threads
 import data.utils as utils
 
 
@@ -6,6 +8,14 @@ def main():
     '''
     Main function to run the application.
     '''
+    parser = argparse.ArgumentParser(description="Super Mega Mind Reader 3000")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="Threads used inside one TensorFlow operation (0: one per core).")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="TensorFlow operations run concurrently (0: TensorFlow default).")
+    args = parser.parse_args()
+
+    # The thread pools must be set before the model is created
+    configure_threads(args.intra_op_threads, args.inter_op_threads)
+
     app = GUI()
     app.setup_gui()
     app.run()
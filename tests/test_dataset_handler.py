@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.dataset_handler import DatasetHandler
+from data.packed_dataset import PackedDataset
+
+
+def make_recording(path, num_samples=3000, num_channels=8):
+    '''
+    A merged recording with class blocks of uneven length, so windows of a class span several chunks
+    '''
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(scale=50.0, size=(num_samples, num_channels)), columns=[f'Channel {n}' for n in range(1, num_channels + 1)])
+    df['Timestamp'] = 1.7e9 + np.arange(num_samples) / 250.0
+    df['Class'] = np.where((np.arange(num_samples) // 700) % 2 == 0, "Relax", "Move")
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def sorted_windows(file_path):
+    dataset = PackedDataset(file_path)
+    order = np.lexsort((dataset.offsets, dataset.labels))
+    return dataset, np.asarray(dataset.windows)[order], dataset.labels[order], dataset.offsets[order]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_streaming_matches_in_memory(tmp_path, compact):
+    file_path = make_recording(tmp_path / "recording.csv")
+    handler = DatasetHandler()
+
+    in_memory_path = handler.preprocess_oneill(pd.read_csv(file_path), 64, 0.25, str(tmp_path / "in_memory"), output_format="packed",
+                                               session="recording.csv", compact=compact)
+    # A chunk size that is not a multiple of the step, so windows span chunk edges
+    streaming_path = handler.preprocess_oneill_streaming(file_path, 64, 0.25, str(tmp_path / "streaming"), chunk_size=157,
+                                                         output_format="packed", compact=compact)
+
+    in_memory, in_memory_windows, in_memory_labels, in_memory_offsets = sorted_windows(in_memory_path)
+    streaming, streaming_windows, streaming_labels, streaming_offsets = sorted_windows(streaming_path)
+    assert streaming.dtype == in_memory.dtype
+    assert streaming.class_names == in_memory.class_names
+    assert len(streaming_windows) == len(in_memory_windows) > 0
+    np.testing.assert_array_equal(streaming_labels, in_memory_labels)
+    np.testing.assert_array_equal(streaming_offsets, in_memory_offsets)
+    # Batches of a different size can sum in a different order, so allow float64 rounding
+    np.testing.assert_allclose(streaming_windows, in_memory_windows, rtol=0, atol=1e-12)
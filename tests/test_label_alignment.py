@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from data.label_alignment import align_labels, label_by_markers, label_dataset, labels_from_markers
+
+
+def test_align_labels_intervals():
+    cue_timestamps = np.array([1.0, 2.0, 3.0])
+    sample_timestamps = np.array([0.5, 1.0, 1.5, 2.0, 2.999, 3.0, 3.5, 4.0])
+
+    np.testing.assert_array_equal(align_labels(sample_timestamps, cue_timestamps), [-1, 0, 0, 1, 1, 2, 2, 2])
+    # The last cue ends at end_timestamp, exclusive
+    np.testing.assert_array_equal(align_labels(sample_timestamps, cue_timestamps, end_timestamp=4.0), [-1, 0, 0, 1, 1, 2, 2, -1])
+
+
+def test_label_dataset_by_interval():
+    sensor_df = pd.DataFrame({'Channel 1': np.arange(8.0), 'Timestamp': [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0]})
+    # Unsorted cues from two marker files
+    class_dfs = [pd.DataFrame({'Class': ["Relax", "Move"], 'Timestamp': [3.0, 1.0]}),
+                 pd.DataFrame({'Class': ["Instructions"], 'Timestamp': [2.0]})]
+
+    labeled = label_dataset(sensor_df, class_dfs)
+
+    assert labeled['Channel 1'].tolist() == [1.0, 2.0, 5.0, 6.0, 7.0]
+    assert labeled['Class'].astype(str).tolist() == ["Move", "Move", "Relax", "Relax", "Relax"]
+
+
+def test_label_dataset_parses_datetime_strings():
+    sensor_df = pd.DataFrame({'Timestamp': pd.to_datetime(["2024-01-01 00:00:01", "2024-01-01 00:00:03"]).astype('int64') / 1e9})
+    class_df = pd.DataFrame({'Class': ["Move", "Relax"], 'Timestamp': ["2024-01-01 00:00:00", "2024-01-01 00:00:02"]})
+
+    assert label_dataset(sensor_df, class_df)['Class'].astype(str).tolist() == ["Move", "Relax"]
+
+
+def test_labels_from_markers_in_chunks_matches_whole():
+    markers = np.zeros(30)
+    markers[[0, 9, 10, 19, 29]] = [1, 2, 3, 2, 1]
+    whole = labels_from_markers(markers)
+
+    chunks = []
+    previous_code = 0
+    for start in range(0, len(markers), 10):
+        codes = labels_from_markers(markers[start: start + 10], previous_code)
+        previous_code = int(codes[-1])
+        chunks.append(codes)
+    np.testing.assert_array_equal(np.concatenate(chunks), whole)
+
+
+def test_labels_from_markers_before_first_marker():
+    np.testing.assert_array_equal(labels_from_markers([0, 0, 2, 0], previous_code=5), [5, 5, 2, 2])
+
+
+def test_label_by_markers_drops_unknown_and_excluded_codes():
+    sensor_df = pd.DataFrame({'Channel 1': np.arange(6.0)})
+    codes = np.array([0, 1, 2, 2, 3, 9])
+
+    labeled = label_by_markers(sensor_df, codes, {1: "Instructions", 2: "Move", 3: "Relax"})
+
+    assert labeled['Channel 1'].tolist() == [2.0, 3.0, 4.0]
+    assert labeled['Class'].astype(str).tolist() == ["Move", "Move", "Relax"]
@@ -0,0 +1,37 @@
+import numpy as np
+
+from data.ring_buffer import RingBuffer
+from models.live_inference import LivePredictor
+
+NUM_CHANNELS = 8
+WINDOW_SIZE = 16
+
+
+class FailingModel:
+    '''
+    A compact model that raises on every call
+    '''
+    input_shape = (None, WINDOW_SIZE, NUM_CHANNELS)
+
+    def __call__(self, inputs, training=False):
+        raise RuntimeError("inference failed")
+
+
+def test_failing_model_stops_the_predictor():
+    ring_buffer = RingBuffer(1000, NUM_CHANNELS)
+    errors = []
+    predictor = LivePredictor(FailingModel(), ring_buffer, channels=range(NUM_CHANNELS), window_size=WINDOW_SIZE, stride=4,
+                              on_error=lambda error, stopped: errors.append((error, stopped)), max_failures=3)
+    predictor.start()
+    for _ in range(10):
+        ring_buffer.write(np.random.default_rng(0).normal(size=(WINDOW_SIZE, NUM_CHANNELS)))
+        predictor.thread.join(timeout=0.2)
+        if not predictor.is_running():
+            break
+
+    assert not predictor.is_running()
+    assert predictor.num_failures == 3
+    assert [stopped for _, stopped in errors] == [False, False, True]
+    assert isinstance(predictor.last_error, RuntimeError)
+    assert "3 failed predictions" in predictor.report()
+    predictor.stop()
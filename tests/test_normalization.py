@@ -0,0 +1,52 @@
+import numpy as np
+from scipy.stats import zscore
+
+from data.normalization import RunningNormalizer, normalize_windows
+
+
+def railed_windows():
+    '''
+    Random windows on the Cyton grid, with one channel stuck at a constant value as a railed or disconnected electrode
+    '''
+    windows = np.random.default_rng(0).normal(size=(4, 64, 10, 11))
+    windows[:, :, 3, 4] = 187500.02
+    return windows
+
+
+def test_normalize_windows_matches_zscore():
+    windows = railed_windows()
+    np.testing.assert_array_equal(normalize_windows(windows), np.nan_to_num(zscore(windows, axis=1)))
+
+
+def test_constant_channel_is_zero():
+    normalized = normalize_windows(railed_windows())
+    assert np.all(normalized[:, :, 3, 4] == 0.0)
+
+
+def test_integer_windows():
+    windows = np.arange(2 * 8 * 3).reshape(2, 8, 3)
+    windows[1, :, 2] = 7
+    np.testing.assert_array_equal(normalize_windows(windows), np.nan_to_num(zscore(windows.astype(np.float64), axis=1)))
+
+
+def test_running_normalizer_matches_offline_on_constant_channel():
+    rng = np.random.default_rng(1)
+    samples = rng.normal(size=(300, 8))
+    samples[:, 5] = 187500.02
+
+    for mode in ("window", "sliding"):
+        normalizer = RunningNormalizer(mode, window_size=64)
+        for chunk in np.array_split(samples, 17):
+            normalizer.update(chunk)
+        live = normalizer.normalize_window(samples[-64:])
+        offline = normalize_windows(samples[np.newaxis, -64:])[0]
+        np.testing.assert_allclose(live, offline, rtol=0, atol=1e-12)
+        assert np.all(live[:, 5] == 0.0)
+
+
+def test_running_normalizer_ewm_constant_channel_is_zero():
+    samples = np.random.default_rng(2).normal(size=(200, 4))
+    samples[:, 1] = 187500.02
+    normalizer = RunningNormalizer("ewm", window_size=64)
+    normalizer.update(samples)
+    assert np.all(normalizer.normalize_window(samples[-64:])[:, 1] == 0.0)
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from models.prediction_server import PredictionClient, PredictionServer, get_address
+
+WINDOW_SHAPE = (16, 8)
+
+
+class MeanBackend:
+    '''
+    A compact backend predicting the mean of each window and its complement
+    '''
+    input_shape = (None,) + WINDOW_SHAPE
+    name = "mean"
+
+    def __call__(self, windows):
+        means = windows.mean(axis=(1, 2))
+        return np.stack([means, 1 - means], axis=1)
+
+
+@pytest.fixture
+def server():
+    server = PredictionServer(MeanBackend(), get_address(f"smmr_test_{os.getpid()}"), max_wait=0.001)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_predictions_round_trip(server):
+    windows = np.random.default_rng(0).normal(size=(3,) + WINDOW_SHAPE).astype(np.float32)
+    client = PredictionClient(server.address)
+    try:
+        assert client.input_shape == (None,) + WINDOW_SHAPE
+        np.testing.assert_allclose(client.predict(windows), MeanBackend()(windows), rtol=1e-6)
+        assert client.get_stats()['windows'] == 3
+    finally:
+        client.close()
+
+
+def test_wrong_window_shape_is_rejected(server):
+    client = PredictionClient(server.address)
+    try:
+        with pytest.raises(RuntimeError, match="expected windows of shape"):
+            client.predict(np.zeros((1, 32, 8), dtype=np.float32))
+    finally:
+        client.close()
+
+
+def test_stopped_server_refuses_clients(server):
+    server.stop()
+    with pytest.raises(ConnectionError):
+        PredictionClient(server.address)
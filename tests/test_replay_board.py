@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from data import replay_board
+from data.replay_board import ReplayBoard
+
+NUM_COLUMNS = 12
+MARKER_COLUMN = 9
+TIMESTAMP_COLUMN = 10
+SAMPLING_RATE = 250
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    A controllable replacement of time.monotonic for the replay board
+    '''
+    now = [0.0]
+    monkeypatch.setattr(replay_board.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def make_board(keep_markers=False):
+    samples = np.zeros((100, NUM_COLUMNS))
+    samples[:, 0] = np.arange(100)
+    samples[[10, 40], MARKER_COLUMN] = [1, 2]
+    board = ReplayBoard(samples, SAMPLING_RATE, timestamp_channel=TIMESTAMP_COLUMN, marker_channel=MARKER_COLUMN,
+                        keep_markers=keep_markers)
+    board.prepare_session()
+    board.start_stream()
+    return board
+
+
+def test_recorded_markers_are_cleared(clock):
+    board = make_board()
+    clock[0] = 20 / SAMPLING_RATE
+    board.insert_marker(3)
+    clock[0] = 100 / SAMPLING_RATE
+    data = board.get_board_data()
+
+    assert data.shape == (NUM_COLUMNS, 100)
+    assert np.flatnonzero(data[MARKER_COLUMN]).tolist() == [20]
+    assert data[MARKER_COLUMN, 20] == 3
+
+
+def test_recorded_markers_can_be_kept(clock):
+    board = make_board(keep_markers=True)
+    clock[0] = 20 / SAMPLING_RATE
+    board.insert_marker(3)
+    clock[0] = 100 / SAMPLING_RATE
+    data = board.get_board_data()
+
+    assert np.flatnonzero(data[MARKER_COLUMN]).tolist() == [10, 20, 40]
@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.label_alignment import label_by_markers, label_dataset, labels_from_markers
+from data.session_recorder import HEADER, RECORD, SAMPLE_DTYPE, SessionLog, SessionRecorder, recover
+
+NUM_COLUMNS = 12
+MARKER_COLUMN = 9
+TIMESTAMP_COLUMN = 10
+RECORD_SAMPLES = 50
+
+
+def make_samples(num_samples, markers=None):
+    '''
+    Board-like samples: package number, 8 channels, marker, timestamp and one more column
+    '''
+    rng = np.random.default_rng(0)
+    samples = rng.normal(size=(num_samples, NUM_COLUMNS)).round(3)
+    samples[:, 0] = np.arange(num_samples)
+    samples[:, MARKER_COLUMN] = 0
+    samples[:, TIMESTAMP_COLUMN] = 1000 + np.arange(num_samples) / 250
+    for position, code in (markers or {}).items():
+        samples[position, MARKER_COLUMN] = code
+    return samples
+
+
+def write_log(path, samples, metadata=None):
+    with SessionRecorder(str(path), NUM_COLUMNS, metadata=metadata, fsync=False) as recorder:
+        for start in range(0, len(samples), RECORD_SAMPLES):
+            recorder.append(samples[start: start + RECORD_SAMPLES])
+    return str(path)
+
+
+def record_offset(log_path, record):
+    return SessionLog(log_path).index['offset'][record]
+
+
+def test_round_trip(tmp_path):
+    samples = make_samples(4 * RECORD_SAMPLES)
+    log = SessionLog(write_log(tmp_path / "session.smmrlog", samples))
+    assert log.num_samples == len(samples)
+    np.testing.assert_array_equal(log.to_array(), samples)
+
+
+def test_truncated_record_is_dropped(tmp_path):
+    samples = make_samples(3 * RECORD_SAMPLES)
+    log_path = write_log(tmp_path / "session.smmrlog", samples)
+
+    # Cut the last record in the middle of its payload, as a crash during a write would
+    cut = record_offset(log_path, 2) + RECORD.size + 100
+    with open(log_path, 'r+b') as file:
+        file.truncate(cut)
+
+    # The stale index no longer matches the file, so the log is scanned
+    log = SessionLog(log_path)
+    assert log.num_samples == 2 * RECORD_SAMPLES
+    np.testing.assert_array_equal(log.to_array(), samples[: 2 * RECORD_SAMPLES])
+
+    assert recover(log_path) == 2 * RECORD_SAMPLES
+    assert os.path.getsize(log_path) == record_offset(log_path, 1) + RECORD.size + RECORD_SAMPLES * NUM_COLUMNS * SAMPLE_DTYPE.itemsize
+    np.testing.assert_array_equal(SessionLog(log_path).to_array(), samples[: 2 * RECORD_SAMPLES])
+
+
+def test_truncated_record_header_is_dropped(tmp_path):
+    samples = make_samples(2 * RECORD_SAMPLES)
+    log_path = write_log(tmp_path / "session.smmrlog", samples)
+    with open(log_path, 'ab') as file:
+        file.write(b"\x01\x02\x03")
+
+    assert recover(log_path) == 2 * RECORD_SAMPLES
+    np.testing.assert_array_equal(SessionLog(log_path).to_array(), samples)
+
+
+def test_corrupted_crc_stops_the_scan(tmp_path):
+    samples = make_samples(3 * RECORD_SAMPLES)
+    log_path = write_log(tmp_path / "session.smmrlog", samples)
+
+    # Flip a byte in the payload of the second record
+    position = record_offset(log_path, 1) + RECORD.size + 10
+    with open(log_path, 'r+b') as file:
+        file.seek(position)
+        byte = file.read(1)
+        file.seek(position)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+    assert recover(log_path) == RECORD_SAMPLES
+    log = SessionLog(log_path)
+    assert len(log.index) == 1
+    np.testing.assert_array_equal(log.to_array(), samples[:RECORD_SAMPLES])
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    samples = make_samples(3 * RECORD_SAMPLES)
+    log_path = write_log(tmp_path / "session.smmrlog", samples)
+    os.remove(f"{log_path}.idx")
+
+    log = SessionLog(log_path)
+    assert log.num_samples == len(samples)
+    np.testing.assert_array_equal(log.to_array(), samples)
+
+
+def test_not_a_session_log(tmp_path):
+    path = tmp_path / "other.smmrlog"
+    path.write_bytes(b"\0" * HEADER.size)
+    with pytest.raises(ValueError):
+        SessionLog(str(path))
+
+
+def in_memory_marked(samples, marker_classes):
+    '''
+    Label the whole recording at once, as the chunked export should
+    '''
+    columns = [f'Channel {n}' for n in range(1, 9)] + ['Timestamp']
+    dataset = pd.DataFrame(samples[:, list(range(1, 9)) + [TIMESTAMP_COLUMN]], columns=columns)
+    codes = labels_from_markers(samples[:, MARKER_COLUMN])
+    return label_by_markers(dataset, codes, marker_classes)
+
+
+@pytest.mark.parametrize("marker_position", [RECORD_SAMPLES - 1, RECORD_SAMPLES, 2 * RECORD_SAMPLES])
+def test_export_marked_carries_markers_across_chunks(tmp_path, marker_position):
+    # Every chunk holds one record, so the markers fall on the last or the first sample of a chunk
+    marker_classes = {1: "Instructions", 2: "Move", 3: "Relax"}
+    samples = make_samples(4 * RECORD_SAMPLES, markers={10: 1, marker_position: 2, 3 * RECORD_SAMPLES: 3})
+    log_path = write_log(tmp_path / "session.smmrlog", samples, metadata={'marker_classes': marker_classes, 'marker_channel': MARKER_COLUMN})
+
+    exported = SessionLog(log_path).export_marked(str(tmp_path / "marked.csv"), chunk_size=RECORD_SAMPLES, timestamp_column=TIMESTAMP_COLUMN)
+
+    expected = in_memory_marked(samples, marker_classes)
+    assert set(expected['Class']) == {"Move", "Relax"}
+    with open(exported) as file:
+        assert file.read() == expected.to_csv(index=False)
+
+
+def test_export_merged_matches_in_memory_labeling(tmp_path):
+    samples = make_samples(4 * RECORD_SAMPLES)
+    timestamps = samples[:, TIMESTAMP_COLUMN]
+    # Cues exactly on a sample, between samples and on the first sample of a chunk
+    class_df = pd.DataFrame({'Class': ["Instructions", "Move", "Relax", "Move"],
+                             'Timestamp': [timestamps[5], timestamps[20] + 0.001, timestamps[RECORD_SAMPLES], timestamps[3 * RECORD_SAMPLES]]})
+    log_path = write_log(tmp_path / "session.smmrlog", samples)
+
+    exported = SessionLog(log_path).export_merged(str(tmp_path / "merged.csv"), class_df, chunk_size=RECORD_SAMPLES,
+                                                 timestamp_column=TIMESTAMP_COLUMN)
+
+    columns = [f'Channel {n}' for n in range(1, 9)] + ['Timestamp']
+    dataset = pd.DataFrame(samples[:, list(range(1, 9)) + [TIMESTAMP_COLUMN]], columns=columns)
+    expected = label_dataset(dataset, class_df)
+    with open(exported) as file:
+        assert file.read() == expected.to_csv(index=False)